@@ -1,77 +1,248 @@
 
 from __future__ import print_function
 
-import boto.ec2
+from boto.ec2.volume import Volume
 from datetime import datetime
+import logging
 import math
-from price import AWSPricingStore
+import time
+from cost import timeline_cost, to_microseconds
+from describe import DescribeInstancesReader, DescribeVolumesReader, parse_iso8601
+from metrics import run_metrics
+from price import PriceNotFoundError, shared_pricing_store
+from regions import connect_ec2
+from throttle import shared_throttle, throttle_connection
+
+try:
+    _intern_str = intern
+except NameError:
+    from sys import intern as _intern_str
+
+# the largest pages EC2 will return for each describe call
+INSTANCE_PAGE_SIZE = 1000
+VOLUME_PAGE_SIZE = 500
 
 
 class AWS(object):
 
     def __init__(self, aws_access_key, aws_secret_key,
-                 aws_region):
-
-        self._connection = boto.ec2.connect_to_region(aws_region,
-                                                      aws_access_key_id=aws_access_key,
-                                                      aws_secret_access_key=aws_secret_key)
+                 aws_region, price_store=None, fast_ingest=False, inventory_cache=None,
+                 api_rate=None, connection=None):
+
+        if connection is None:
+            connection = connect_ec2(aws_region, aws_access_key, aws_secret_key)
+        # every call for this account and region is paced and retried
+        # when EC2 throttles it
+        self._connection = throttle_connection(connection,
+                                               shared_throttle(aws_region, aws_access_key, api_rate))
         self._region = aws_region
-        self._price_store = AWSPricingStore()
+        self._price_store = price_store or shared_pricing_store()
+        # decode the raw describe responses ourselves rather than
+        # building full boto objects
+        self._fast_ingest = fast_ingest
+        # optional InventoryCache, only used for unfiltered listings
+        self._inventory_cache = inventory_cache
     """Retreives a list of instances
 
+    The state and tag filters are applied by EC2 and results are fetched
+    a page at a time, so only one page is held in memory. With an
+    inventory cache and no tag filter, a fresh enough cached copy of the
+    region is used instead.
+
     :param state one of running, terminated, stopped
+    :param tags optional dict of tag name to value an instance must have
+    :param page_size number of instances to request per call (5 - 1000)
     :returns: AWSInstance
 
     """
-    def instances(self, state="running"):
-
-        reservations = self._connection.get_all_reservations()
-
-
-        for reservation in reservations:
-
-            for instance in reservation.instances:
-
-                if instance.state == state:
-                    launchedAtUtc = self._parse_date_time(instance.launch_time)
-                    cost_per_hour = self._price_store.instance_cost_per_hour(self._region, instance.instance_type)
-
-                    yield AWSInstance(identifier=instance.id,
-                                      launchedAtUtc=launchedAtUtc,
-                                      aws_region=self._region,
-                                      aws_instance_type=instance.instance_type,
-                                      keyname=instance.key_name,
-                                      cost_per_hour=cost_per_hour,
-                                      tags=instance.tags)
+    def instances(self, state="running", tags=None, page_size=INSTANCE_PAGE_SIZE):
+
+        if self._inventory_cache is not None and not tags:
+            records = self._inventory_cache.instances(self._region, state,
+                                                      lambda: self._instance_records(state, None, page_size))
+        else:
+            records = self._instance_records(state, tags, page_size)
+
+        count = 0
+        not_found = 0
+
+        for instance in records:
+
+            launchedAtUtc = self._parse_date_time(instance.launch_time)
+
+            try:
+                cost_per_hour = self._price_store.instance_cost_per_hour(self._region, instance.instance_type)
+            except PriceNotFoundError:
+                logging.warning("Price not found for {} ({} in {} running since {})".format(instance.id,
+                                                                                            instance.instance_type,
+                                                                                            self._region,
+                                                                                            launchedAtUtc))
+                not_found += 1
+                continue
+
+            count += 1
+            yield AWSInstance(identifier=instance.id,
+                              launchedAtUtc=launchedAtUtc,
+                              aws_region=self._region,
+                              aws_instance_type=instance.instance_type,
+                              keyname=instance.key_name,
+                              cost_per_hour=cost_per_hour,
+                              tags=instance.tags,
+                              price_timeline=self._price_store.instance_price_timeline(self._region,
+                                                                                       instance.instance_type))
+
+        run_metrics().record('instances', self._region, items=count, price_not_found=not_found)
 
     """Retreives a list of volumes
 
-    :param state one of running, terminated, stopped
+    Filters are applied by EC2 and results are fetched a page at a time.
+    With an inventory cache and no tag filter, a fresh enough cached copy
+    of the region is used instead.
+
+    :param tags optional dict of tag name to value a volume must have
+    :param page_size number of volumes to request per call (5 - 500)
     :returns: AWSVolume
 
     """
-    def volumes(self):
+    def volumes(self, tags=None, page_size=VOLUME_PAGE_SIZE):
+
+        if self._inventory_cache is not None and not tags:
+            records = self._inventory_cache.volumes(self._region,
+                                                    lambda: self._volume_records(None, page_size))
+        else:
+            records = self._volume_records(tags, page_size)
 
-        volumes = self._connection.get_all_volumes()
+        count = 0
+        not_found = 0
 
-        for volume in volumes:
+        for volume in records:
             createdAtUtc = self._parse_date_time(volume.create_time)
-            cost_per_gb, iops_cost = self._price_store.volume_costs(self._region, volume.type)
 
+            try:
+                cost_per_gb, iops_cost = self._price_store.volume_costs(self._region, volume.type)
+            except PriceNotFoundError:
+                logging.warning("Price not found for {} ({} in {})".format(volume.id,
+                                                                         volume.type,
+                                                                         self._region))
+                not_found += 1
+                continue
+
+            count += 1
             yield AWSVolume(volume.id, volume.size, volume.type, self._region, volume.iops, createdAtUtc, cost_per_gb, iops_cost)
 
+        run_metrics().record('volumes', self._region, items=count, price_not_found=not_found)
+
+    def _instance_records(self, state, tags, page_size):
+        filters = self._tag_filters(tags)
+        filters['instance-state-name'] = state
+
+        for reservations in self._pages(self._describe_instances, 'DescribeInstances',
+                                        filters=filters, max_results=page_size):
+            for reservation in reservations:
+                for instance in reservation.instances:
+                    yield instance
+
+    def _volume_records(self, tags, page_size):
+        for volumes in self._pages(self._describe_volumes, 'DescribeVolumes',
+                                   filters=self._tag_filters(tags), max_results=page_size):
+            for volume in volumes:
+                yield volume
+
+    def _pages(self, describe, action, **kwargs):
+        next_token = None
+        metrics = run_metrics()
+
+        while True:
+            # with fast ingest the page is decoded as it is read, after
+            # this only covers the request and the response headers
+            start = time.time()
+            page = describe(next_token=next_token, **kwargs)
+            metrics.record(action, self._region, time.time() - start, calls=1)
+            yield page
+
+            next_token = page.next_token
+            if not next_token:
+                return
+
+    def _describe_instances(self, filters=None, max_results=None, next_token=None):
+        if self._fast_ingest:
+            return DescribeInstancesReader(self._describe('DescribeInstances', filters, max_results, next_token))
+
+        return self._connection.get_all_reservations(filters=filters, max_results=max_results,
+                                                     next_token=next_token)
+
+    def _describe_volumes(self, filters=None, max_results=None, next_token=None):
+        if self._fast_ingest:
+            return DescribeVolumesReader(self._describe('DescribeVolumes', filters, max_results, next_token))
+
+        # boto's get_all_volumes does not expose paging
+        params = self._describe_params(filters, max_results, next_token)
+        return self._connection.get_list('DescribeVolumes', params,
+                                         [('item', Volume)], verb='POST')
+
+    def _describe(self, action, filters, max_results, next_token):
+        params = self._describe_params(filters, max_results, next_token)
+        response = self._connection.make_request(action, params, verb='POST')
+
+        if response.status != 200:
+            raise self._connection.ResponseError(response.status, response.reason, response.read())
+
+        return response
+
+    def _describe_params(self, filters, max_results, next_token):
+        params = {}
+        if filters:
+            self._connection.build_filter_params(params, filters)
+        if max_results is not None:
+            params['MaxResults'] = max_results
+        if next_token:
+            params['NextToken'] = next_token
+        return params
+
+    def _tag_filters(self, tags):
+        filters = {}
+        for name, value in (tags or {}).items():
+            filters['tag:{}'.format(name)] = value
+        return filters
+
     def _parse_date_time(self, datetime_str):
         # example - 2016-01-13T15:42:25.000Z
+        if self._fast_ingest:
+            return parse_iso8601(datetime_str)
         return datetime.strptime(datetime_str, '%Y-%m-%dT%H:%M:%S.%fZ')
 
 
+# regions, types, keynames and tag keys repeat across the whole fleet and
+# there are only so many of them, so a single copy of each is kept for
+# good and shared by every resource
+_interned = {}
+
+
+def _intern(value):
+    if value is None:
+        return None
+    return _interned.setdefault(value, value)
+
+
+def _intern_tags(tags):
+    # tag values can be unique e.g. a Name or a build id, so they are only
+    # interned by python, which lets go of a value no resource holds
+    if not tags:
+        return tags
+    return dict((_intern(name), _intern_str(value) if type(value) is str else value)
+                for name, value in tags.items())
+
+
 class AWSVolume(object):
 
+    __slots__ = ('identifier', 'size', 'type', 'aws_region', 'provisioned_iops',
+                 'createdAtUtc', 'cost_per_gb', 'iops_cost', 'cost')
+
     def __init__(self, identifier, size, volume_type, aws_region, iops, createdAtUtc, cost_per_gb, iops_cost):
         self.identifier = identifier
         self.size = size
-        self.type = volume_type
-        self.aws_region = aws_region,
+        self.type = _intern(volume_type)
+        self.aws_region = _intern(aws_region)
         self.provisioned_iops = iops
         self.createdAtUtc = createdAtUtc
         self.cost_per_gb = cost_per_gb
@@ -133,28 +304,49 @@ class AWSVolume(object):
 
 class AWSInstance(object):
 
+    __slots__ = ('identifier', 'cost_per_hour', 'launchedAtUtc', 'aws_region',
+                 'aws_instance_type', 'keyname', 'tags', 'price_timeline', 'cost')
+
     def __init__(self, identifier, launchedAtUtc, aws_region,
-                 aws_instance_type, keyname, cost_per_hour, tags=[]):
+                 aws_instance_type, keyname, cost_per_hour, tags=[], price_timeline=None):
         self.identifier = identifier
         self.cost_per_hour = cost_per_hour
+        # past price changes, shared by every instance of the same region and type
+        self.price_timeline = price_timeline
         self.launchedAtUtc = launchedAtUtc
-        self.aws_region = aws_region
-        self.aws_instance_type = aws_instance_type
-        self.keyname = keyname
-        self.tags = tags
+        self.aws_region = _intern(aws_region)
+        self.aws_instance_type = _intern(aws_instance_type)
+        self.keyname = _intern(keyname)
+        self.tags = _intern_tags(tags)
         self.cost = 0.0
 
-    def calculate_cost(self):
+    def calculate_cost(self, now=None):
         """Given a cost per hour will calculate the total cost since creation.
 
+        When the price changed since launch each hour is charged at the
+        price of the time.
+
         Note : total cost is rounded up to the nearest completed hour.
         """
-        elapsed_hours_since_creation = self._total_hours_since_creation()
+        now = now or datetime.utcnow()
+        if self.price_timeline is not None:
+            self.cost = timeline_cost(self.price_timeline, to_microseconds(self.launchedAtUtc),
+                                      to_microseconds(now))
+            return
+
+        elapsed_hours_since_creation = self._total_hours_since_creation(now)
         self.cost = self.cost_per_hour * elapsed_hours_since_creation
         self.cost_per_hour = self.cost_per_hour
 
-    def _total_hours_since_creation(self):
-        now = datetime.utcnow()
+    def copy(self):
+        """:returns: a new AWSInstance with the same fields, which can be
+        costed again without changing this one"""
+        instance = AWSInstance.__new__(AWSInstance)
+        for name in self.__slots__:
+            setattr(instance, name, getattr(self, name))
+        return instance
+
+    def _total_hours_since_creation(self, now):
         delta_since_last_update = now - self.launchedAtUtc
         total_seconds = delta_since_last_update.total_seconds()
         return math.ceil(total_seconds / 3600)
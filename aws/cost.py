@@ -0,0 +1,190 @@
+
+from __future__ import print_function
+
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+import math
+
+try:
+    from itertools import izip as zip
+except ImportError:
+    pass
+
+try:
+    import numpy
+except ImportError:
+    # the plain python versions below are used instead
+    numpy = None
+
+EPOCH = datetime(1970, 1, 1)
+HOURS_PER_DAY = 24
+DAYS_PER_MONTH = 30
+
+
+def to_microseconds(value):
+    """
+    Converts a naive UTC datetime to whole microseconds since the epoch
+
+    Integer microseconds keep the elapsed time exact, so costs match
+    AWSInstance.calculate_cost to the last bit.
+
+    :param value
+
+    :returns: int
+
+    """
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def instance_costs(launched_at_us, costs_per_hour, now):
+    """
+    Accrued cost of each instance since launch, rounded up to the
+    nearest completed hour
+
+    :param launched_at_us launch times in microseconds since the epoch
+    :param costs_per_hour hourly prices (in USD)
+    :param now reference time for the whole fleet
+
+    :returns: array of costs (in USD)
+
+    """
+    now_us = to_microseconds(now)
+
+    if numpy is not None:
+        launched_at_us = _as_numpy(launched_at_us, numpy.int64)
+        costs_per_hour = _as_numpy(costs_per_hour, numpy.float64)
+        return costs_per_hour * numpy.ceil(((now_us - launched_at_us) / 1e6) / 3600)
+
+    ceil = math.ceil
+    return array('d', [cost_per_hour * ceil(((now_us - launched_us) / 1e6) / 3600)
+                       for launched_us, cost_per_hour in zip(launched_at_us, costs_per_hour)])
+
+
+def price_timeline(starts_us, prices):
+    """
+    Builds the timeline used by timeline_cost
+
+    :param starts_us times each price took effect, in microseconds since
+                     the epoch, oldest first
+    :param prices costs per hour (in USD)
+
+    :returns: (starts, prices, cost accrued from the first start to each
+               start in USD microseconds per hour) all as tuples
+
+    """
+    accrued = [0.0]
+    for index in range(1, len(starts_us)):
+        accrued.append(accrued[-1] + prices[index - 1] * (starts_us[index] - starts_us[index - 1]))
+    return tuple(starts_us), tuple(prices), tuple(accrued)
+
+
+def timeline_cost(timeline, launched_us, now_us):
+    """
+    Accrued cost of one instance whose price changed while it ran,
+    rounded up to the nearest completed hour like instance_costs
+
+    Each hour is charged at the price in effect at the time, a price
+    applies from its start until the next one and the first price also
+    covers any time before it.
+
+    :param timeline see price_timeline
+    :param launched_us launch time in microseconds since the epoch
+    :param now_us reference time in microseconds since the epoch
+
+    :returns: cost (in USD)
+
+    """
+    hours = math.ceil(((now_us - launched_us) / 1e6) / 3600)
+    end_us = launched_us + int(hours) * 3600 * 1000000
+    return (_accrued_at(timeline, end_us) - _accrued_at(timeline, launched_us)) / 3.6e9
+
+
+def _accrued_at(timeline, at_us):
+    # the running total at the start of the segment plus the part of
+    # the segment up to at_us, found with one binary search
+    starts, prices, accrued = timeline
+    index = max(bisect_right(starts, at_us) - 1, 0)
+    return accrued[index] + prices[index] * (at_us - starts[index])
+
+
+def volume_costs(volume_types, sizes, provisioned_iops, costs_per_gb, iops_costs):
+    """
+    Monthly cost of each volume, see AWSVolume.calculate_cost
+
+    :returns: array of costs (in USD)
+
+    """
+    if numpy is not None and len(volume_types):
+        volume_types = numpy.asarray(volume_types)
+        storage = _as_numpy(costs_per_gb, numpy.float64) * _as_numpy(sizes, numpy.float64)
+        iops = _as_numpy(provisioned_iops, numpy.float64) * _as_numpy(iops_costs, numpy.float64)
+
+        costs = numpy.where((volume_types == 'gp2') | (volume_types == 'standard'), storage, 0.0)
+        return numpy.where(volume_types == 'io1', storage + iops, costs)
+
+    costs = array('d', [0.0]) * len(sizes)
+
+    for index, volume_type in enumerate(volume_types):
+        if volume_type == 'gp2' or volume_type == 'standard':
+            costs[index] = costs_per_gb[index] * sizes[index]
+        elif volume_type == 'io1':
+            costs[index] = (costs_per_gb[index] * sizes[index]) + (provisioned_iops[index] * iops_costs[index])
+
+    return costs
+
+
+def run_rates(costs_per_hour):
+    """
+    Ongoing cost of a fleet
+
+    :returns: per hour, per day, per 30 day month (all in USD)
+
+    """
+    per_hour = sum(costs_per_hour)
+    return per_hour, per_hour * HOURS_PER_DAY, per_hour * HOURS_PER_DAY * DAYS_PER_MONTH
+
+
+def _as_numpy(values, dtype):
+    # share the memory of a stdlib array rather than copying it item by item
+    if isinstance(values, array):
+        return numpy.frombuffer(values, dtype=values.typecode).astype(dtype, copy=False)
+    return numpy.asarray(values, dtype=dtype)
+
+
+class BatchCostCalculator(object):
+    """Costs a whole fleet of AWSInstance and AWSVolume in one pass
+    against a single reference time."""
+
+    def __init__(self, now=None):
+        self.now = now or datetime.utcnow()
+
+    def cost_instances(self, instances):
+        launched_at_us = array('l', [to_microseconds(i.launchedAtUtc) for i in instances])
+        costs_per_hour = array('d', [i.cost_per_hour for i in instances])
+        costs = instance_costs(launched_at_us, costs_per_hour, self.now)
+
+        # instances that ran across a price change are integrated over
+        # their timeline, everything else keeps the flat cost
+        now_us = to_microseconds(self.now)
+        for index, instance in enumerate(instances):
+            if instance.price_timeline is not None:
+                costs[index] = timeline_cost(instance.price_timeline, launched_at_us[index], now_us)
+
+        for instance, cost in zip(instances, costs.tolist()):
+            instance.cost = cost
+
+        return costs
+
+    def cost_volumes(self, volumes):
+        costs = volume_costs([v.type for v in volumes],
+                             array('d', [v.size for v in volumes]),
+                             array('d', [v.provisioned_iops or 0 for v in volumes]),
+                             array('d', [v.cost_per_gb for v in volumes]),
+                             array('d', [v.iops_cost for v in volumes]))
+
+        for volume, cost in zip(volumes, costs.tolist()):
+            volume.cost = cost
+
+        return costs
@@ -0,0 +1,115 @@
+
+from __future__ import print_function
+
+from collections import namedtuple
+from datetime import datetime
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+
+# only the fields the reporter uses, named as boto names them so either
+# can be handed to AWS.instances() / AWS.volumes()
+InstanceRecord = namedtuple('InstanceRecord',
+                            ['id', 'instance_type', 'launch_time', 'key_name', 'state', 'tags'])
+ReservationRecord = namedtuple('ReservationRecord', ['instances'])
+VolumeRecord = namedtuple('VolumeRecord',
+                          ['id', 'size', 'type', 'iops', 'create_time', 'tags'])
+
+
+def parse_iso8601(value):
+    """
+    Parses the fixed format timestamps EC2 returns e.g. 2016-01-13T15:42:25.000Z
+
+    :param value
+
+    :returns: naive datetime in UTC
+
+    """
+    return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                    int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                    int(value[20:23] or 0) * 1000)
+
+
+class DescribeInstancesReader(object):
+    """Incrementally decodes a DescribeInstances response.
+
+    Yields a ReservationRecord per reservation, each reservation is
+    discarded once it has been yielded. next_token is set once the
+    response has been read to the end.
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self.next_token = None
+
+    def __iter__(self):
+        for ns, element in _items(self, 'reservationSet'):
+            instances = []
+
+            for item in element.iterfind(ns + 'instancesSet/' + ns + 'item'):
+                instances.append(InstanceRecord(id=item.findtext(ns + 'instanceId'),
+                                                instance_type=item.findtext(ns + 'instanceType'),
+                                                launch_time=item.findtext(ns + 'launchTime'),
+                                                key_name=item.findtext(ns + 'keyName'),
+                                                state=item.findtext(ns + 'instanceState/' + ns + 'name'),
+                                                tags=_tags(ns, item)))
+
+            yield ReservationRecord(instances=instances)
+
+
+class DescribeVolumesReader(object):
+    """Incrementally decodes a DescribeVolumes response.
+
+    Yields a VolumeRecord per volume, next_token is set once the
+    response has been read to the end.
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self.next_token = None
+
+    def __iter__(self):
+        for ns, item in _items(self, 'volumeSet'):
+            iops = item.findtext(ns + 'iops')
+
+            yield VolumeRecord(id=item.findtext(ns + 'volumeId'),
+                               size=int(item.findtext(ns + 'size') or 0),
+                               type=item.findtext(ns + 'volumeType'),
+                               iops=int(iops) if iops else None,
+                               create_time=item.findtext(ns + 'createTime'),
+                               tags=_tags(ns, item))
+
+
+def _items(reader, item_set):
+    # only the depth is tracked per element, the children of each
+    # <item> in the result set are looked up once it is complete
+    depth = 0
+    ns = ''
+    result_set = None
+
+    for event, element in ElementTree.iterparse(reader._source, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                ns = element.tag[:element.tag.find('}') + 1]
+            elif depth == 2:
+                result_set = element if element.tag == ns + item_set else None
+            continue
+
+        depth -= 1
+
+        if depth == 2 and result_set is not None:
+            yield ns, element
+            result_set.remove(element)
+        elif depth == 1 and element.tag == ns + 'nextToken':
+            reader.next_token = element.text
+
+
+def _tags(ns, item):
+    tags = {}
+    for tag in item.iterfind(ns + 'tagSet/' + ns + 'item'):
+        tags[tag.findtext(ns + 'key')] = tag.findtext(ns + 'value') or ''
+    return tags
@@ -0,0 +1,174 @@
+
+from __future__ import print_function
+
+import json
+import sqlite3
+import time
+
+from describe import InstanceRecord, VolumeRecord
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    region TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    state TEXT,
+    instance_type TEXT,
+    launch_time TEXT,
+    key_name TEXT,
+    tags TEXT,
+    PRIMARY KEY (region, identifier)
+);
+CREATE TABLE IF NOT EXISTS volumes (
+    region TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    size INTEGER,
+    type TEXT,
+    iops INTEGER,
+    create_time TEXT,
+    tags TEXT,
+    PRIMARY KEY (region, identifier)
+);
+CREATE TABLE IF NOT EXISTS refreshes (
+    region TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    refreshed_at REAL NOT NULL,
+    PRIMARY KEY (region, kind)
+);
+"""
+
+
+class InventoryCache(object):
+    """Local SQLite copy of the instances and volumes of each region.
+
+    A region is served from the cache while its last refresh is no older
+    than max_staleness seconds. Otherwise it is fetched again and only
+    the rows that changed, appeared or disappeared are written back.
+
+    Several accounts can share one cache file, each with its own scope.
+    """
+
+    def __init__(self, path, max_staleness=3600, scope=None):
+        self._path = path
+        self._max_staleness = max_staleness
+        self._scope = scope
+
+        connection = self._connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def instances(self, region, state, fetch):
+        """
+        Instances of a region in the given state
+
+        :param region
+        :param state
+        :param fetch callable returning the instances from EC2, used
+                     when the cached copy is too stale
+
+        :returns: InstanceRecord
+
+        """
+        kind = 'instances:{}'.format(state)
+        region = self._scoped(region)
+
+        if self._is_fresh(region, kind):
+            return self._cached_instances(region, state)
+
+        return self._refresh(region, kind, fetch(), 'instances',
+                             "SELECT identifier, state, instance_type, launch_time, key_name, tags "
+                             "FROM instances WHERE region = ? AND state = ?", (region, state),
+                             lambda i: (i.id, i.state, i.instance_type, i.launch_time, i.key_name,
+                                        self._dump_tags(i.tags)))
+
+    def volumes(self, region, fetch):
+        """
+        Volumes of a region
+
+        :param region
+        :param fetch callable returning the volumes from EC2, used when
+                     the cached copy is too stale
+
+        :returns: VolumeRecord
+
+        """
+        region = self._scoped(region)
+
+        if self._is_fresh(region, 'volumes'):
+            return self._cached_volumes(region)
+
+        return self._refresh(region, 'volumes', fetch(), 'volumes',
+                             "SELECT identifier, size, type, iops, create_time, tags "
+                             "FROM volumes WHERE region = ?", (region,),
+                             lambda v: (v.id, v.size, v.type, v.iops, v.create_time,
+                                        self._dump_tags(v.tags)))
+
+    def _scoped(self, region):
+        # rows are keyed by region, prefixed with the scope when there is one
+        return region if self._scope is None else '{}/{}'.format(self._scope, region)
+
+    def _is_fresh(self, region, kind):
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT refreshed_at FROM refreshes WHERE region = ? AND kind = ?",
+                                     (region, kind)).fetchone()
+        finally:
+            connection.close()
+
+        return row is not None and time.time() - row[0] <= self._max_staleness
+
+    def _cached_instances(self, region, state):
+        connection = self._connect()
+        try:
+            for row in connection.execute("SELECT identifier, instance_type, launch_time, key_name, state, tags "
+                                          "FROM instances WHERE region = ? AND state = ?", (region, state)):
+                yield InstanceRecord(id=row[0], instance_type=row[1], launch_time=row[2],
+                                     key_name=row[3], state=row[4], tags=json.loads(row[5]))
+        finally:
+            connection.close()
+
+    def _cached_volumes(self, region):
+        connection = self._connect()
+        try:
+            for row in connection.execute("SELECT identifier, size, type, iops, create_time, tags "
+                                          "FROM volumes WHERE region = ?", (region,)):
+                yield VolumeRecord(id=row[0], size=row[1], type=row[2], iops=row[3],
+                                   create_time=row[4], tags=json.loads(row[5]))
+        finally:
+            connection.close()
+
+    def _refresh(self, region, kind, resources, table, select, select_args, to_row):
+        # rows are passed on as they arrive from EC2, the cache is only
+        # updated once every resource has been seen
+        connection = self._connect()
+        try:
+            cached = dict((row[0], tuple(row)) for row in connection.execute(select, select_args))
+            seen = set()
+            changed = []
+
+            for resource in resources:
+                row = to_row(resource)
+                seen.add(row[0])
+                if cached.get(row[0]) != row:
+                    changed.append(row)
+                yield resource
+
+            with connection:
+                if changed:
+                    placeholders = ", ".join("?" * (len(changed[0]) + 1))
+                    connection.executemany("INSERT OR REPLACE INTO {} VALUES ({})".format(table, placeholders),
+                                           [(region,) + row for row in changed])
+                connection.executemany("DELETE FROM {} WHERE region = ? AND identifier = ?".format(table),
+                                       [(region, identifier) for identifier in cached if identifier not in seen])
+                connection.execute("INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?)",
+                                   (region, kind, time.time()))
+        finally:
+            connection.close()
+
+    def _dump_tags(self, tags):
+        return json.dumps(dict(tags or {}), sort_keys=True)
+
+    def _connect(self):
+        # one connection per use, regions are collected on several threads
+        return sqlite3.connect(self._path, timeout=30)
@@ -0,0 +1,273 @@
+
+from __future__ import print_function
+
+import math
+import sqlite3
+
+from cost import timeline_cost, to_microseconds
+
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 86400
+
+# samples are what each report run appends, older samples are rolled up
+# into the daily tables. tag rows repeat the time and spend of their
+# sample so tag queries never have to join back to samples. last_seen
+# is when each instance was last sampled, so its next sample only adds
+# the spend since then and a new instance adds its spend since launch,
+# or since the first run of the ledger when it was launched before.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    sampled_at INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS last_seen (
+    identifier TEXT PRIMARY KEY,
+    sampled_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    sampled_at INTEGER NOT NULL,
+    region TEXT NOT NULL,
+    instance_type TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    spend REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_by_time
+    ON samples (sampled_at, region, instance_type, spend);
+CREATE TABLE IF NOT EXISTS sample_tags (
+    sample_id INTEGER NOT NULL,
+    sampled_at INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    spend REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sample_tags_by_key
+    ON sample_tags (key, sampled_at, value, spend);
+CREATE INDEX IF NOT EXISTS sample_tags_by_time
+    ON sample_tags (sampled_at);
+CREATE TABLE IF NOT EXISTS daily (
+    day INTEGER NOT NULL,
+    region TEXT NOT NULL,
+    instance_type TEXT NOT NULL,
+    spend REAL NOT NULL,
+    PRIMARY KEY (day, region, instance_type)
+);
+CREATE TABLE IF NOT EXISTS daily_tags (
+    key TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    spend REAL NOT NULL,
+    PRIMARY KEY (key, day, value)
+);
+"""
+
+GROUP_BY = ('region', 'instance_type')
+
+
+class CostLedger(object):
+    """Append only history of what the fleet cost, kept in SQLite.
+
+    Every report run records, per instance, the spend since the previous
+    run. Samples older than retention_days are compacted into one row per
+    day, region and type (and per day, tag key and value) so queries over
+    a long history only touch a few rows per day.
+    """
+
+    def __init__(self, path, retention_days=30):
+        self._path = path
+        self._retention_days = retention_days
+
+        connection = self._connect()
+        try:
+            connection.executescript(SCHEMA)
+            with connection:
+                # ledgers from before last_seen learn it from their samples
+                if connection.execute("SELECT COUNT(*) FROM last_seen").fetchone()[0] == 0:
+                    connection.execute("INSERT INTO last_seen "
+                                       "SELECT identifier, MAX(sampled_at) FROM samples GROUP BY identifier")
+        finally:
+            connection.close()
+
+    def record(self, now, instances):
+        """
+        Appends the spend of every instance since it was last recorded
+
+        The first time an instance is seen its spend since launch is
+        recorded, e.g. the hours it spent in the grace period, but never
+        from before the first run of the ledger. Spend is what the report
+        accrues over the interval, at the prices of the time, and an
+        interval that spans days is split into one sample per day.
+
+        :param now time of the run, naive UTC datetime
+        :param instances costed AWSInstance
+
+        :returns: number of samples written
+
+        """
+        sampled_at = to_microseconds(now) // 1000000
+        connection = self._connect()
+        try:
+            with connection:
+                first_run = connection.execute("SELECT MIN(sampled_at) FROM runs").fetchone()[0]
+                connection.execute("INSERT OR IGNORE INTO runs VALUES (?)", (sampled_at,))
+                last_seen = dict(connection.execute("SELECT identifier, sampled_at FROM last_seen "
+                                                    "WHERE sampled_at < ?", (sampled_at,)))
+                # the first run only starts the ledger, it has no interval
+                earliest = sampled_at if first_run is None else min(first_run, sampled_at)
+
+                count = 0
+                for instance in instances:
+                    launched_us = to_microseconds(instance.launchedAtUtc)
+                    start = last_seen.get(instance.identifier)
+                    if start is None:
+                        start = max(launched_us // 1000000, earliest)
+
+                    for at, spend in _daily_spend(instance, launched_us, start, sampled_at):
+                        sample_id = connection.execute("INSERT INTO samples (sampled_at, region, instance_type, identifier, spend) "
+                                                       "VALUES (?, ?, ?, ?, ?)",
+                                                       (at, instance.aws_region, instance.aws_instance_type,
+                                                        instance.identifier, spend)).lastrowid
+                        connection.executemany("INSERT INTO sample_tags VALUES (?, ?, ?, ?, ?)",
+                                               [(sample_id, at, key, value, spend)
+                                                for key, value in (instance.tags or {}).items()])
+                        count += 1
+                    last_seen[instance.identifier] = sampled_at
+
+                connection.executemany("INSERT OR REPLACE INTO last_seen VALUES (?, ?)",
+                                       [(identifier, seen_at) for identifier, seen_at in last_seen.items()
+                                        if seen_at == sampled_at])
+        finally:
+            connection.close()
+
+        self.compact(now)
+        return count
+
+    def compact(self, now):
+        """
+        Rolls the samples older than the retention period up into daily
+        buckets
+
+        :param now naive UTC datetime the retention period ends at
+
+        :returns: number of samples compacted
+
+        """
+        # only whole days are compacted so a day is never split between
+        # the samples and the daily tables
+        cutoff = to_microseconds(now) // 1000000 - self._retention_days * SECONDS_PER_DAY
+        cutoff -= cutoff % SECONDS_PER_DAY
+
+        connection = self._connect()
+        try:
+            with connection:
+                # the sums are staged and added with INSERT OR IGNORE then
+                # UPDATE, upserts need SQLite 3.24
+                daily = connection.execute("SELECT sampled_at / ? * ? AS day, region, instance_type, SUM(spend) "
+                                           "FROM samples WHERE sampled_at < ? GROUP BY day, region, instance_type",
+                                           (SECONDS_PER_DAY, SECONDS_PER_DAY, cutoff)).fetchall()
+                connection.executemany("INSERT OR IGNORE INTO daily VALUES (?, ?, ?, 0.0)",
+                                       [(day, region, instance_type) for day, region, instance_type, _ in daily])
+                connection.executemany("UPDATE daily SET spend = spend + ? "
+                                       "WHERE day = ? AND region = ? AND instance_type = ?",
+                                       [(spend, day, region, instance_type)
+                                        for day, region, instance_type, spend in daily])
+
+                daily_tags = connection.execute("SELECT key, sampled_at / ? * ? AS day, value, SUM(spend) "
+                                                "FROM sample_tags WHERE sampled_at < ? GROUP BY key, day, value",
+                                                (SECONDS_PER_DAY, SECONDS_PER_DAY, cutoff)).fetchall()
+                connection.executemany("INSERT OR IGNORE INTO daily_tags VALUES (?, ?, ?, 0.0)",
+                                       [(key, day, value) for key, day, value, _ in daily_tags])
+                connection.executemany("UPDATE daily_tags SET spend = spend + ? "
+                                       "WHERE key = ? AND day = ? AND value = ?",
+                                       [(spend, key, day, value) for key, day, value, spend in daily_tags])
+                connection.execute("DELETE FROM sample_tags WHERE sampled_at < ?", (cutoff,))
+                compacted = connection.execute("DELETE FROM samples WHERE sampled_at < ?", (cutoff,)).rowcount
+                connection.execute("DELETE FROM runs WHERE sampled_at < ? AND sampled_at < (SELECT MAX(sampled_at) FROM runs)",
+                                   (cutoff,))
+                # an instance not seen since the cutoff is long gone
+                connection.execute("DELETE FROM last_seen WHERE sampled_at < ?", (cutoff,))
+        finally:
+            connection.close()
+
+        return compacted
+
+    def spend(self, since, until, group_by='region', interval=SECONDS_PER_DAY):
+        """
+        Spend over time, broken down by group
+
+        Compacted history can only be resolved to the day it belongs to.
+
+        :param since naive UTC datetime, inclusive
+        :param until naive UTC datetime, exclusive
+        :param group_by one of region, instance_type or tag:<key>
+        :param interval width of each bucket in seconds
+
+        :returns: list of (bucket start in seconds since the epoch, group value, spend)
+                  ordered by bucket then group value
+
+        """
+        since = to_microseconds(since) // 1000000
+        until = to_microseconds(until) // 1000000
+
+        if group_by.startswith('tag:'):
+            key = group_by[len('tag:'):]
+            queries = [("SELECT sampled_at / ? * ? AS bucket, value, SUM(spend) FROM sample_tags "
+                        "WHERE key = ? AND sampled_at >= ? AND sampled_at < ? GROUP BY bucket, value",
+                        (interval, interval, key, since, until)),
+                       ("SELECT day / ? * ? AS bucket, value, SUM(spend) FROM daily_tags "
+                        "WHERE key = ? AND day >= ? AND day < ? GROUP BY bucket, value",
+                        (interval, interval, key, since, until))]
+        elif group_by in GROUP_BY:
+            queries = [("SELECT sampled_at / ? * ? AS bucket, {0}, SUM(spend) FROM samples "
+                        "WHERE sampled_at >= ? AND sampled_at < ? GROUP BY bucket, {0}".format(group_by),
+                        (interval, interval, since, until)),
+                       ("SELECT day / ? * ? AS bucket, {0}, SUM(spend) FROM daily "
+                        "WHERE day >= ? AND day < ? GROUP BY bucket, {0}".format(group_by),
+                        (interval, interval, since, until))]
+        else:
+            raise ValueError("Unable to group by {}".format(group_by))
+
+        totals = {}
+        connection = self._connect()
+        try:
+            for query, args in queries:
+                for bucket, value, spend in connection.execute(query, args):
+                    totals[(bucket, value)] = totals.get((bucket, value), 0.0) + spend
+        finally:
+            connection.close()
+
+        return [(bucket, value, spend) for (bucket, value), spend in sorted(totals.items())]
+
+    def _connect(self):
+        return sqlite3.connect(self._path, timeout=30)
+
+
+def _daily_spend(instance, launched_us, start, end):
+    """
+    The spend of an instance from start until end, one (time, spend) per
+    day the interval touches. Each is sampled at the end of its part of the
+    interval, within its day.
+
+    """
+    parts = []
+    accrued = _accrued(instance, launched_us, start)
+    # the last second of each day the interval crosses, then its end
+    at = start - start % SECONDS_PER_DAY + SECONDS_PER_DAY - 1
+    while at < end:
+        spend = _accrued(instance, launched_us, at) - accrued
+        if spend:
+            parts.append((at, spend))
+            accrued += spend
+        at += SECONDS_PER_DAY
+    parts.append((end, _accrued(instance, launched_us, end) - accrued))
+    return parts
+
+
+def _accrued(instance, launched_us, at):
+    # what the report charges from launch until at (seconds since the
+    # epoch), so the samples of an instance add up to its accrued cost
+    at_us = at * 1000000
+    if at_us <= launched_us:
+        return 0.0
+    if instance.price_timeline is not None:
+        return timeline_cost(instance.price_timeline, launched_us, at_us)
+    return instance.cost_per_hour * math.ceil((at_us - launched_us) / 3.6e9)
@@ -0,0 +1,199 @@
+
+from __future__ import print_function
+
+from datetime import datetime
+import json
+import os
+import threading
+import time
+
+# prefix of every metric in the Prometheus textfile
+PROMETHEUS_PREFIX = 'aws_reporter'
+
+
+class _Timing(object):
+    """Times one pass through a stage, set items before it ends"""
+
+    __slots__ = ('_metrics', '_stage', '_region', '_start', 'items')
+
+    def __init__(self, metrics, stage, region):
+        self._metrics = metrics
+        self._stage = stage
+        self._region = region
+        self.items = 0
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self._metrics.record(self._stage, self._region, time.time() - self._start, items=self.items)
+
+
+class _NullTiming(object):
+
+    __slots__ = ('items',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class RunMetrics(object):
+    """Wall time and counts of each stage of a report run, per region
+    where the stage runs per region.
+
+    Stages are recorded a page, region or report at a time, never per
+    resource, so keeping them costs next to nothing.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        # (stage, region) -> counter name -> total, including seconds and passes
+        self._stages = {}
+
+    def stage(self, stage, region=None):
+        """
+        Times a stage for as long as the returned context is open
+
+            with run_metrics().stage('whitelist') as timing:
+                timing.items = len(instances)
+
+        :param stage e.g. collect
+        :param region optional
+
+        """
+        return _Timing(self, stage, region)
+
+    def record(self, stage, region=None, seconds=0.0, **counts):
+        """
+        Adds to the totals of a stage, counts are summed by name e.g.
+        calls, items, retries
+
+        """
+        counts['seconds'] = seconds
+        counts['passes'] = 1
+        self._add(stage, region, counts)
+
+    def totals(self):
+        """:returns: list of (stage, region, counter dict) in stage order"""
+        with self._lock:
+            return sorted(((stage, region, dict(totals)) for (stage, region), totals in self._stages.items()),
+                          key=lambda t: (t[0], t[1] or ''))
+
+    def merge(self, totals):
+        """Adds the totals of another run e.g. a worker process"""
+        for stage, region, counts in totals:
+            self._add(stage, region, counts)
+
+    def _add(self, stage, region, counts):
+        with self._lock:
+            totals = self._stages.setdefault((stage, region), {})
+            for name, value in counts.items():
+                totals[name] = totals.get(name, 0) + value
+
+    def summary(self):
+        """:returns: dict for the JSON run summary"""
+        return {'started': datetime.utcfromtimestamp(self.started).isoformat() + 'Z',
+                'seconds': round(time.time() - self.started, 6),
+                'stages': [dict(counts, stage=stage, region=region) for stage, region, counts in self.totals()]}
+
+    def write(self, prefix):
+        """
+        Writes the run summary to prefix.json and the same totals for the
+        Prometheus node exporter textfile collector to prefix.prom
+
+        Both are written to a temporary file first and renamed into
+        place, so a collector never reads half a file.
+
+        :param prefix e.g. /var/lib/node_exporter/textfile/aws_reporter
+
+        """
+        summary = self.summary()
+        _write_atomically(prefix + '.json', json.dumps(summary, indent=2, sort_keys=True,
+                                                        separators=(',', ': ')) + '\n')
+        _write_atomically(prefix + '.prom', self._prometheus(summary))
+
+    def _prometheus(self, summary):
+        lines = ['# HELP {0}_last_run_timestamp_seconds When the last run started'.format(PROMETHEUS_PREFIX),
+                 '# TYPE {0}_last_run_timestamp_seconds gauge'.format(PROMETHEUS_PREFIX),
+                 '{0}_last_run_timestamp_seconds {1:.3f}'.format(PROMETHEUS_PREFIX, self.started),
+                 '# HELP {0}_last_run_seconds Wall time of the last run'.format(PROMETHEUS_PREFIX),
+                 '# TYPE {0}_last_run_seconds gauge'.format(PROMETHEUS_PREFIX),
+                 '{0}_last_run_seconds {1:.6f}'.format(PROMETHEUS_PREFIX, summary['seconds'])]
+
+        # one gauge per counter, labelled by stage and region
+        by_counter = {}
+        for stage in summary['stages']:
+            for name, value in stage.items():
+                if name not in ('stage', 'region'):
+                    by_counter.setdefault(name, []).append((stage['stage'], stage['region'], value))
+
+        for name in sorted(by_counter):
+            metric = '{}_stage_{}'.format(PROMETHEUS_PREFIX, name)
+            lines.append('# HELP {} {} of each stage in the last run'.format(metric, name.capitalize()))
+            lines.append('# TYPE {} gauge'.format(metric))
+            for stage, region, value in by_counter[name]:
+                labels = 'stage="{}"'.format(_escape(stage))
+                if region is not None:
+                    labels += ',region="{}"'.format(_escape(region))
+                lines.append('{}{{{}}} {}'.format(metric, labels, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+class _NullMetrics(object):
+    """Stands in for RunMetrics when metrics are not wanted"""
+
+    enabled = False
+    _timing = _NullTiming()
+
+    def stage(self, stage, region=None):
+        return self._timing
+
+    def record(self, stage, region=None, seconds=0.0, **counts):
+        pass
+
+    def totals(self):
+        return []
+
+    def merge(self, totals):
+        pass
+
+
+_run_metrics = _NullMetrics()
+
+
+def run_metrics():
+    """:returns: the process wide RunMetrics, or a stand in which
+    records nothing until enable_metrics is called"""
+    return _run_metrics
+
+
+def enable_metrics():
+    """
+    Starts recording metrics for this process, discarding any recorded
+    so far
+
+    :returns: RunMetrics
+
+    """
+    global _run_metrics
+    _run_metrics = RunMetrics()
+    return _run_metrics
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomically(path, text):
+    temp_file = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_file, 'w') as out:
+        out.write(text)
+    os.rename(temp_file, path)
@@ -0,0 +1,276 @@
+
+from __future__ import print_function
+
+import json
+from json.decoder import scanstring
+
+from price import EBS_TYPES
+
+# older offer files only name the location of a product
+LOCATIONS = {
+    'US East (N. Virginia)': 'us-east-1',
+    'US East (Ohio)': 'us-east-2',
+    'US West (N. California)': 'us-west-1',
+    'US West (Oregon)': 'us-west-2',
+    'Canada (Central)': 'ca-central-1',
+    'EU (Ireland)': 'eu-west-1',
+    'EU (London)': 'eu-west-2',
+    'EU (Paris)': 'eu-west-3',
+    'EU (Frankfurt)': 'eu-central-1',
+    'EU (Stockholm)': 'eu-north-1',
+    'Asia Pacific (Tokyo)': 'ap-northeast-1',
+    'Asia Pacific (Seoul)': 'ap-northeast-2',
+    'Asia Pacific (Osaka-Local)': 'ap-northeast-3',
+    'Asia Pacific (Singapore)': 'ap-southeast-1',
+    'Asia Pacific (Sydney)': 'ap-southeast-2',
+    'Asia Pacific (Mumbai)': 'ap-south-1',
+    'South America (Sao Paulo)': 'sa-east-1',
+    'AWS GovCloud (US)': 'us-gov-west-1',
+}
+
+# older offer files only describe the type of a volume
+VOLUME_TYPES = {
+    'General Purpose': 'gp2',
+    'Provisioned IOPS': 'io1',
+    'Magnetic': 'standard',
+}
+
+# price dimension unit -> rate name used in the ebs price file, multiplier
+EBS_UNITS = {
+    'GB-Mo': ('perGBmoProvStorage', 1),
+    'IOPS-Mo': ('perPIOPSreq', 1),
+    'IOs': ('perMMIOreq', 1000000),
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+# what a number can be made of, after the part already decoded
+NUMBER_CHARS = '0123456789+-.eE'
+
+
+class JsonStream(object):
+    """Walks a JSON document read a chunk at a time.
+
+    Objects are stepped through member by member with members(), and
+    values are either decoded whole with value() or passed over with
+    skip(), so memory is bounded by the largest value decoded rather
+    than by the size of the document.
+    """
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE):
+        self._source = source
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def members(self):
+        """
+        Steps through the object at the current position, the value of
+        each member must be read with value(), skip() or members()
+        before asking for the next one
+
+        :returns: member names
+
+        """
+        self._expect('{')
+        while True:
+            char = self._peek()
+            if char == '}':
+                self._pos += 1
+                return
+            if char == ',':
+                self._pos += 1
+                char = self._peek()
+            if char != '"':
+                raise ValueError("Expected a member name at {}".format(self._pos))
+
+            key = self._string()
+            self._expect(':')
+            yield key
+
+    def value(self):
+        """:returns: the value at the current position, decoded whole"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # most likely cut off at the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+            # a number may run on into the next chunk, e.g. 6.02e23 cut
+            # after 6.02e decodes as 6.02
+            if not self._buffer[end:].lstrip(NUMBER_CHARS) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def skip(self):
+        """Passes over the value at the current position"""
+        char = self._peek()
+        if char == '{':
+            for _ in self.members():
+                self.skip()
+        elif char == '[':
+            self._pos += 1
+            while True:
+                char = self._peek()
+                if char == ']':
+                    self._pos += 1
+                    return
+                if char == ',':
+                    self._pos += 1
+                self.skip()
+        else:
+            self.value()
+
+    def _string(self):
+        while True:
+            try:
+                value, end = scanstring(self._buffer, self._pos + 1)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            self._pos = end
+            return value
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError("Expected {} at {}".format(char, self._pos))
+        self._pos += 1
+
+    def _peek(self):
+        # skips whitespace, returning the next significant character
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of document")
+
+    def _fill(self):
+        if self._eof:
+            return False
+
+        chunk = self._source.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+
+        # drop what has been read already
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+
+def read_offer_file(source, operating_system='Linux', tenancy='Shared'):
+    """
+    Extracts on demand instance and EBS prices from an AWS EC2 offer file
+
+    Products are read first and only the SKUs of the operating system,
+    tenancy and volume types wanted are remembered, then the on demand
+    terms of those SKUs are priced. Products and terms are decoded one
+    SKU at a time and dropped straight away when they are not wanted.
+
+    :param source file like object holding the offer file
+    :param operating_system e.g. Linux or Windows
+    :param tenancy e.g. Shared or Dedicated
+
+    :returns: instance prices {(region, type): cost per hour},
+              volume rates {(region, ebs type): {rate name: price}}
+
+    """
+    stream = JsonStream(source)
+    instance_skus = {}
+    volume_skus = {}
+    instance_prices = {}
+    volume_rates = {}
+
+    for section in stream.members():
+        if section == 'products':
+            for sku in stream.members():
+                _add_product(stream.value(), operating_system, tenancy, instance_skus, volume_skus)
+        elif section == 'terms':
+            for term_type in stream.members():
+                for sku in stream.members():
+                    # decoding a whole term is quicker than stepping over it
+                    offers = stream.value()
+                    if term_type != 'OnDemand' or (sku not in instance_skus and sku not in volume_skus):
+                        continue
+                    for unit, price in _dimensions(offers):
+                        if sku in instance_skus and unit == 'Hrs':
+                            instance_prices.setdefault(instance_skus[sku], price)
+                        elif sku in volume_skus and unit in EBS_UNITS:
+                            rate, multiplier = EBS_UNITS[unit]
+                            volume_rates.setdefault(volume_skus[sku], {}).setdefault(rate, price * multiplier)
+        else:
+            stream.skip()
+
+    return instance_prices, volume_rates
+
+
+def write_price_files(instance_prices, volume_rates, instance_price_file, ebs_price_file):
+    """
+    Writes prices in the formats AWSPricingStore reads
+
+    :param instance_prices see read_offer_file
+    :param volume_rates see read_offer_file
+    :param instance_price_file path e.g. data.aws.ondemand.json
+    :param ebs_price_file path e.g. data.aws.ebs.json
+
+    """
+    regions = {}
+    for (region, instance_type), price in sorted(instance_prices.items()):
+        regions.setdefault(region, []).append({"type": instance_type, "price": price,
+                                               "os": "linux", "utilization": "ondemand"})
+
+    with open(instance_price_file, 'w') as data_file:
+        json.dump({"regions": [{"region": region, "instanceTypes": types}
+                               for region, types in sorted(regions.items())]},
+                  data_file, indent=2, sort_keys=True)
+
+    regions = {}
+    for (region, ebs_type), rates in sorted(volume_rates.items()):
+        regions.setdefault(region, []).append({"name": EBS_TYPES[ebs_type][0],
+                                               "values": [{"rate": rate, "prices": {"USD": repr(price)}}
+                                                          for rate, price in sorted(rates.items())]})
+
+    with open(ebs_price_file, 'w') as data_file:
+        json.dump({"config": {"currencies": ["USD"], "rate": "perGB",
+                              "regions": [{"region": region, "types": types}
+                                          for region, types in sorted(regions.items())]}},
+                  data_file, indent=2, sort_keys=True)
+
+
+def _add_product(product, operating_system, tenancy, instance_skus, volume_skus):
+    attributes = product.get('attributes', {})
+    region = attributes.get('regionCode') or LOCATIONS.get(attributes.get('location'))
+    if region is None:
+        return
+
+    family = product.get('productFamily')
+
+    if family == 'Compute Instance':
+        if (attributes.get('operatingSystem') == operating_system and
+                attributes.get('tenancy') == tenancy and
+                attributes.get('preInstalledSw', 'NA') == 'NA' and
+                attributes.get('capacitystatus', 'Used') == 'Used'):
+            instance_skus[product['sku']] = (region, attributes.get('instanceType'))
+    elif family in ('Storage', 'System Operation'):
+        # storage is priced per GB, IOPS and I/O requests as system operations
+        ebs_type = attributes.get('volumeApiName') or VOLUME_TYPES.get(attributes.get('volumeType'))
+        if ebs_type in EBS_TYPES:
+            volume_skus[product['sku']] = (region, ebs_type)
+
+
+def _dimensions(offers):
+    for offer in offers.values():
+        for dimension in offer.get('priceDimensions', {}).values():
+            price = dimension.get('pricePerUnit', {}).get('USD')
+            if price is not None:
+                yield dimension.get('unit'), float(price)
@@ -1,7 +1,17 @@
 
 from __future__ import print_function
 
+from datetime import datetime
 import json
+import logging
+import marshal
+import os
+import re
+import threading
+import time
+
+from cost import price_timeline, to_microseconds
+from metrics import run_metrics
 
 
 class PriceNotFoundError(Exception):
@@ -10,17 +20,54 @@ class PriceNotFoundError(Exception):
         self.aws_type = aws_type
 
 
+# bump whenever the layout or meaning of the compiled price snapshot changes
+SNAPSHOT_VERSION = 3
+
+# dated price snapshots in the history directory e.g. data.aws.ondemand.2016-04-01.json
+HISTORY_FILE = re.compile(r'\.(\d{4}-\d{2}-\d{2})\.json$')
+
+# https://aws.amazon.com/ec2/previous-generation/
+PREVIOUS_GENERATION_PRICES = {
+    ("us-east-1", "m1.medium"): 0.087,
+    ("us-west-2", "t1.micro"): 0.02,
+    ("eu-west-1", "m1.medium"): 0.095,
+}
+
+# http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/EBSVolumeTypes.html
+# loookup   nice name               data name
+# gp2       General Purpose (SSD)   Amazon EBS General Purpose (SSD) volumes
+# io1       Provisioned IOPS (SSD)  Amazon EBS Provisioned IOPS (SSD) volumes
+# standard  Magnetic                Amazon EBS Magnetic volumes
+EBS_TYPES = {
+    'gp2': ('Amazon EBS General Purpose (SSD) volumes', None),
+    'io1': ('Amazon EBS Provisioned IOPS (SSD) volumes', 'perPIOPSreq'),
+    'standard': ('Amazon EBS Magnetic volumes', 'perMMIOreq'),
+}
+
+
 class AWSPricingStore(object):
-    """Stores current prices for AWS things."""
+    """Stores current prices for AWS things.
 
-    def __init__(self, instance_price_file='data.aws.ondemand.json',
-                        ebs_price_file='data.aws.ebs.json'):
+    Prices are indexed by (region, type) when the store is loaded so
+    every lookup is a single dictionary access.
 
-        # REVIEW : is it okay if this just throws
-        with open(instance_price_file) as data_file:
-            self._instance_data = json.load(data_file)
-        with open(ebs_price_file) as data_file:
-            self._ebs_data = json.load(data_file)
+    Past instance prices can be read from a directory of dated snapshots
+    of the instance price file, each in effect from its date until the
+    next one. They are merged into one timeline of price changes per
+    (region, type).
+    """
+
+    def __init__(self, instance_price_file='data.aws.ondemand.json',
+                        ebs_price_file='data.aws.ebs.json', cache_file=None,
+                        history_dir=None):
+        self._instance_price_file = instance_price_file
+        self._ebs_price_file = ebs_price_file
+        self._cache_file = cache_file
+        self._history_dir = history_dir
+        self._lock = threading.Lock()
+        self._instance_prices = None
+        self._volume_prices = None
+        self._instance_timelines = None
 
     def volume_costs(self, aws_region, ebs_type):
         """
@@ -32,7 +79,11 @@ class AWSPricingStore(object):
         :returns: cost per hour, iops_rate (both in USD) 
 
         """
-        return self._find_volume_price_in_data(aws_region, ebs_type)
+        self._ensure_loaded()
+        try:
+            return self._volume_prices[(aws_region, ebs_type)]
+        except KeyError:
+            raise PriceNotFoundError(aws_region, ebs_type)
 
     def instance_cost_per_hour(self, aws_region, aws_type):
         """
@@ -44,90 +95,201 @@ class AWSPricingStore(object):
         :returns: cost per hour (in USD)
 
         """
-        return self._find_instance_cost(aws_region, aws_type)
-
-    def _find_instance_cost(self, aws_region, aws_type):
-
-        found, cost = self._previous_generation_instance_look_up(aws_region, aws_type)
-
-        if found:
-            return cost
+        self._ensure_loaded()
+        try:
+            return self._instance_prices[(aws_region, aws_type)]
+        except KeyError:
+            raise PriceNotFoundError(aws_region, aws_type)
 
-        found, cost = self._find_instance_price_in_data(aws_region, aws_type)
-
-        if found:
-            return cost
-
-        raise PriceNotFoundError(aws_region, aws_type)
-
-    # https://aws.amazon.com/ec2/previous-generation/
-    def _previous_generation_instance_look_up(self, aws_region, aws_type):
-        if aws_region == "us-east-1" and aws_type == "m1.medium":
-            return True, 0.087
-        if aws_region == "us-west-2" and aws_type == "t1.micro":
-            return True, 0.02
-        if aws_region == "eu-west-1" and aws_type == "m1.medium":
-            return True, 0.095
-        return False, 0.0
-
-    def _find_instance_price_in_data(self, aws_region, aws_type):
-        regions = self._first_or_none(
-                        filter(
-                            lambda r: r['region'] == aws_region,
-                            self._instance_data['regions']))
-
-        if regions is None:
-            return False, 0.00
-
-        instance_types = self._first_or_none(
-                filter(
-                    lambda r: r['type'] == aws_type, regions['instanceTypes']))
-
-        if instance_types is None:
-            return False, 0.00
-
-        return True, instance_types['price']
+    def instance_price_timeline(self, aws_region, aws_type):
+        """
+        For a given region and type retrieves every change in its
+        hourly price
 
-    def _find_volume_price_in_data(self, aws_region, ebs_type):
-        # http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/EBSVolumeTypes.html
-        # loookup   nice name               data name
-        # gp2       General Purpose (SSD)   Amazon EBS General Purpose (SSD) volumes
-        # io1       Provisioned IOPS (SSD)  Amazon EBS Provisioned IOPS (SSD) volumes
-        # standard  Magnetic                Amazon EBS Magnetic volumes
-        if ebs_type == 'gp2':
-             return self._get_volume_prices(aws_region, 'Amazon EBS General Purpose (SSD) volumes', None)
-        if ebs_type == 'io1':
-            return self._get_volume_prices(aws_region, 'Amazon EBS Provisioned IOPS (SSD) volumes', 'perPIOPSreq')
-        if ebs_type == 'standard':
-            return self._get_volume_prices(aws_region, 'Amazon EBS Magnetic volumes', 'perMMIOreq')
+        :param aws_region
+        :param aws_type
 
-        return PriceNotFoundError(aws_region, ebs_type)
+        :returns: timeline for aws.cost.timeline_cost, or None when the
+                  price history does not show the price changing
 
-    # ugly
-    def _get_volume_prices(self, aws_region, type_long_name, iops_long_name):
-        region = self._first_or_none(
-                        filter(
-                            lambda r: r['region'] == aws_region, self._ebs_data['config']['regions']
-                        ))
+        """
+        self._ensure_loaded()
+        return self._instance_timelines.get((aws_region, aws_type))
 
-        if region is None:
-            PriceNotFoundError(aws_region, ebs_type)
+    def load(self):
+        """Reads the prices now rather than on the first lookup, writing
+        the compiled snapshot when there is a cache file"""
+        self._ensure_loaded()
 
-        types = region['types']
+    def _ensure_loaded(self):
+        if self._instance_prices is not None:
+            return
 
-        values = filter(lambda t: t['name'] == type_long_name, types)
+        with self._lock:
+            if self._instance_prices is None:
+                start = time.time()
+                self._volume_prices, self._instance_timelines, self._instance_prices = self._load()
+                run_metrics().record('price_load', None, time.time() - start,
+                                     items=len(self._instance_prices) + len(self._volume_prices))
 
-        perGBrateNode = filter(lambda p: p['rate'] == 'perGBmoProvStorage', values[0]['values'])
-        perGBrate = float(perGBrateNode[0]['prices']['USD'])
+    def _load(self):
+        signature = self._source_signature()
 
-        if iops_long_name is not None:
-            iopsNode = filter(lambda p: p['rate'] == iops_long_name, values[0]['values'])
-            iops = float(iopsNode[0]['prices']['USD'])
-        else:
-            iops = 0.0
+        if self._cache_file is not None:
+            snapshot = self._read_snapshot(signature)
+            if snapshot is not None:
+                return snapshot
 
-        return perGBrate, iops
+        # REVIEW : is it okay if this just throws
+        with open(self._instance_price_file) as data_file:
+            instance_data = json.load(data_file)
+        with open(self._ebs_price_file) as data_file:
+            ebs_data = json.load(data_file)
+
+        volume_prices = self._index_volume_prices(ebs_data)
+        instance_prices = self._index_instance_prices(instance_data)
+        instance_timelines = self._index_instance_timelines(self._history_files(), instance_prices)
+
+        if self._cache_file is not None:
+            self._write_snapshot(signature, volume_prices, instance_timelines, instance_prices)
+
+        return volume_prices, instance_timelines, instance_prices
+
+    def _source_signature(self):
+        # the compiled snapshot is only valid for the exact source files
+        signature = [SNAPSHOT_VERSION]
+        paths = [self._instance_price_file, self._ebs_price_file]
+        paths.extend(path for effective, path in self._history_files())
+        for path in paths:
+            stat = os.stat(path)
+            signature.append((os.path.abspath(path), stat.st_size, int(stat.st_mtime)))
+        return tuple(signature)
+
+    def _history_files(self):
+        """:returns: list of (effective datetime, path), oldest first"""
+        if self._history_dir is None:
+            return []
+
+        files = []
+        for name in os.listdir(self._history_dir):
+            match = HISTORY_FILE.search(name)
+            if match:
+                files.append((datetime.strptime(match.group(1), '%Y-%m-%d'),
+                              os.path.join(self._history_dir, name)))
+        return sorted(files)
+
+    def _read_snapshot(self, signature):
+        try:
+            with open(self._cache_file, 'rb') as cache:
+                cached_signature, volume_prices, instance_timelines, instance_prices = marshal.load(cache)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+        if cached_signature != signature:
+            return None
+
+        return volume_prices, instance_timelines, instance_prices
+
+    def _write_snapshot(self, signature, volume_prices, instance_timelines, instance_prices):
+        temp_file = "{}.{}.tmp".format(self._cache_file, os.getpid())
+        try:
+            with open(temp_file, 'wb') as cache:
+                marshal.dump((signature, volume_prices, instance_timelines, instance_prices), cache)
+            os.rename(temp_file, self._cache_file)
+        except (IOError, OSError) as e:
+            logging.warning("Unable to write price cache {} : {}".format(self._cache_file, e))
+
+    def _index_instance_prices(self, instance_data):
+        prices = {}
+
+        for region in instance_data['regions']:
+            for instance_type in region['instanceTypes']:
+                key = (region['region'], instance_type['type'])
+                # the first entry wins, as the old linear scan did
+                prices.setdefault(key, instance_type['price'])
+
+        # previous generation prices take precedence over the data file
+        prices.update(PREVIOUS_GENERATION_PRICES)
+        return prices
+
+    def _index_instance_timelines(self, history_files, current_prices):
+        if not history_files:
+            return {}
+
+        def dated_prices():
+            for effective, path in history_files:
+                with open(path) as data_file:
+                    yield effective, self._index_instance_prices(json.load(data_file))
+
+            # the current prices are the last point, from when the file was
+            # last changed and never before the newest history file, so
+            # recent hours are charged what cost_per_hour shows
+            modified = datetime.utcfromtimestamp(os.stat(self._instance_price_file).st_mtime)
+            yield max(history_files[-1][0], modified), current_prices
+
+        changes = {}
+
+        for effective, prices in dated_prices():
+            effective_us = to_microseconds(effective)
+            for key, price in prices.items():
+                starts, key_prices = changes.setdefault(key, ([], []))
+                if starts and starts[-1] == effective_us:
+                    # the current prices dated the same as the newest file
+                    # replace them
+                    key_prices[-1] = price
+                    if len(key_prices) > 1 and key_prices[-2] == price:
+                        del starts[-1], key_prices[-1]
+                # only keep the points where the price changed
+                elif not key_prices or key_prices[-1] != price:
+                    starts.append(effective_us)
+                    key_prices.append(price)
+
+        # a single price needs no timeline, the flat hourly cost is exact
+        return dict((key, price_timeline(starts, prices))
+                    for key, (starts, prices) in changes.items() if len(prices) > 1)
+
+    def _index_volume_prices(self, ebs_data):
+        prices = {}
+
+        for region in ebs_data['config']['regions']:
+            rates_by_name = {}
+            for volume_type in region['types']:
+                rates = {}
+                for value in volume_type['values']:
+                    rates[value['rate']] = float(value['prices']['USD'])
+                rates_by_name.setdefault(volume_type['name'], rates)
+
+            for ebs_type, (type_long_name, iops_long_name) in EBS_TYPES.items():
+                rates = rates_by_name.get(type_long_name)
+
+                if rates is None or 'perGBmoProvStorage' not in rates:
+                    continue
+
+                iops = rates.get(iops_long_name, 0.0) if iops_long_name else 0.0
+                prices[(region['region'], ebs_type)] = (rates['perGBmoProvStorage'], iops)
+
+        return prices
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def shared_pricing_store(cache_file=None, history_dir=None):
+    """
+    Returns the process wide pricing store, creating it on first use.
+
+    Prices are not read until the first lookup.
+
+    :param cache_file optional path of a compiled price snapshot
+    :param history_dir optional directory of dated instance price files
 
-    # REVIEW : this must already exist in the stdlib ?
-    def _first_or_none(self, some_list):
-        return some_list[0] if some_list else None
+    :returns: AWSPricingStore
+
+    """
+    global _shared_store
+
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = AWSPricingStore(cache_file=cache_file, history_dir=history_dir)
+        return _shared_store
@@ -0,0 +1,174 @@
+
+from __future__ import print_function
+
+import json
+import logging
+import os
+import threading
+import time
+
+import boto.ec2
+from boto.ec2.connection import EC2Connection
+from boto.ec2.regioninfo import RegionInfo
+
+from throttle import shared_throttle, throttle_connection
+
+# a region that held nothing when last checked is only checked again
+# after this many seconds
+IDLE_RECHECK = 24 * 60 * 60
+# how long the regions EC2 offers an account are trusted for
+DISCOVERY_TTL = 7 * 24 * 60 * 60
+
+# endpoint of each region DescribeRegions listed this run, boto only
+# knows the regions that existed when it was released
+_endpoints = {}
+
+
+def discover_regions(aws_access_key, aws_secret_key, api_rate=None, endpoint='us-east-1'):
+    """
+    Asks EC2 for every region the account can use
+
+    :returns: list of region names
+
+    """
+    connection = connect_ec2(endpoint, aws_access_key, aws_secret_key)
+    connection = throttle_connection(connection, shared_throttle(endpoint, aws_access_key, api_rate))
+    found = connection.get_all_regions()
+    for region in found:
+        _endpoints[region.name] = region.endpoint
+    return sorted(region.name for region in found)
+
+
+def connect_ec2(region, aws_access_key, aws_secret_key):
+    """
+    Connects to EC2 in a region, including the regions newer than boto.
+    Those use the endpoint DescribeRegions gave, or the usual
+    ec2.<region>.amazonaws.com when the regions were not discovered this
+    run.
+
+    :returns: EC2Connection
+
+    """
+    connection = boto.ec2.connect_to_region(region,
+                                            aws_access_key_id=aws_access_key,
+                                            aws_secret_access_key=aws_secret_key)
+    if connection is None:
+        endpoint = _endpoints.get(region, 'ec2.{}.amazonaws.com'.format(region))
+        connection = EC2Connection(aws_access_key_id=aws_access_key,
+                                   aws_secret_access_key=aws_secret_key,
+                                   region=RegionInfo(name=region, endpoint=endpoint))
+    return connection
+
+
+class RegionActivity(object):
+    """Remembers, per account, which regions held resources when they
+    were last checked, in a local JSON file.
+
+        {"<account>": {"discovered": 1476800000.0,
+                       "regions": ["eu-west-1", "us-east-1", ...],
+                       "checked": {"us-east-1": [1476800000.0, 1520], ...}}}
+
+    Regions which held resources are checked on every run. A region
+    which held nothing is checked again once idle_recheck seconds have
+    passed, and a region never checked is always checked.
+    """
+
+    def __init__(self, path, idle_recheck=IDLE_RECHECK, discovery_ttl=DISCOVERY_TTL):
+        self._path = path
+        self._idle_recheck = idle_recheck
+        self._discovery_ttl = discovery_ttl
+        self._lock = threading.Lock()
+
+    def known_regions(self, account, discover, fallback, rediscover=False):
+        """
+        The regions of an account, discovered again once the last list is
+        older than discovery_ttl
+
+        :param account e.g. the access key
+        :param discover callable returning the region names from EC2
+        :param fallback regions to use when discovery fails
+        :param rediscover True to discover regardless of age
+
+        :returns: list of region names
+
+        """
+        with self._lock:
+            state = self._read()
+            entry = state.setdefault(account, {})
+
+            if not rediscover and entry.get('regions') \
+                    and time.time() - entry.get('discovered', 0) < self._discovery_ttl:
+                return list(entry['regions'])
+
+            try:
+                entry['regions'] = list(discover())
+                entry['discovered'] = time.time()
+            except Exception as e:
+                logging.warning("Unable to discover the regions of {} : {}".format(account, e))
+                return list(entry.get('regions') or fallback)
+
+            self._write(state)
+            return list(entry['regions'])
+
+    def regions_to_check(self, account, candidates, full_sweep=False):
+        """
+        :param account e.g. the access key
+        :param candidates regions the account can use
+        :param full_sweep True to check every candidate
+
+        :returns: the candidates worth checking this run, in order
+
+        """
+        if full_sweep:
+            return list(candidates)
+
+        checked = self._checked(account)
+        now = time.time()
+        return [region for region in candidates
+                if region not in checked or checked[region][1] > 0
+                or now - checked[region][0] >= self._idle_recheck]
+
+    def active_regions(self, account, candidates):
+        """
+        :returns: the candidates that held resources when last checked,
+                  or that have never been checked
+
+        """
+        checked = self._checked(account)
+        return [region for region in candidates if region not in checked or checked[region][1] > 0]
+
+    def record(self, account, resources):
+        """
+        Stores what each region held
+
+        :param account e.g. the access key
+        :param resources dict of region to the number of resources found
+
+        """
+        now = time.time()
+        with self._lock:
+            state = self._read()
+            checked = state.setdefault(account, {}).setdefault('checked', {})
+            for region, count in resources.items():
+                checked[region] = [now, count]
+            self._write(state)
+
+    def _checked(self, account):
+        with self._lock:
+            return self._read().get(account, {}).get('checked', {})
+
+    def _read(self):
+        try:
+            with open(self._path) as activity_file:
+                return json.load(activity_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _write(self, state):
+        temp_file = "{}.{}.tmp".format(self._path, os.getpid())
+        try:
+            with open(temp_file, 'w') as activity_file:
+                json.dump(state, activity_file, indent=2, sort_keys=True)
+            os.rename(temp_file, self._path)
+        except (IOError, OSError) as e:
+            logging.warning("Unable to write region activity {} : {}".format(self._path, e))
@@ -0,0 +1,238 @@
+
+from __future__ import print_function
+
+from collections import namedtuple
+from datetime import datetime
+from heapq import merge
+from operator import itemgetter
+import hashlib
+import logging
+import os
+
+# a volume is priced per 30 day month, snapshots compare costs per hour
+HOURS_PER_MONTH = 24 * 30
+
+HEADER = '# snapshot '
+
+# one costed instance or volume as it appears in a SnapshotDiff,
+# cost_per_hour is only there to show how much a change is worth, the
+# digest is what is compared
+SnapshotRecord = namedtuple('SnapshotRecord', ['identifier', 'digest', 'cost_per_hour', 'region', 'type'])
+
+DIGEST_MASK = (1 << 64) - 1
+
+
+def snapshot_records(instances, volumes):
+    """
+    :param instances costed AWSInstance
+    :param volumes costed AWSVolume
+
+    :returns: list of (identifier, digest, cost per hour, region, type)
+              sorted by identifier
+
+    """
+    digests = _Digests()
+    records = [(instance.identifier, digests.instance(instance), instance.cost_per_hour,
+                instance.aws_region, instance.aws_instance_type)
+               for instance in instances]
+    records.extend((volume.identifier, digests.volume(volume), volume.cost / HOURS_PER_MONTH,
+                    volume.aws_region, volume.type)
+                   for volume in volumes)
+    records.sort(key=itemgetter(0))
+    return records
+
+
+class _Digests(object):
+    """Digests the costed fields of each resource.
+
+    Each distinct value is hashed once per run and the hashes of the
+    fields and tags of a resource are summed, so a fleet sharing a few
+    types, regions and tags costs a few dictionary lookups a resource and
+    tags need no sorting.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+
+    def instance(self, instance):
+        digest = self._hash(('instance', instance.aws_instance_type, instance.aws_region,
+                             instance.keyname, instance.cost_per_hour))
+        if instance.tags:
+            for tag in instance.tags.items():
+                digest += self._hash(tag)
+        return '%016x' % (digest & DIGEST_MASK)
+
+    def volume(self, volume):
+        digest = self._hash(('volume', volume.type, volume.aws_region, volume.size,
+                             volume.provisioned_iops, volume.cost))
+        return '%016x' % digest
+
+    def _hash(self, value):
+        hashed = self._hashes.get(value)
+        if hashed is None:
+            text = u'\x00'.join(repr(part) if isinstance(part, float) else u'{}'.format(part) for part in value)
+            hashed = self._hashes[value] = int(hashlib.md5(text.encode('utf-8')).hexdigest()[:16], 16)
+        return hashed
+
+
+class SnapshotDiff(object):
+    """What was added, removed or changed between two snapshots"""
+
+    def __init__(self, previous_taken_at, taken_at, added, removed, changed, records):
+        self.previous_taken_at = previous_taken_at
+        self.taken_at = taken_at
+        # what to save for next time, the current records plus those
+        # carried forward from regions that were not collected
+        self.records = records
+        # SnapshotRecord
+        self.added = added
+        self.removed = removed
+        # (previous SnapshotRecord, current SnapshotRecord)
+        self.changed = changed
+
+    @property
+    def has_changes(self):
+        return bool(self.added or self.removed or self.changed)
+
+    @property
+    def cost_per_hour_change(self):
+        """How much more, or less, the fleet costs an hour"""
+        return (sum(record.cost_per_hour for record in self.added)
+                - sum(record.cost_per_hour for record in self.removed)
+                + sum(current.cost_per_hour - previous.cost_per_hour for previous, current in self.changed))
+
+
+def diff_records(previous, current, collected_regions=None):
+    """
+    Walks two snapshots side by side, once
+
+    A previous record of a region that was not collected this time, e.g.
+    one that timed out, is carried forward rather than removed.
+
+    :param previous (identifier, digest, cost per hour, region, type)
+                    sorted by identifier
+    :param current the same, sorted by identifier
+    :param collected_regions regions current covers, None for every region
+
+    :returns: (added, removed, changed, carried) added, removed and
+              changed are SnapshotRecord, carried the previous records
+              kept as they were, sorted by identifier
+
+    """
+    added = []
+    removed = []
+    changed = []
+    carried = []
+
+    previous = iter(previous)
+    current = iter(current)
+    old = next(previous, None)
+    new = next(current, None)
+
+    while old is not None and new is not None:
+        if old[0] == new[0]:
+            if old[1] != new[1]:
+                changed.append((_record(old), _record(new)))
+            old = next(previous, None)
+            new = next(current, None)
+        elif old[0] < new[0]:
+            _gone(old, collected_regions, removed, carried)
+            old = next(previous, None)
+        else:
+            added.append(_record(new))
+            new = next(current, None)
+
+    while old is not None:
+        _gone(old, collected_regions, removed, carried)
+        old = next(previous, None)
+
+    while new is not None:
+        added.append(_record(new))
+        new = next(current, None)
+
+    return added, removed, changed, carried
+
+
+def _gone(row, collected_regions, removed, carried):
+    if collected_regions is None or row[3] in collected_regions:
+        removed.append(_record(row))
+    else:
+        identifier, digest, cost_per_hour, region, resource_type = row
+        carried.append((identifier, digest, float(cost_per_hour), region, resource_type))
+
+
+def _record(row):
+    # costs read back from a file are only parsed when they are shown
+    identifier, digest, cost_per_hour, region, resource_type = row
+    return SnapshotRecord(identifier, digest, float(cost_per_hour), region, resource_type)
+
+
+class Snapshot(object):
+    """The costed resources of the last run, kept in a local file with one
+    line per resource sorted by identifier.
+
+        # snapshot 2016-10-18T12:00:00
+        i-0123456789abcdef0<TAB>digest<TAB>cost per hour<TAB>region<TAB>type
+
+    Only a digest of the costed fields is kept, so a snapshot of a million
+    resources is a few tens of MB and two are compared in one pass.
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    def diff(self, records, now, collected_regions=None):
+        """
+        :param records from snapshot_records
+        :param now naive UTC datetime of this run
+        :param collected_regions regions the records cover, the saved
+                                 records of any other region are carried
+                                 forward. None for every region
+
+        :returns: SnapshotDiff against the saved snapshot, None when there
+                  is none
+
+        """
+        try:
+            snapshot_file = open(self._path)
+        except IOError:
+            return None
+
+        with snapshot_file:
+            previous_taken_at = self._taken_at(snapshot_file.readline())
+            if previous_taken_at is None:
+                logging.warning("Ignoring snapshot {}, it has no header".format(self._path))
+                return None
+
+            added, removed, changed, carried = diff_records(self._read(snapshot_file), records,
+                                                            collected_regions)
+
+        if carried:
+            records = list(merge(records, carried))
+        return SnapshotDiff(previous_taken_at, now, added, removed, changed, records)
+
+    def save(self, records, now):
+        """
+        Replaces the saved snapshot
+
+        :param records from snapshot_records, or SnapshotDiff.records
+        :param now naive UTC datetime of this run
+
+        """
+        temp_file = "{}.{}.tmp".format(self._path, os.getpid())
+        try:
+            with open(temp_file, 'w') as snapshot_file:
+                snapshot_file.write(HEADER + now.isoformat() + '\n')
+                snapshot_file.writelines('%s\t%s\t%r\t%s\t%s\n' % record for record in records)
+            os.rename(temp_file, self._path)
+        except (IOError, OSError) as e:
+            logging.warning("Unable to write snapshot {} : {}".format(self._path, e))
+
+    def _taken_at(self, header):
+        if not header.startswith(HEADER):
+            return None
+        return datetime.strptime(header[len(HEADER):].strip()[:19], "%Y-%m-%dT%H:%M:%S")
+
+    def _read(self, snapshot_file):
+        for line in snapshot_file:
+            yield line.rstrip('\n').split('\t')
@@ -0,0 +1,248 @@
+
+from __future__ import print_function
+
+import logging
+import random
+import socket
+import threading
+import time
+
+try:
+    from httplib import HTTPException
+except ImportError:
+    from http.client import HTTPException
+
+from boto.exception import BotoServerError
+
+# error codes EC2 answers with when an account calls it too often
+THROTTLING_ERRORS = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException')
+# error codes of a passing fault on the EC2 side, retried like any 5xx
+TRANSIENT_ERRORS = ('InternalError', 'InternalFailure', 'ServiceUnavailable', 'Unavailable')
+
+# EC2 refills the request bucket of an account at about 20 calls per
+# second per region, with room for a burst of 100
+DEFAULT_RATE = 20
+DEFAULT_BURST = 100
+DEFAULT_CONCURRENCY = 8
+
+
+class TokenBucket(object):
+    """Spaces out calls to at most rate per second, allowing bursts of
+    up to burst calls.
+
+    The rate backs off on throttling (halving) and recovers by about one
+    call per second every second without it, never above its maximum.
+    """
+
+    def __init__(self, rate, burst, minimum_rate=1):
+        self._maximum_rate = float(rate)
+        self._minimum_rate = min(float(minimum_rate), self._maximum_rate)
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # a token is taken straight away, going into debt if need be,
+        # and the caller sleeps until the debt would have been repaid
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def release(self, throttled=None):
+        """:param throttled True, False or None when the call failed for another reason"""
+        with self._lock:
+            if throttled:
+                self._rate = max(self._minimum_rate, self._rate / 2)
+                # drop any burst saved up, it is what got throttled
+                self._tokens = min(self._tokens, 0.0)
+            elif throttled is not None:
+                self._rate = min(self._maximum_rate, self._rate + 1 / self._rate)
+
+
+class AdaptiveLimit(object):
+    """Bounds the calls in flight, growing the bound by one call per
+    round of successes and halving it on each throttle (AIMD)."""
+
+    def __init__(self, initial, maximum, minimum=1):
+        self.limit = float(initial)
+        self._maximum = maximum
+        self._minimum = minimum
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, throttled=None):
+        """:param throttled True, False or None when the call failed for another reason"""
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.limit = max(self._minimum, self.limit / 2)
+            elif throttled is not None:
+                self.limit = min(self._maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class ThrottleStats(object):
+    """Counts of the calls made through a RegionThrottle"""
+
+    __slots__ = ('calls', 'retries', 'throttles', 'errors', 'failures')
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        # server and connection errors, retried but not backed off from
+        self.errors = 0
+        self.failures = 0
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.retries += other.retries
+        self.throttles += other.throttles
+        self.errors += other.errors
+        self.failures += other.failures
+
+
+class RegionThrottle(object):
+    """Paces the EC2 calls of one account in one region.
+
+    Every call takes a token from a TokenBucket and a slot from an
+    AdaptiveLimit, both of which back off when EC2 throttles and recover
+    while it does not. A throttled call is retried after a jittered
+    exponential backoff, up to max_attempts times. So is a call that met
+    a 5xx or a connection error, which boto would otherwise have retried,
+    without slowing the other calls down.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, concurrency=DEFAULT_CONCURRENCY,
+                 max_attempts=8, base_delay=0.25, max_delay=20):
+        self._bucket = TokenBucket(rate, burst)
+        self._limit = AdaptiveLimit(concurrency, concurrency)
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._lock = threading.Lock()
+        self.stats = ThrottleStats()
+
+    def call(self, function, *args, **kwargs):
+        attempt = 0
+
+        while True:
+            self._limit.acquire()
+            self._bucket.acquire()
+            throttled = None
+            try:
+                self._count('calls')
+                result = function(*args, **kwargs)
+                throttled = False
+                return result
+            except BotoServerError as e:
+                if e.error_code in THROTTLING_ERRORS:
+                    throttled = True
+                    self._count('throttles')
+                elif _transient(e):
+                    self._count('errors')
+                else:
+                    raise
+                if attempt + 1 >= self._max_attempts:
+                    self._count('failures')
+                    raise
+                reason = e.error_code or e.status
+            except (socket.error, HTTPException) as e:
+                self._count('errors')
+                if attempt + 1 >= self._max_attempts:
+                    self._count('failures')
+                    raise
+                reason = e
+            finally:
+                self._limit.release(throttled)
+                self._bucket.release(throttled)
+
+            # full jitter keeps the threads that were throttled together
+            # from retrying together
+            attempt += 1
+            self._count('retries')
+            delay = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** attempt))
+            logging.debug("{}, retrying in {:.2f}s".format(reason, delay))
+            time.sleep(delay)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self.stats, name, getattr(self.stats, name) + 1)
+
+
+def _transient(error):
+    return error.error_code in TRANSIENT_ERRORS or (error.status or 0) >= 500
+
+
+def throttle_connection(connection, throttle):
+    """
+    Routes every request of a boto connection through a RegionThrottle
+
+    boto's own retries are turned off so throttles are seen, and backed
+    off from, here, where server and connection errors are retried too.
+    boto still sleeps for up to a second before handing back a
+    throttling error.
+
+    :param connection boto EC2Connection
+    :param throttle RegionThrottle
+
+    :returns: the connection
+
+    """
+    make_request = connection.make_request
+    connection.make_request = lambda *args, **kwargs: throttle.call(make_request, *args, **kwargs)
+    connection.num_retries = 0
+    return connection
+
+
+_shared_throttles = {}
+_shared_throttles_lock = threading.Lock()
+
+
+def shared_throttle(region, account=None, rate=None, burst=None):
+    """
+    Returns the process wide throttle of an account in a region,
+    creating it on first use
+
+    EC2 limits the requests of each account in each region, so every
+    connection to the same pair shares one throttle.
+
+    :param region
+    :param account e.g. the access key
+    :param rate optional calls per second, used when the throttle is created
+    :param burst optional most calls at once, by default as many as
+                 EC2 allows at the default rate, scaled to rate
+
+    :returns: RegionThrottle
+
+    """
+    with _shared_throttles_lock:
+        throttle = _shared_throttles.get((account, region))
+        if throttle is None:
+            rate = rate or DEFAULT_RATE
+            burst = burst or max(1, int(DEFAULT_BURST * rate / DEFAULT_RATE))
+            throttle = _shared_throttles[(account, region)] = RegionThrottle(rate=rate, burst=burst)
+        return throttle
+
+
+def throttle_stats():
+    """:returns: ThrottleStats totalled over every shared throttle"""
+    total = ThrottleStats()
+    with _shared_throttles_lock:
+        for throttle in _shared_throttles.values():
+            total.merge(throttle.stats)
+    return total
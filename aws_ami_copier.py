@@ -5,7 +5,23 @@ from __future__ import print_function
 from argparse import ArgumentParser
 
 from options.helper import EnvDefault
-import boto.ec2
+from aws.regions import RegionActivity, connect_ec2, discover_regions
+from aws.throttle import DEFAULT_RATE, shared_throttle, throttle_connection, throttle_stats
+
+from multiprocessing.pool import ThreadPool
+import json
+import logging
+import sys
+import time
+
+# tag put on every copy, holding the id of the image it was copied from
+SOURCE_AMI_TAG = 'source-ami'
+
+# states of a copy that need not be made again
+USABLE_STATES = ('available', 'pending')
+
+# what ImageIndex finds in a region it could not describe
+_UNKNOWN = object()
 
 regions = ['us-west-2', 'us-east-1', 'us-west-1', 'eu-west-1', 'sa-east-1',
             'ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1', 'eu-central-1']
@@ -46,21 +62,305 @@ def main():
         help='Region to copy from (or REGION environment variable)'
     )
 
+    parser.add_argument(
+        '--concurrency', default=4, type=int, required=False,
+        action=EnvDefault, envvar='CONCURRENCY',
+        help='Number of regions to copy to at the same time (or CONCURRENCY environment variable)'
+    )
+
+    parser.add_argument(
+        '--wait', default=False, required=False, action='store_true',
+        help='Wait for every copy to become available or fail'
+    )
+
+    parser.add_argument(
+        '--timeout', default=3600, type=int, required=False,
+        action=EnvDefault, envvar='TIMEOUT',
+        help='Seconds to wait for the copies with --wait (or TIMEOUT environment variable)'
+    )
+
+    parser.add_argument(
+        '--index-cache', default='.ami_index.json', required=False,
+        action=EnvDefault, envvar='INDEX_CACHE',
+        help='File caching the copies already made in each region (or INDEX_CACHE environment variable)'
+    )
+
+    parser.add_argument(
+        '--index-ttl', default=300, type=int, required=False,
+        action=EnvDefault, envvar='INDEX_TTL',
+        help='Seconds the cached index of copies is trusted for (or INDEX_TTL environment variable)'
+    )
+
+    parser.add_argument(
+        '--api-rate', default=DEFAULT_RATE, type=float, required=False,
+        action=EnvDefault, envvar='API_RATE',
+        help='Most EC2 calls per second in each region, throttled calls are retried (or API_RATE environment variable)'
+    )
+
+    parser.add_argument(
+        '--region-activity', default=None, required=False,
+        action=EnvDefault, envvar='REGION_ACTIVITY',
+        help='Region activity file kept by aws_reporter.py, only regions that held resources are copied to (or REGION_ACTIVITY environment variable)'
+    )
+
+    parser.add_argument(
+        '--all-regions', default=False, required=False, action='store_true',
+        help='Discover the regions again and copy to every one of them, even with --region-activity'
+    )
+
     opts = parser.parse_args()
-    _copy_to_all_the_regions(opts.ami, opts.image_type, opts.region, 
-                            opts.aws_access_key, opts.aws_secret_key)
-
-def _copy_to_all_the_regions(ami, type_of_image, origin_region, 
-                            aws_access_key, aws_secret_key):
-    
-    for region in regions:
-        if region is not origin_region.lower():
-            conn = boto.ec2.connect_to_region(region,
-                                      aws_access_key_id=aws_access_key,
-                                      aws_secret_access_key=aws_secret_key)
-
-            image = conn.copy_image(origin_region, ami)
-            print(region, type_of_image, image.image_id)
+
+    target_regions = [region for region in _candidate_regions(opts) if region != opts.region.lower()]
+    index = ImageIndex(opts.aws_access_key, opts.aws_secret_key,
+                       cache_file=opts.index_cache, ttl=opts.index_ttl, api_rate=opts.api_rate)
+    existing = index.copies_of(opts.ami, target_regions, opts.concurrency)
+
+    copies = _copy_to_all_the_regions(opts.ami, opts.image_type, opts.region,
+                                      opts.aws_access_key, opts.aws_secret_key,
+                                      opts.concurrency, existing, opts.api_rate, target_regions)
+    index.record(opts.ami, copies)
+
+    if opts.wait:
+        _wait_for_copies(copies, opts.timeout)
+        index.record(opts.ami, copies)
+
+    _print_summary(copies)
+
+    stats = throttle_stats()
+    print("EC2 calls : {}, throttled : {}, errors : {}, retried : {}, gave up : {}".format(
+        stats.calls, stats.throttles, stats.errors, stats.retries, stats.failures), file=sys.stderr)
+
+    if opts.wait and any(copy.state != 'available' for copy in copies):
+        sys.exit(1)
+
+
+def _candidate_regions(opts):
+    """Every region, or with a region activity file the regions of the
+    account that held resources when the reporter last checked"""
+    if not opts.region_activity:
+        return regions
+
+    activity = RegionActivity(opts.region_activity)
+    known = activity.known_regions(opts.aws_access_key,
+                                   lambda: discover_regions(opts.aws_access_key, opts.aws_secret_key, opts.api_rate),
+                                   regions, rediscover=opts.all_regions)
+    if opts.all_regions:
+        return known
+    return activity.active_regions(opts.aws_access_key, known)
+
+
+class ImageIndex(object):
+    """Index of the copies of a source image already in each region.
+
+    Copies are found by the tag this tool puts on them, or by the
+    description EC2 gives a copy. The index is cached in a local file
+    for ttl seconds so reruns do not describe every region again.
+    """
+
+    def __init__(self, aws_access_key, aws_secret_key, cache_file=None, ttl=300, api_rate=None):
+        self._aws_access_key = aws_access_key
+        self._aws_secret_key = aws_secret_key
+        self._cache_file = cache_file
+        self._ttl = ttl
+        self._api_rate = api_rate
+
+    def copies_of(self, ami, target_regions, concurrency=4):
+        """
+        Finds the usable copies of an image
+
+        :param ami source image
+        :param target_regions regions to look in
+
+        :returns: dict of region to (image_id, state) for available or pending copies
+
+        """
+        cache = self._read_cache()
+        entry = cache.get(ami)
+
+        if entry is not None and time.time() - entry['fetched'] < self._ttl \
+                and set(target_regions) <= set(entry['regions']):
+            return dict((region, tuple(image)) for region, image in entry['images'].items()
+                        if image[1] in USABLE_STATES)
+
+        pool = ThreadPool(processes=max(1, min(concurrency, len(target_regions))))
+        try:
+            found = pool.map(lambda region: self._try_find_copy(ami, region), target_regions)
+        finally:
+            pool.close()
+
+        images = dict((region, image) for region, image in zip(target_regions, found)
+                      if image not in (None, _UNKNOWN))
+        # a region that could not be looked in is not cached, the next run
+        # looks again
+        cache[ami] = {'fetched': time.time(),
+                      'regions': [region for region, image in zip(target_regions, found) if image is not _UNKNOWN],
+                      'images': images}
+        self._write_cache(cache)
+        return images
+
+    def record(self, ami, copies):
+        """Adds copies just made, or their latest state, to the cache"""
+        cache = self._read_cache()
+        entry = cache.get(ami)
+
+        if entry is None:
+            return
+
+        for copy in copies:
+            if copy.image_id is not None and copy.state in USABLE_STATES:
+                entry['images'][copy.region] = (copy.image_id, copy.state)
+            else:
+                # a failed copy is made again on the next run
+                entry['images'].pop(copy.region, None)
+        self._write_cache(cache)
+
+    def _try_find_copy(self, ami, region):
+        # one region failing to answer does not stop the others, it is
+        # copied to as if it had no copy
+        try:
+            return self._find_copy(ami, region)
+        except Exception as e:
+            logging.warning("Unable to look for copies of {} in {} : {}".format(ami, region, e))
+            return _UNKNOWN
+
+    def _find_copy(self, ami, region):
+        connection = _connect(region, self._aws_access_key, self._aws_secret_key, self._api_rate)
+
+        images = connection.get_all_images(owners=['self'], filters={'tag:' + SOURCE_AMI_TAG: ami})
+        if not images:
+            images = connection.get_all_images(owners=['self'],
+                                               filters={'description': '[Copied {} from *'.format(ami)})
+
+        usable = [image for image in images if image.state in USABLE_STATES]
+        if not usable:
+            return None
+
+        # prefer a finished copy over one in progress
+        usable.sort(key=lambda image: image.state != 'available')
+        return usable[0].id, usable[0].state
+
+    def _read_cache(self):
+        if self._cache_file is None:
+            return {}
+        try:
+            with open(self._cache_file) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_cache(self, cache):
+        if self._cache_file is None:
+            return
+        try:
+            with open(self._cache_file, 'w') as cache_file:
+                json.dump(cache, cache_file)
+        except IOError as e:
+            logging.warning("Unable to write image index {} : {}".format(self._cache_file, e))
+
+
+class ImageCopy(object):
+    """Tracks the copy of an image to one region"""
+
+    def __init__(self, region, type_of_image):
+        self.region = region
+        self.type_of_image = type_of_image
+        self.connection = None
+        self.image_id = None
+        self.state = 'pending'
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+
+def _copy_to_all_the_regions(ami, type_of_image, origin_region,
+                            aws_access_key, aws_secret_key, concurrency=4, existing=None,
+                            api_rate=None, target_regions=None):
+
+    existing = existing or {}
+
+    copies = [ImageCopy(region, type_of_image) for region in target_regions or regions
+              if region != origin_region.lower()]
+
+    def copy(image_copy):
+        try:
+            image_copy.connection = _connect(image_copy.region, aws_access_key, aws_secret_key, api_rate)
+
+            if image_copy.region in existing:
+                image_copy.image_id, image_copy.state = existing[image_copy.region]
+                print(image_copy.region, type_of_image, image_copy.image_id, "(already copied)")
+                return
+
+            image = image_copy.connection.copy_image(origin_region, ami)
+            image_copy.image_id = image.image_id
+            print(image_copy.region, type_of_image, image.image_id)
+
+            # tag the copy so later runs can find it
+            try:
+                image_copy.connection.create_tags([image.image_id], {SOURCE_AMI_TAG: ami,
+                                                                     'source-region': origin_region,
+                                                                     'image-type': type_of_image})
+            except Exception as e:
+                logging.warning("Unable to tag {} in {} : {}".format(image.image_id, image_copy.region, e))
+        except Exception as e:
+            image_copy.state = 'failed'
+            image_copy.error = e
+            image_copy.finished = time.time()
+            logging.error("Unable to copy {} to {} : {}".format(ami, image_copy.region, e))
+
+    pool = ThreadPool(processes=max(1, min(concurrency, len(copies))))
+    try:
+        pool.map(copy, copies)
+    finally:
+        pool.close()
+
+    return copies
+
+
+def _connect(region, aws_access_key, aws_secret_key, api_rate=None):
+    # calls to one region are paced and retried when EC2 throttles them
+    connection = connect_ec2(region, aws_access_key, aws_secret_key)
+    return throttle_connection(connection, shared_throttle(region, aws_access_key, api_rate))
+
+
+def _wait_for_copies(copies, timeout, initial_delay=5, max_delay=60):
+    """Polls every pending copy together, backing off exponentially,
+    until each is available or failed or the timeout passes."""
+
+    deadline = time.time() + timeout
+    delay = initial_delay
+
+    while True:
+        pending = [copy for copy in copies if copy.state == 'pending']
+
+        for copy in pending:
+            try:
+                image = copy.connection.get_image(copy.image_id)
+            except Exception as e:
+                # the new image is not always visible straight away
+                logging.warning("Unable to check {} in {} : {}".format(copy.image_id, copy.region, e))
+                continue
+
+            if image is not None and image.state in ('available', 'failed'):
+                copy.state = image.state
+                copy.finished = time.time()
+
+        if not any(copy.state == 'pending' for copy in copies):
+            return
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def _print_summary(copies):
+    for copy in copies:
+        print("{} \t{} \t{} \t{:.0f}s".format(copy.region, copy.image_id, copy.state, copy.elapsed()))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+
+from options.helper import EnvDefault
+from aws.ledger import CostLedger, SECONDS_PER_DAY, SECONDS_PER_HOUR
+
+from datetime import datetime, timedelta
+import sys
+
+INTERVALS = {'hour': SECONDS_PER_HOUR, 'day': SECONDS_PER_DAY, 'week': 7 * SECONDS_PER_DAY}
+
+
+def main():
+
+    parser = ArgumentParser(
+        'aws_ledger.py',
+        description="Queries the cost history recorded by aws_reporter.py --ledger."
+    )
+
+    parser.add_argument(
+        '--ledger', required=True,
+        action=EnvDefault, envvar='LEDGER',
+        help='Path of the cost ledger (or LEDGER environment variable)'
+    )
+    parser.add_argument(
+        '--retention-days', default=30, type=int, required=False,
+        action=EnvDefault, envvar='RETENTION_DAYS',
+        help='Days of samples kept before they are rolled up into daily totals (or RETENTION_DAYS environment variable)'
+    )
+
+    commands = parser.add_subparsers(dest='command')
+
+    query = commands.add_parser('query', help='Print the spend over time')
+    query.add_argument(
+        '--since', default=None, type=_parse_date,
+        help='First day to include, YYYY-MM-DD (default 7 days ago)'
+    )
+    query.add_argument(
+        '--until', default=None, type=_parse_date,
+        help='Day to stop before, YYYY-MM-DD (default now)'
+    )
+    query.add_argument(
+        '--group-by', default='region',
+        help='One of region, instance_type or tag:<key>'
+    )
+    query.add_argument(
+        '--interval', default='day', choices=sorted(INTERVALS),
+        help='Width of each row'
+    )
+
+    commands.add_parser('compact', help='Roll samples older than the retention period up into daily totals')
+
+    opts = parser.parse_args()
+
+    now = datetime.utcnow()
+    ledger = CostLedger(opts.ledger, retention_days=opts.retention_days)
+
+    if opts.command == 'compact':
+        print("Compacted {} samples".format(ledger.compact(now)))
+        return
+
+    since = opts.since or now - timedelta(days=7)
+    until = opts.until or now
+
+    try:
+        rows = ledger.spend(since, until, group_by=opts.group_by, interval=INTERVALS[opts.interval])
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+
+    total = 0.0
+    for bucket, value, spend in rows:
+        total += spend
+        print("{} \t{} \t${:.2f}".format(datetime.utcfromtimestamp(bucket), value, spend))
+
+    print ("Total : \t${:.2f}".format(total))
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+
+from options.helper import EnvDefault
+from aws.offer import read_offer_file, write_price_files
+from aws.price import AWSPricingStore
+
+
+def main():
+
+    parser = ArgumentParser(
+        'aws_price_import.py',
+        description="Imports on demand prices from a local copy of the AWS EC2 offer file."
+    )
+
+    parser.add_argument(
+        '-offer-file', required=True,
+        action=EnvDefault, envvar='OFFER_FILE',
+        help='Path of the offer file e.g. a download of https://pricing.us-east-1.amazonaws.com/offers/v1.0/aws/AmazonEC2/current/index.json (or OFFER_FILE environment variable)'
+    )
+    parser.add_argument(
+        '--instance-price-file', default='data.aws.ondemand.json', required=False,
+        action=EnvDefault, envvar='INSTANCE_PRICE_FILE',
+        help='Instance price file to write (or INSTANCE_PRICE_FILE environment variable)'
+    )
+    parser.add_argument(
+        '--ebs-price-file', default='data.aws.ebs.json', required=False,
+        action=EnvDefault, envvar='EBS_PRICE_FILE',
+        help='EBS price file to write (or EBS_PRICE_FILE environment variable)'
+    )
+    parser.add_argument(
+        '--operating-system', default='Linux', required=False,
+        action=EnvDefault, envvar='OPERATING_SYSTEM',
+        help='Operating system to price instances for (or OPERATING_SYSTEM environment variable)'
+    )
+    parser.add_argument(
+        '--tenancy', default='Shared', required=False,
+        action=EnvDefault, envvar='TENANCY',
+        help='Tenancy to price instances for e.g. Shared or Dedicated (or TENANCY environment variable)'
+    )
+    parser.add_argument(
+        '--price-cache', default=None, required=False,
+        action=EnvDefault, envvar='PRICE_CACHE',
+        help='Also compile the imported prices into this price snapshot, see aws_reporter.py (or PRICE_CACHE environment variable)'
+    )
+
+    opts = parser.parse_args()
+
+    with open(opts.offer_file) as offer_file:
+        instance_prices, volume_rates = read_offer_file(offer_file,
+                                                        operating_system=opts.operating_system,
+                                                        tenancy=opts.tenancy)
+
+    write_price_files(instance_prices, volume_rates, opts.instance_price_file, opts.ebs_price_file)
+    print("Imported {} instance prices and {} volume prices".format(len(instance_prices), len(volume_rates)))
+
+    if opts.price_cache:
+        AWSPricingStore(opts.instance_price_file, opts.ebs_price_file, cache_file=opts.price_cache).load()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,19 +5,50 @@ from __future__ import print_function
 from argparse import ArgumentParser
 
 from options.helper import EnvDefault
-from aws.price import PriceNotFoundError
+from aws.price import shared_pricing_store
 from aws.aws import AWS
+from aws.inventory import InventoryCache
+from aws.ledger import CostLedger
+from aws.metrics import enable_metrics, run_metrics
+from aws.regions import IDLE_RECHECK, RegionActivity, discover_regions
+from aws.snapshot import Snapshot, snapshot_records
+from aws.cost import BatchCostCalculator
+from aws.throttle import DEFAULT_RATE, ThrottleStats, shared_throttle, throttle_stats
+from reports.aggregate import ReportSummary, aggregate
 from reports.console_report import ConsoleReporter
+from reports.diff_report import DiffConsoleReporter, DiffEmailReportWriter
 from reports.email_report import HtmlEmailTemplateReportWriter
+from reports.export import EXPORTS, export, open_exports, parquet_supported
+from reports.mailer import BackgroundMailer, SmtpMailer
+from reports.ranking import most_expensive
+from reports.service import RegionReport, ReportService
 
 from datetime import datetime
+from multiprocessing import Pool, TimeoutError
+from multiprocessing.pool import ThreadPool
+import fnmatch
 import json
 import logging
+import re
 import sys
+import threading
+import time
+
+try:
+    from Queue import Empty, Full, Queue
+except ImportError:
+    from queue import Empty, Full, Queue
 
 regions = ['us-east-1', 'us-west-1', 'us-west-2', 'eu-west-1', 'sa-east-1',
             'ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1', 'eu-central-1']
 
+# instances each (account, region) shard sends back when --top is not given
+DEFAULT_SHARD_TOP = 25
+# instances younger than this are left out of the reports
+GRACE_PERIOD_IN_HOURS = 24
+# resources each region streaming an export fetches ahead of the writer
+STREAM_BUFFER = 1000
+
 def main():
 
     parser = ArgumentParser(
@@ -25,15 +56,25 @@ def main():
         description="Collates a report of running AWS instances"
     )
     parser.add_argument(
-        '-aws-access-key', required=True,
+        '-aws-access-key', default=None, required=False,
         action=EnvDefault, envvar='AWS_ACCESS_KEY',
         help='AWS Access Key (or AWS_ACCESS_KEY environment variable)'
     )
     parser.add_argument(
-        '-aws-secret-key', required=True,
+        '-aws-secret-key', default=None, required=False,
         action=EnvDefault, envvar='AWS_SECRET_KEY',
         help='AWS Secret Key (or AWS_SECRET_KEY environment variable)'
     )
+    parser.add_argument(
+        '--accounts', default=None, required=False,
+        action=EnvDefault, envvar='ACCOUNTS',
+        help='JSON file of named account credentials to report on together, instead of -aws-access-key and -aws-secret-key (or ACCOUNTS environment variable)'
+    )
+    parser.add_argument(
+        '--processes', default=4, type=int, required=False,
+        action=EnvDefault, envvar='PROCESSES',
+        help='Number of (account, region) shards to collect at the same time with --accounts (or PROCESSES environment variable)'
+    )
     parser.add_argument(
         '--email-password', default=None, required=False,
         action=EnvDefault, envvar='EMAIL_PASSWORD',
@@ -49,72 +90,755 @@ def main():
         action=EnvDefault, envvar='EMAIL_TO',
         help='Comma seperated email recipients (or EMAIL_TO environment variable)'
     )
+    parser.add_argument(
+        '--smtp-host', default='smtp.gmail.com', required=False,
+        action=EnvDefault, envvar='SMTP_HOST',
+        help='SMTP server to send email through (or SMTP_HOST environment variable)'
+    )
+    parser.add_argument(
+        '--smtp-port', default=587, type=int, required=False,
+        action=EnvDefault, envvar='SMTP_PORT',
+        help='SMTP server port (or SMTP_PORT environment variable)'
+    )
+    parser.add_argument(
+        '--smtp-no-starttls', default=False, required=False, action='store_true',
+        help='Do not upgrade the SMTP connection with STARTTLS e.g. for a local relay'
+    )
+    parser.add_argument(
+        '--email-background', default=False, required=False, action='store_true',
+        help='Send email on a background thread while the other reports are written'
+    )
     parser.add_argument(
         '--reports', default='Console', required=False,
         action=EnvDefault, envvar='REPORTS',
-        help='Comma seperated list from from - Console, Email (or REPORTS environment variable)'
+        help='Comma seperated list from from - Console, Email, Diff, DiffEmail, CSV, JSONLines, Parquet (or REPORTS environment variable)'
+    )
+    parser.add_argument(
+        '--export-out', default=None, required=False,
+        action=EnvDefault, envvar='EXPORT_OUT',
+        help='Write the CSV, JSONLines and Parquet reports to EXPORT_OUT.csv, EXPORT_OUT.jsonl and EXPORT_OUT.parquet rather than standard out (or EXPORT_OUT environment variable)'
+    )
+    parser.add_argument(
+        '--price-cache', default=None, required=False,
+        action=EnvDefault, envvar='PRICE_CACHE',
+        help='Path of a compiled price snapshot to reuse between runs (or PRICE_CACHE environment variable)'
+    )
+    parser.add_argument(
+        '--price-history', default=None, required=False,
+        action=EnvDefault, envvar='PRICE_HISTORY',
+        help='Directory of past instance price files named data.aws.ondemand.YYYY-MM-DD.json, used to cost instances that ran across a price change (or PRICE_HISTORY environment variable)'
+    )
+    parser.add_argument(
+        '--concurrency', default=4, type=int, required=False,
+        action=EnvDefault, envvar='CONCURRENCY',
+        help='Number of regions to query at the same time (or CONCURRENCY environment variable)'
+    )
+    parser.add_argument(
+        '--region-timeout', default=300, type=int, required=False,
+        action=EnvDefault, envvar='REGION_TIMEOUT',
+        help='Seconds to wait for a region before leaving it out of the report (or REGION_TIMEOUT environment variable)'
+    )
+    parser.add_argument(
+        '--api-rate', default=DEFAULT_RATE, type=float, required=False,
+        action=EnvDefault, envvar='API_RATE',
+        help='Most EC2 calls per second in each region, throttled calls are retried (or API_RATE environment variable)'
+    )
+    parser.add_argument(
+        '--top', default=None, type=int, required=False,
+        action=EnvDefault, envvar='TOP',
+        help='Only list the N most expensive instances, the rest are summarised in one row (or TOP environment variable)'
+    )
+    parser.add_argument(
+        '--group-by-tags', default='', required=False,
+        action=EnvDefault, envvar='GROUP_BY_TAGS',
+        help='Comma seperated tag names to break the costs down by, as well as region, type and keyname (or GROUP_BY_TAGS environment variable)'
+    )
+    parser.add_argument(
+        '--fast-ingest', default=False, required=False, action='store_true',
+        help='Decode EC2 responses with the lightweight parser instead of boto'
+    )
+    parser.add_argument(
+        '--inventory-cache', default=None, required=False,
+        action=EnvDefault, envvar='INVENTORY_CACHE',
+        help='Path of a SQLite copy of the instances and volumes to reuse between runs (or INVENTORY_CACHE environment variable)'
+    )
+    parser.add_argument(
+        '--max-staleness', default=3600, type=int, required=False,
+        action=EnvDefault, envvar='MAX_STALENESS',
+        help='Seconds a region in the inventory cache is used before it is fetched again, 0 always refreshes (or MAX_STALENESS environment variable)'
+    )
+    parser.add_argument(
+        '--ledger', default=None, required=False,
+        action=EnvDefault, envvar='LEDGER',
+        help='Path of a cost ledger to append this run to, see aws_ledger.py (or LEDGER environment variable)'
+    )
+    parser.add_argument(
+        '--snapshot', default=None, required=False,
+        action=EnvDefault, envvar='SNAPSHOT',
+        help='File keeping the costed resources of the last run, the Diff and DiffEmail reports compare against it (or SNAPSHOT environment variable)'
+    )
+    parser.add_argument(
+        '--region-activity', default=None, required=False,
+        action=EnvDefault, envvar='REGION_ACTIVITY',
+        help='File remembering the regions of each account and which held resources, regions that held none are only checked every --idle-region-recheck seconds (or REGION_ACTIVITY environment variable)'
+    )
+    parser.add_argument(
+        '--idle-region-recheck', default=IDLE_RECHECK, type=int, required=False,
+        action=EnvDefault, envvar='IDLE_REGION_RECHECK',
+        help='Seconds before a region that held nothing is checked again with --region-activity (or IDLE_REGION_RECHECK environment variable)'
+    )
+    parser.add_argument(
+        '--all-regions', default=False, required=False, action='store_true',
+        help='Discover the regions again and check every one of them, even with --region-activity'
+    )
+    parser.add_argument(
+        '--serve', default=None, type=int, required=False,
+        action=EnvDefault, envvar='SERVE',
+        help='Keep running and serve the report on this local port, refreshing each region every --refresh-interval seconds (or SERVE environment variable)'
+    )
+    parser.add_argument(
+        '--serve-host', default='127.0.0.1', required=False,
+        action=EnvDefault, envvar='SERVE_HOST',
+        help='Address to serve the report on with --serve (or SERVE_HOST environment variable)'
+    )
+    parser.add_argument(
+        '--refresh-interval', default=300, type=int, required=False,
+        action=EnvDefault, envvar='REFRESH_INTERVAL',
+        help='Seconds between refreshes of each region with --serve (or REFRESH_INTERVAL environment variable)'
+    )
+    parser.add_argument(
+        '--metrics-out', default=None, required=False,
+        action=EnvDefault, envvar='METRICS_OUT',
+        help='Write the time, calls and items of each stage of the run to METRICS_OUT.json and, for the Prometheus textfile collector, METRICS_OUT.prom (or METRICS_OUT environment variable)'
     )
 
     opts = parser.parse_args()
 
+    if opts.accounts is None and (opts.aws_access_key is None or opts.aws_secret_key is None):
+        print("Reports require -aws-access-key and -aws-secret-key, or --accounts")
+        parser.print_help()
+        sys.exit(2)
+        return
+
+    if opts.serve is not None and opts.accounts:
+        print("--serve reports on a single account, it can not be used with --accounts")
+        parser.print_help()
+        sys.exit(2)
+        return
+
+    if opts.accounts and (opts.snapshot or "Diff" in opts.reports):
+        print("Diff reports need every resource, they can not be used with --accounts")
+        parser.print_help()
+        sys.exit(2)
+        return
+
+    report_list = opts.reports.split(",")
+    export_list = [report_type for report_type in report_list if report_type in EXPORTS]
+    if export_list and opts.accounts:
+        print("Exports need every resource, they can not be used with --accounts")
+        parser.print_help()
+        sys.exit(2)
+        return
+
+    if "Parquet" in export_list and (opts.export_out is None or not parquet_supported()):
+        print("Parquet reports require pyarrow and --export-out")
+        parser.print_help()
+        sys.exit(2)
+        return
+
+    if opts.export_out is None and export_list and len(export_list) + len(set(report_list) & set(["Console", "Diff"])) > 1:
+        print("Only one report can be written to standard out, use --export-out")
+        parser.print_help()
+        sys.exit(2)
+        return
+
+    if "Diff" in opts.reports and opts.snapshot is None:
+        print("Diff reports require --snapshot")
+        parser.print_help()
+        sys.exit(2)
+        return
+
     if "Email" in opts.reports:
             if opts.email_from is None or opts.email_to.split(",") is None or opts.email_password is None:
                 print("Email reports require --email-password, --email-from and --email-to")
                 parser.print_help()
                 sys.exit(2)
                 return
-    # go get the data
-    instances, volumes = _execute_report(opts.aws_access_key, opts.aws_secret_key)
+    tag_keys = [t for t in opts.group_by_tags.split(",") if t]
+    metrics = enable_metrics() if opts.metrics_out else run_metrics()
+    activity = None
+    if opts.region_activity:
+        activity = RegionActivity(opts.region_activity, idle_recheck=opts.idle_region_recheck)
+
+    if opts.serve is not None:
+        _serve(opts, tag_keys)
+        return
+
+    if len(export_list) == len(report_list) and not (opts.ledger or opts.snapshot):
+        # nothing needs the whole fleet at once, resources are exported
+        # as they are fetched
+        _stream_exports(opts, export_list, activity)
+        _print_api_stats(throttle_stats())
+
+        if opts.metrics_out:
+            metrics.write(opts.metrics_out)
+        return
+
+    if opts.accounts:
+        # every shard is summarised where it is collected, only the
+        # totals and its most expensive instances come back
+        instances, summary, stats = _execute_accounts_report(_read_accounts(opts.accounts), tag_keys,
+                                                             top=opts.top if opts.top is not None else DEFAULT_SHARD_TOP,
+                                                             processes=opts.processes,
+                                                             price_cache=opts.price_cache,
+                                                             price_history=opts.price_history,
+                                                             region_timeout=opts.region_timeout,
+                                                             api_rate=opts.api_rate,
+                                                             fast_ingest=opts.fast_ingest,
+                                                             inventory_cache=opts.inventory_cache,
+                                                             max_staleness=opts.max_staleness,
+                                                             activity=activity,
+                                                             full_sweep=opts.all_regions)
+        volumes = []
+        collected_regions = None
+
+        if opts.ledger:
+            logging.warning("--ledger needs every instance, it is not recorded with --accounts")
+    else:
+        # go get the data
+        instances, volumes, collected_regions = _execute_report(opts.aws_access_key, opts.aws_secret_key,
+                                                                price_cache=opts.price_cache,
+                                                                price_history=opts.price_history,
+                                                                concurrency=opts.concurrency,
+                                                                region_timeout=opts.region_timeout,
+                                                                api_rate=opts.api_rate,
+                                                                fast_ingest=opts.fast_ingest,
+                                                                inventory_cache=opts.inventory_cache,
+                                                                max_staleness=opts.max_staleness,
+                                                                activity=activity,
+                                                                full_sweep=opts.all_regions)
+        stats = throttle_stats()
+
+        if opts.ledger:
+            with metrics.stage('ledger') as timing:
+                timing.items = len(instances)
+                CostLedger(opts.ledger).record(datetime.utcnow(), instances)
+
+        # totals and rollups shared by every report
+        with metrics.stage('aggregate') as timing:
+            timing.items = len(instances) + len(volumes)
+            summary = aggregate(instances, volumes, tag_keys=tag_keys)
 
     # format and send the reports
-    _output_reports(instances, volumes, opts.reports.split(","), opts)
+    _output_reports(instances, volumes, summary, report_list, opts, collected_regions)
+
+    _print_api_stats(stats)
 
+    if opts.metrics_out:
+        metrics.write(opts.metrics_out)
 
-def _execute_report(aws_access_key, aws_secret_key):
+
+def _execute_report(aws_access_key, aws_secret_key, price_cache=None, price_history=None,
+                    concurrency=4, region_timeout=None, api_rate=None, fast_ingest=False,
+                    inventory_cache=None, max_staleness=3600, activity=None, full_sweep=False):
 
     now = datetime.utcnow()
-    grace_period_in_hours = 24
     whitelist = Whitelist()
     costed_instances = []
     costed_volumes = []
+    price_store = shared_pricing_store(cache_file=price_cache, history_dir=price_history)
+    inventory = InventoryCache(inventory_cache, max_staleness) if inventory_cache else None
+    to_collect = _regions_to_check(activity, aws_access_key, aws_secret_key, api_rate=api_rate,
+                                   full_sweep=full_sweep)
+    resources = {}
+
+    # regions are fetched in parallel but merged in the order of the
+    # regions list so the report is the same from run to run
+    for region, instances, volumes in _collect_regions(aws_access_key, aws_secret_key, price_store,
+                                                       concurrency, region_timeout, fast_ingest,
+                                                       inventory, api_rate, to_collect):
+
+        resources[region] = len(instances) + len(volumes)
+        costed_volumes.extend(volumes)
+
+        with run_metrics().stage('whitelist', region) as timing:
+            timing.items = len(instances)
+            costed_instances.extend(_reportable(now, whitelist, instances))
+
+    # everything is costed against the same point in time
+    with run_metrics().stage('costing') as timing:
+        timing.items = len(costed_instances) + len(costed_volumes)
+        calculator = BatchCostCalculator(now)
+        calculator.cost_volumes(costed_volumes)
+        calculator.cost_instances(costed_instances)
+
+    if activity is not None:
+        activity.record(aws_access_key, resources)
+
+    _record_api_stats(aws_access_key, to_collect)
+
+    # a region that failed or timed out is left out
+    return costed_instances, costed_volumes, list(resources)
+
+
+def _serve(opts, tag_keys):
+    """Runs the reporter as a service with the prices, whitelist and
+    costed regions kept in memory between refreshes"""
+    logging.basicConfig(level=logging.INFO)
+
+    price_store = shared_pricing_store(cache_file=opts.price_cache, history_dir=opts.price_history)
+    price_store.load()
+    whitelist = Whitelist()
+    inventory = InventoryCache(opts.inventory_cache, opts.max_staleness) if opts.inventory_cache else None
+    # one connection per region, kept open between refreshes
+    connections = {}
+
+    def refresh_region(region):
+        aws = connections.get(region)
+        if aws is None:
+            aws = connections[region] = AWS(opts.aws_access_key, opts.aws_secret_key, region,
+                                            price_store=price_store, fast_ingest=opts.fast_ingest,
+                                            inventory_cache=inventory, api_rate=opts.api_rate)
+        volumes = list(aws.volumes())
+        instances = list(aws.instances())
+
+        now = datetime.utcnow()
+        instances = _reportable(now, whitelist, instances)
+        calculator = BatchCostCalculator(now)
+        calculator.cost_volumes(volumes)
+        calculator.cost_instances(instances)
+        return RegionReport(instances, volumes, aggregate(instances, volumes, tag_keys=tag_keys), now)
+
+    def recost_region(report, now):
+        # only the accrued cost of an instance moves between refreshes. the
+        # instances are copied as the current FleetReport is still read
+        instances = [instance.copy() for instance in report.instances]
+        BatchCostCalculator(now).cost_instances(instances)
+        return RegionReport(instances, report.volumes,
+                            aggregate(instances, report.volumes, tag_keys=tag_keys), report.refreshed_at)
 
-    for region in regions:
+    def write_reports(report):
+        if opts.ledger:
+            CostLedger(opts.ledger).record(datetime.utcnow(), report.instances)
+        _output_reports(report.instances, report.volumes, report.summary,
+                        opts.reports.split(","), opts, list(report.regions))
 
-        aws = AWS(aws_access_key, aws_secret_key, region)
+    service = ReportService(refresh_region, regions, tag_keys=tag_keys,
+                            refresh_interval=opts.refresh_interval,
+                            concurrency=opts.concurrency,
+                            region_timeout=opts.region_timeout,
+                            write_reports=write_reports,
+                            top=opts.top,
+                            recost_region=recost_region)
+    try:
+        service.serve_forever(opts.serve_host, opts.serve)
+    except KeyboardInterrupt:
+        pass
 
-        for volume in aws.volumes():
 
+def _execute_accounts_report(accounts, tag_keys, top, processes=4, price_cache=None,
+                             price_history=None, region_timeout=None, api_rate=None,
+                             fast_ingest=False, inventory_cache=None, max_staleness=3600,
+                             activity=None, full_sweep=False):
+    """Collects every (account, region) shard on a pool of processes.
+
+    Each shard is costed and summarised in its worker, which sends back
+    a ReportSummary labelled with the account and only its top most
+    expensive instances. A shard which fails or does not answer within
+    region_timeout seconds is logged and left out.
+
+    :returns: (most expensive instances, ReportSummary, ThrottleStats)
+    """
+    now = datetime.utcnow()
+    # read once here so the forked workers inherit the prices
+    shared_pricing_store(cache_file=price_cache, history_dir=price_history).load()
+
+    shards = [(account, region) for account in accounts
+              for region in _regions_to_check(activity, account['aws_access_key'], account['aws_secret_key'],
+                                              account.get('regions'), api_rate, full_sweep)]
+    resources = dict((account['aws_access_key'], {}) for account in accounts)
+    summary = ReportSummary(tag_keys=tag_keys)
+    instances = []
+    stats = ThrottleStats()
+    metrics = run_metrics()
+    pool = Pool(processes=max(1, min(processes, len(shards))))
+
+    try:
+        pending = [(account, region, pool.apply_async(_collect_shard,
+                                                              (account, region, now, tag_keys, top,
+                                                               price_cache, price_history, fast_ingest,
+                                                               inventory_cache, max_staleness, api_rate,
+                                                               metrics.enabled)))
+                   for account, region in shards]
+
+        for account, region, result in pending:
+            try:
+                shard_summary, shard_instances, shard_stats, shard_metrics, shard_resources = \
+                    result.get(region_timeout)
+            except TimeoutError:
+                logging.warning("Timed out after {}s collecting {} {}".format(region_timeout, account['name'],
+                                                                              region))
+                continue
+            except Exception as e:
+                logging.warning("Unable to collect {} {} : {}".format(account['name'], region, e))
+                continue
+
+            resources[account['aws_access_key']][region] = shard_resources
+            summary.merge(shard_summary)
+            instances.extend(shard_instances)
+            stats.merge(shard_stats)
+            metrics.merge(shard_metrics)
+    finally:
+        # a hung shard must not keep the report waiting once the others are in
+        pool.terminate()
+
+    if activity is not None:
+        for aws_access_key, counts in resources.items():
+            activity.record(aws_access_key, counts)
+
+    shown, _ = most_expensive(instances, top)
+    return shown, summary, stats
+
+
+def _collect_shard(account, region, now, tag_keys, top, price_cache, price_history, fast_ingest,
+                   inventory_cache, max_staleness, api_rate, metrics_enabled=False):
+    # the worker keeps the metrics of this shard alone, to send back
+    metrics = enable_metrics() if metrics_enabled else run_metrics()
+    price_store = shared_pricing_store(cache_file=price_cache, history_dir=price_history)
+    inventory = None
+    if inventory_cache:
+        inventory = InventoryCache(inventory_cache, max_staleness, scope=account['name'])
+
+    instances, volumes = _collect_region(account['aws_access_key'], account['aws_secret_key'], region,
+                                         price_store, fast_ingest, inventory, api_rate)
+    resources = len(instances) + len(volumes)
+    with metrics.stage('whitelist', region) as timing:
+        timing.items = len(instances)
+        instances = _reportable(now, Whitelist(), instances)
+
+    with metrics.stage('costing', region) as timing:
+        timing.items = len(instances) + len(volumes)
+        calculator = BatchCostCalculator(now)
+        calculator.cost_volumes(volumes)
+        calculator.cost_instances(instances)
+
+    with metrics.stage('aggregate', region) as timing:
+        timing.items = len(instances) + len(volumes)
+        summary = aggregate(instances, volumes, tag_keys=tag_keys)
+        summary.label('account', account['name'])
+        shown, _ = most_expensive(instances, top)
+
+    _record_api_stats(account['aws_access_key'], [region])
+    return summary, shown, shared_throttle(region, account['aws_access_key']).stats, metrics.totals(), resources
+
+
+def _read_accounts(accounts_file):
+    """
+    Reads the named credentials of each account to report on
+
+        {"accounts": [{"name": "production",
+                       "aws_access_key": "AKIA...", "aws_secret_key": "...",
+                       "regions": ["us-east-1", "eu-west-1"]}]}
+
+    regions is optional, by default every region is collected.
+
+    :returns: list of account dicts
+    """
+    with open(accounts_file) as data_file:
+        accounts = json.load(data_file)['accounts']
+
+    names = [account['name'] for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError("Account names in {} must be unique".format(accounts_file))
+
+    return accounts
+
+
+def _regions_to_check(activity, aws_access_key, aws_secret_key, candidates=None, api_rate=None,
+                      full_sweep=False):
+    """The regions to collect for an account, every region unless a
+    RegionActivity says some are idle"""
+    if activity is None:
+        return candidates or regions
+
+    if candidates is None:
+        candidates = activity.known_regions(aws_access_key,
+                                            lambda: discover_regions(aws_access_key, aws_secret_key, api_rate),
+                                            regions, rediscover=full_sweep)
+
+    return activity.regions_to_check(aws_access_key, candidates, full_sweep)
+
+
+def _collect_regions(aws_access_key, aws_secret_key, price_store, concurrency, region_timeout,
+                     fast_ingest=False, inventory=None, api_rate=None, to_collect=None):
+    """Fetches the instances and volumes of every region using a bounded
+    pool of threads.
+
+    A region which fails or does not answer within region_timeout seconds
+    is logged and left out rather than failing the whole report.
+    """
+    to_collect = to_collect or regions
+    pool = ThreadPool(processes=max(1, min(concurrency, len(to_collect))))
+
+    try:
+        pending = [(region, pool.apply_async(_collect_region,
+                                             (aws_access_key, aws_secret_key, region, price_store,
+                                              fast_ingest, inventory, api_rate)))
+                   for region in to_collect]
+
+        for region, result in pending:
+            try:
+                instances, volumes = result.get(region_timeout)
+            except TimeoutError:
+                logging.warning("Timed out after {}s collecting {}".format(region_timeout, region))
+                continue
+            except Exception as e:
+                logging.warning("Unable to collect {} : {}".format(region, e))
+                continue
+
+            yield region, instances, volumes
+    finally:
+        # the worker threads are daemons so a hung region can not keep
+        # the process alive, joining them here could
+        pool.close()
+
+
+class PartialRegionError(Exception):
+    """A region failed after some of its resources were exported"""
+
+
+def _stream_exports(opts, export_list, activity=None):
+    """Exports every resource while up to --concurrency regions are
+    fetched, costing each as it comes so only a few pages are held.
+
+    A region that fails or times out before it yields anything is left
+    out, as it is from any report. One that fails part way through fails
+    the export and no file is written, rather than a partial one passing
+    for a complete one.
+    """
+    now = datetime.utcnow()
+    whitelist = Whitelist()
+    price_store = shared_pricing_store(cache_file=opts.price_cache, history_dir=opts.price_history)
+    inventory = InventoryCache(opts.inventory_cache, opts.max_staleness) if opts.inventory_cache else None
+    to_collect = _regions_to_check(activity, opts.aws_access_key, opts.aws_secret_key, api_rate=opts.api_rate,
+                                   full_sweep=opts.all_regions)
+    resources = {}
+    failed = set()
+
+    def aws(region):
+        return AWS(opts.aws_access_key, opts.aws_secret_key, region, price_store=price_store,
+                   fast_ingest=opts.fast_ingest, inventory_cache=inventory, api_rate=opts.api_rate)
+
+    def instances():
+        for instance in _streamed(lambda region: aws(region).instances(), to_collect, resources, failed,
+                                  opts.concurrency, opts.region_timeout):
+            if _is_reportable(now, whitelist, instance):
+                instance.calculate_cost(now)
+                yield instance
+
+    def volumes():
+        for volume in _streamed(lambda region: aws(region).volumes(), to_collect, resources, failed,
+                                opts.concurrency, opts.region_timeout):
             volume.calculate_cost()
-            costed_volumes.append(volume)
+            yield volume
 
-        for instance in aws.instances():
+    try:
+        with run_metrics().stage('export') as timing:
+            timing.items = export(open_exports(export_list, opts.export_out), instances(), volumes())
+    except PartialRegionError as e:
+        logging.error("Export abandoned, {}".format(e))
+        sys.exit(1)
 
-            if whitelist.ok(instance.identifier) and _running_before_min_age(now, instance.launchedAtUtc, grace_period_in_hours):
+    if activity is not None:
+        activity.record(opts.aws_access_key, resources)
 
+    _record_api_stats(opts.aws_access_key, to_collect)
+
+
+def _streamed(fetch, to_collect, resources, failed, concurrency=4, region_timeout=None):
+    """
+    Yields what fetch returns for each region in turn, counting it in
+    resources. Up to concurrency regions are fetched at once, each into a
+    queue of at most STREAM_BUFFER resources.
+
+    A region which fails or keeps the reader waiting region_timeout seconds
+    in all is logged, added to failed and left out from then on. If
+    it had already yielded resources PartialRegionError is raised.
+    """
+    to_collect = [region for region in to_collect if region not in failed]
+    if not to_collect:
+        return
+
+    abandoned = threading.Event()
+    queues = [(region, Queue(STREAM_BUFFER)) for region in to_collect]
+
+    def fill(region, queue):
+        # (resource, None) for each resource then (None, None) at the end,
+        # or (None, error)
+        try:
+            for resource in fetch(region):
+                if not _offer(queue, (resource, None), abandoned):
+                    return
+            _offer(queue, (None, None), abandoned)
+        except Exception as e:
+            _offer(queue, (None, e), abandoned)
+
+    pool = ThreadPool(processes=max(1, min(concurrency, len(to_collect))))
+    try:
+        for region, queue in queues:
+            pool.apply_async(fill, (region, queue))
+
+        for region, queue in queues:
+            # only the time spent waiting on the region counts, not the
+            # time spent writing what it sent
+            waited = 0.0
+            count = 0
+            while True:
+                started = time.time()
                 try:
-                    instance.calculate_cost()
-                    costed_instances.append(instance)
+                    resource, error = queue.get(timeout=max(0, region_timeout - waited) if region_timeout else None)
+                except Empty:
+                    resource, error = None, "timed out after {}s".format(region_timeout)
+                waited += time.time() - started
+
+                if resource is not None:
+                    count += 1
+                    yield resource
+                    continue
+
+                if error is not None:
+                    failed.add(region)
+                    if count:
+                        raise PartialRegionError("{} failed after {} resources : {}".format(region, count, error))
+                    logging.warning("Unable to collect {} : {}".format(region, error))
+                else:
+                    resources[region] = resources.get(region, 0) + count
+                break
+    finally:
+        # a fetch still running stops at its next resource, the threads
+        # are daemons so one hung in a call can not keep the process alive
+        abandoned.set()
+        pool.close()
+
+
+def _offer(queue, item, abandoned):
+    """Puts item on queue once there is room, False if the reader gave up first"""
+    while not abandoned.is_set():
+        try:
+            queue.put(item, timeout=1)
+            return True
+        except Full:
+            continue
+    return False
 
-                except PriceNotFoundError:
-                    logging.warning("Price not found for {} ({} in {} running since {})".format(instance.identifier,
-                                                                                                instance.aws_instance_type,
-                                                                                                instance.aws_region,
-                                                                                                instance.launchedAtUtc))
-    return costed_instances, costed_volumes
 
+def _collect_region(aws_access_key, aws_secret_key, region, price_store, fast_ingest=False,
+                    inventory=None, api_rate=None):
+    with run_metrics().stage('collect', region) as timing:
+        aws = AWS(aws_access_key, aws_secret_key, region, price_store=price_store,
+                  fast_ingest=fast_ingest, inventory_cache=inventory, api_rate=api_rate)
+        volumes = list(aws.volumes())
+        instances = list(aws.instances())
+        timing.items = len(instances) + len(volumes)
+    return instances, volumes
 
-def _output_reports(instances, volumes, report_list, opts):
 
-    for report_type in report_list:
+def _output_reports(instances, volumes, summary, report_list, opts, collected_regions=None):
 
-        if report_type == "Console":
-            reporter = ConsoleReporter()
-            reporter.write(instances, volumes)
-        elif report_type == "Email":
-            reporter = HtmlEmailTemplateReportWriter(opts.email_from,
+    now = datetime.utcnow()
+    snapshot = None
+    diff = None
+    if opts.snapshot:
+        snapshot = Snapshot(opts.snapshot)
+        with run_metrics().stage('snapshot') as timing:
+            timing.items = len(instances) + len(volumes)
+            records = snapshot_records(instances, volumes)
+            # regions that were not collected keep their saved records
+            diff = snapshot.diff(records, now, collected_regions)
+            if diff is not None:
+                records = diff.records
+
+    mailer = None
+    if "Email" in report_list or "DiffEmail" in report_list:
+        # one smtp session is shared by every email sent this run
+        mailer = SmtpMailer(host=opts.smtp_host, port=opts.smtp_port,
+                            username=opts.email_from, password=opts.email_password,
+                            starttls=not opts.smtp_no_starttls)
+        if opts.email_background:
+            mailer = BackgroundMailer(mailer)
+
+    try:
+        for report_type in report_list:
+
+            with run_metrics().stage('report:{}'.format(report_type)) as timing:
+                timing.items = len(instances)
+
+                if report_type == "Console":
+                    reporter = ConsoleReporter(top=opts.top)
+                    reporter.write(instances, volumes, summary)
+                elif report_type == "Email":
+                    reporter = HtmlEmailTemplateReportWriter(opts.email_from,
+                                                             opts.email_to.split(","),
+                                                             opts.email_password,
+                                                             top=opts.top,
+                                                             mailer=mailer)
+                    reporter.write(instances, volumes, summary)
+                elif report_type == "Diff":
+                    reporter = DiffConsoleReporter(top=opts.top)
+                    reporter.write(diff)
+                elif report_type == "DiffEmail":
+                    reporter = DiffEmailReportWriter(opts.email_from,
                                                      opts.email_to.split(","),
-                                                     opts.email_password)
-            reporter.write(instances, volumes)
+                                                     opts.email_password,
+                                                     top=opts.top,
+                                                     mailer=mailer)
+                    reporter.write(diff)
+                elif report_type in EXPORTS:
+                    export(open_exports([report_type], opts.export_out), instances, volumes)
+    finally:
+        if mailer is not None:
+            # waits for any email sent in the background
+            with run_metrics().stage('mail_close'):
+                mailer.close()
+
+    # only once the reports are out, so a failed email is sent again next run
+    if snapshot is not None:
+        if isinstance(mailer, BackgroundMailer) and mailer.failures:
+            logging.warning("Not saving snapshot {}, {} emails could not be sent".format(opts.snapshot,
+                                                                                         mailer.failures))
+            return
+
+        with run_metrics().stage('snapshot_save') as timing:
+            timing.items = len(records)
+            snapshot.save(records, now)
+
+
+def _record_api_stats(aws_access_key, collected_regions):
+    metrics = run_metrics()
+    if not metrics.enabled:
+        return
+
+    for region in collected_regions:
+        stats = shared_throttle(region, aws_access_key).stats
+        metrics.record('ec2_api', region, calls=stats.calls, retries=stats.retries,
+                       throttles=stats.throttles, errors=stats.errors, failures=stats.failures)
+
+
+def _print_api_stats(stats):
+    print("EC2 calls : {}, throttled : {}, errors : {}, retried : {}, gave up : {}".format(
+                                            stats.calls,
+                                            stats.throttles,
+                                            stats.errors,
+                                            stats.retries,
+                                            stats.failures), file=sys.stderr)
+
+
+def _reportable(now, whitelist, instances, grace_period_in_hours=GRACE_PERIOD_IN_HOURS):
+    return [instance for instance in instances if _is_reportable(now, whitelist, instance, grace_period_in_hours)]
+
+
+def _is_reportable(now, whitelist, instance, grace_period_in_hours=GRACE_PERIOD_IN_HOURS):
+    return whitelist.ok(instance) and _running_before_min_age(now, instance.launchedAtUtc, grace_period_in_hours)
 
 
 def _running_before_min_age(now, launched_at, grace_period_in_hours):
@@ -124,15 +848,98 @@ def _running_before_min_age(now, launched_at, grace_period_in_hours):
 
 class Whitelist(object):
     """Maintains a white list of instances which are
-    to be excluded from the reports"""
+    to be excluded from the reports
+
+    Each item in the file is one rule, an instance matching any rule is
+    excluded :
+
+        {"identifier": "i-123"}                         exact instance id
+        {"instance_type": "t2.nano"}                    exact instance type
+        {"tag": {"key": "env", "value": "dev"}}         tag with value
+        {"tag": {"key": "ci"}}                          tag with any value
+        {"pattern": "i-0ab*", "field": "identifier"}    glob on identifier or keyname
+        {"regex": "^jenkins-", "field": "keyname"}      regex on identifier or keyname
+
+    A glob matches the whole value, a regex anywhere in it unless it is
+    anchored, as with re.search.
+
+    The rules are compiled once into hashed sets and one combined regex
+    of the globs per field, so checking an instance does not grow with
+    the number of exact rules. Each regex rule is compiled on its own so
+    its groups, backreferences and inline flags keep their meaning.
+    """
+
+    _fields = ('identifier', 'keyname')
+
     def __init__(self, whitelistfile='data.whitelist.json'):
         # REVIEW : is it okay if this just throws
         with open(whitelistfile) as data_file:
             json_contents = json.load(data_file)
-            self._data = map(lambda i: i['identifier'], json_contents['items'])
 
-    def ok(self, identifier):
-        return identifier not in self._data
+        self._identifiers = set()
+        self._instance_types = set()
+        self._tags = set()
+        self._tag_keys = set()
+        globs = dict((field, []) for field in self._fields)
+        regexes = dict((field, []) for field in self._fields)
+
+        for item in json_contents['items']:
+            if 'identifier' in item:
+                self._identifiers.add(item['identifier'])
+            if 'instance_type' in item:
+                self._instance_types.add(item['instance_type'])
+            if 'tag' in item:
+                if 'value' in item['tag']:
+                    self._tags.add((item['tag']['key'], item['tag']['value']))
+                else:
+                    self._tag_keys.add(item['tag']['key'])
+            if 'pattern' in item:
+                globs[item.get('field', 'identifier')].append(self._translate_glob(item['pattern']))
+            if 'regex' in item:
+                regexes[item.get('field', 'identifier')].append(self._compile_regex(item['regex']))
+
+        self._patterns = []
+        for field in self._fields:
+            patterns = regexes[field]
+            if globs[field]:
+                patterns.insert(0, re.compile('|'.join('(?:{})'.format(p) for p in globs[field])))
+            if patterns:
+                self._patterns.append((field, patterns))
+
+    def ok(self, instance):
+        if instance.identifier in self._identifiers:
+            return False
+        if instance.aws_instance_type in self._instance_types:
+            return False
+
+        if self._tags or self._tag_keys:
+            for tag in (instance.tags or {}).items():
+                if tag in self._tags or tag[0] in self._tag_keys:
+                    return False
+
+        for field, patterns in self._patterns:
+            value = getattr(instance, field)
+            if value is not None and any(pattern.search(value) for pattern in patterns):
+                return False
+
+        return True
+
+    def _compile_regex(self, regex):
+        try:
+            return re.compile(regex)
+        except re.error as e:
+            raise ValueError("Invalid whitelist regex {} : {}".format(regex, e))
+
+    def _translate_glob(self, glob):
+        # fnmatch appends its flags to the pattern, which can not be
+        # combined with other patterns, so only keep the expression. it
+        # has no groups of its own and anchors the end only, the start is
+        # anchored here as the combined regex is searched
+        pattern = fnmatch.translate(glob)
+        if pattern.endswith('(?ms)'):
+            pattern = pattern[:-len('(?ms)')]
+        return r'\A' + pattern
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Benchmark of the batch cost engine against the per object methods.
+
+Checks both produce identical costs and times each over a synthetic
+fleet, both including the round trip through the resource objects and
+for the array kernels alone. Uses numpy when it is installed.
+
+    python -m benchmarks.batch_cost [count]
+"""
+
+from __future__ import print_function
+
+from array import array
+from datetime import datetime, timedelta
+import sys
+import time
+
+from aws import cost
+from aws.aws import AWSInstance, AWSVolume
+from aws.cost import BatchCostCalculator, instance_costs, to_microseconds, volume_costs
+
+TYPES = [('t2.micro', 0.013), ('m4.large', 0.12), ('c4.xlarge', 0.209), ('r3.2xlarge', 0.665)]
+VOLUMES = [('gp2', 0.1, 0.0), ('io1', 0.125, 0.065), ('standard', 0.05, 0.05)]
+
+
+def _fleet(count):
+    launched = datetime(2016, 1, 1)
+    instances = []
+    volumes = []
+
+    for index in range(count):
+        aws_type, price = TYPES[index % len(TYPES)]
+        instances.append(AWSInstance('i-{}'.format(index), launched + timedelta(seconds=index * 37, microseconds=index),
+                                     'us-east-1', aws_type, 'key', price, {}))
+        volume_type, per_gb, iops_cost = VOLUMES[index % len(VOLUMES)]
+        volumes.append(AWSVolume('vol-{}'.format(index), 8 + index % 500, volume_type, 'us-east-1',
+                                 1000 if volume_type == 'io1' else None, launched, per_gb, iops_cost))
+
+    return instances, volumes
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    now = datetime(2016, 6, 1, 12, 30, 15, 250000)
+    instances, volumes = _fleet(count)
+
+    start = time.time()
+    for instance in instances:
+        instance.calculate_cost(now)
+    for volume in volumes:
+        volume.calculate_cost()
+    per_object = time.time() - start
+
+    expected = [i.cost for i in instances] + [v.cost for v in volumes]
+
+    start = time.time()
+    calculator = BatchCostCalculator(now)
+    calculator.cost_instances(instances)
+    calculator.cost_volumes(volumes)
+    batch = time.time() - start
+
+    assert expected == [i.cost for i in instances] + [v.cost for v in volumes]
+
+    launched_at_us = array('l', [to_microseconds(i.launchedAtUtc) for i in instances])
+    costs_per_hour = array('d', [i.cost_per_hour for i in instances])
+    columns = ([v.type for v in volumes],
+               array('d', [v.size for v in volumes]),
+               array('d', [v.provisioned_iops or 0 for v in volumes]),
+               array('d', [v.cost_per_gb for v in volumes]),
+               array('d', [v.iops_cost for v in volumes]))
+
+    start = time.time()
+    instance_costs(launched_at_us, costs_per_hour, now)
+    volume_costs(*columns)
+    kernels = time.time() - start
+
+    print("resources : {} instances, {} volumes".format(count, count))
+    print("numpy : {}".format(cost.numpy is not None))
+    print("per object : {:.2f} s".format(per_object))
+    print("batch (objects) : {:.2f} s".format(batch))
+    print("batch (arrays) : {:.2f} s".format(kernels))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Benchmark of decoding DescribeInstances / DescribeVolumes responses.
+
+Replicates the recorded responses in benchmarks/fixtures to a fleet of
+the requested size and compares boto's object construction plus
+strptime against the lightweight readers in aws.describe.
+
+    python -m benchmarks.describe_decode [count]
+"""
+
+from __future__ import print_function
+
+from datetime import datetime
+from io import BytesIO
+import os
+import re
+import sys
+import time
+import xml.sax
+
+import boto.handler
+from boto.ec2.instance import Reservation
+from boto.ec2.volume import Volume
+from boto.resultset import ResultSet
+
+from aws.describe import DescribeInstancesReader, DescribeVolumesReader, parse_iso8601
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _fixture(name, item_set, count):
+    # the recorded response holds a single item, repeat it
+    with open(os.path.join(FIXTURES, name), 'rb') as fixture:
+        body = fixture.read()
+
+    match = re.search(b'(<' + item_set + b'>\\s*)(<item>.*</item>)(\\s*</' + item_set + b'>)', body, re.S)
+    items = match.group(2) * count
+    return body[:match.start(2)] + items + body[match.end(2):]
+
+
+def _boto_instances(body):
+    reservations = ResultSet([('item', Reservation)])
+    xml.sax.parseString(body, boto.handler.XmlHandler(reservations, None))
+    for reservation in reservations:
+        for instance in reservation.instances:
+            yield datetime.strptime(instance.launch_time, '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _boto_volumes(body):
+    volumes = ResultSet([('item', Volume)])
+    xml.sax.parseString(body, boto.handler.XmlHandler(volumes, None))
+    for volume in volumes:
+        yield datetime.strptime(volume.create_time, '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _fast_instances(body):
+    for reservation in DescribeInstancesReader(BytesIO(body)):
+        for instance in reservation.instances:
+            yield parse_iso8601(instance.launch_time)
+
+
+def _fast_volumes(body):
+    for volume in DescribeVolumesReader(BytesIO(body)):
+        yield parse_iso8601(volume.create_time)
+
+
+def _per_second(decode, body, count):
+    start = time.time()
+    decoded = sum(1 for _ in decode(body))
+    elapsed = time.time() - start
+    assert decoded == count
+    return count / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    instances = _fixture('describe_instances.xml', b'reservationSet', count)
+    volumes = _fixture('describe_volumes.xml', b'volumeSet', count)
+
+    print("resources per response : {}".format(count))
+    print("instances boto : {:.0f}/sec".format(_per_second(_boto_instances, instances, count)))
+    print("instances fast : {:.0f}/sec".format(_per_second(_fast_instances, instances, count)))
+    print("volumes boto : {:.0f}/sec".format(_per_second(_boto_volumes, volumes, count)))
+    print("volumes fast : {:.0f}/sec".format(_per_second(_fast_volumes, volumes, count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""Offline end to end benchmark of a report run.
+
+Generates a SyntheticFleet and serves it to AWS through a stub
+connection, then times each stage of a report run in turn : fetch,
+parse, price lookup, whitelist, costing, aggregate and rendering the
+console and email reports. Prints one JSON document with the seconds,
+items per second and peak resident memory of every stage, to compare
+between versions.
+
+    python -m benchmarks.end_to_end [instances] [volumes] [fast|boto]
+"""
+
+from __future__ import print_function
+
+from datetime import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from aws.aws import AWS, INSTANCE_PAGE_SIZE, VOLUME_PAGE_SIZE
+from aws.cost import BatchCostCalculator
+from aws.price import AWSPricingStore
+from aws_reporter import Whitelist, _reportable
+from benchmarks.fleet import SyntheticFleet, StubEC2Connection
+from reports.aggregate import aggregate
+from reports.console_report import ConsoleReporter
+from reports.email_report import HtmlEmailTemplateReportWriter
+
+# far above what the stub needs, so the throttle never waits
+API_RATE = 1e9
+TAG_KEYS = ['team', 'env']
+
+
+class _Replay(object):
+    """Hands AWS records already fetched, in place of an InventoryCache"""
+
+    def __init__(self, instances, volumes):
+        self._instances = instances
+        self._volumes = volumes
+
+    def instances(self, region, state, fetch):
+        return self._instances
+
+    def volumes(self, region, fetch):
+        return self._volumes
+
+
+class _NullMailer(object):
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, from_address, recipients, title, htmlmessage):
+        self.sent += len(htmlmessage)
+
+
+class _NullOutput(object):
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, text):
+        self.written += len(text)
+
+    def flush(self):
+        pass
+
+
+class _Stages(object):
+
+    def __init__(self):
+        self.stages = []
+
+    def record(self, name, seconds, items):
+        self.stages.append({'stage': name,
+                            'seconds': round(seconds, 4),
+                            'items': items,
+                            'per_second': round(items / seconds) if seconds else None,
+                            'peak_rss_mb': _peak_rss_mb()})
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def _whitelist_file(directory):
+    # a handful of each kind of rule, as a real whitelist has
+    rules = [{"identifier": "i-{:017x}".format(index * 97)} for index in range(200)]
+    rules.extend([{"instance_type": "x1.32xlarge"},
+                  {"tag": {"key": "env", "value": "ci"}},
+                  {"pattern": "i-00000000000000ff*", "field": "identifier"},
+                  {"regex": "^deploy-team-39$", "field": "keyname"}])
+
+    path = os.path.join(directory, 'whitelist.json')
+    with open(path, 'w') as whitelist_file:
+        json.dump({"items": rules}, whitelist_file)
+    return path
+
+
+def _run(fleet, fast_ingest, whitelist_file, stages):
+    now = datetime.utcnow()
+    price_store = AWSPricingStore()
+    price_store.load()
+    connections = dict((region, StubEC2Connection(fleet, region)) for region in fleet.regions)
+
+    def aws(region, inventory=None):
+        return AWS('benchmark', 'stub', region, price_store=price_store, fast_ingest=fast_ingest,
+                   inventory_cache=inventory, api_rate=API_RATE, connection=connections[region])
+
+    # fetch and parse run together, the stub times its share
+    start = time.time()
+    records = {}
+    for region in fleet.regions:
+        ec2 = aws(region)
+        records[region] = (list(ec2._instance_records('running', None, INSTANCE_PAGE_SIZE)),
+                           list(ec2._volume_records(None, VOLUME_PAGE_SIZE)))
+    elapsed = time.time() - start
+    fetch = sum(connection.fetch_seconds for connection in connections.values())
+    resources = fleet.instance_count + fleet.volume_count
+    # fetch counts pages, every other stage counts resources
+    stages.record('fetch', fetch, sum(connection.requests for connection in connections.values()))
+    stages.record('parse', elapsed - fetch, resources)
+
+    start = time.time()
+    instances = []
+    volumes = []
+    for region in fleet.regions:
+        ec2 = aws(region, _Replay(*records.pop(region)))
+        instances.extend(ec2.instances())
+        volumes.extend(ec2.volumes())
+    stages.record('price_lookup', time.time() - start, resources)
+    assert (len(instances), len(volumes)) == (fleet.instance_count, fleet.volume_count)
+
+    start = time.time()
+    reportable = _reportable(now, Whitelist(whitelist_file), instances)
+    stages.record('whitelist', time.time() - start, len(instances))
+
+    start = time.time()
+    calculator = BatchCostCalculator(now)
+    calculator.cost_volumes(volumes)
+    calculator.cost_instances(reportable)
+    stages.record('costing', time.time() - start, len(reportable) + len(volumes))
+
+    start = time.time()
+    summary = aggregate(reportable, volumes, tag_keys=TAG_KEYS)
+    stages.record('aggregate', time.time() - start, len(reportable) + len(volumes))
+
+    output = _NullOutput()
+    stdout, sys.stdout = sys.stdout, output
+    try:
+        start = time.time()
+        ConsoleReporter().write(reportable, volumes, summary)
+        stages.record('render_console', time.time() - start, len(reportable))
+    finally:
+        sys.stdout = stdout
+
+    mailer = _NullMailer()
+    start = time.time()
+    HtmlEmailTemplateReportWriter('from@example.com', ['to@example.com'], None,
+                                  mailer=mailer).write(reportable, volumes, summary)
+    stages.record('render_email', time.time() - start, len(reportable))
+
+    return len(reportable), output.written, mailer.sent
+
+
+def main():
+    instance_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    volume_count = int(sys.argv[2]) if len(sys.argv) > 2 else instance_count
+    ingest = sys.argv[3] if len(sys.argv) > 3 else 'fast'
+
+    directory = tempfile.mkdtemp(prefix='fleet')
+    try:
+        fleet = SyntheticFleet(instance_count, volume_count, directory)
+        start = time.time()
+        fleet_bytes = fleet.write()
+        generate = time.time() - start
+
+        stages = _Stages()
+        start = time.time()
+        reported, console_bytes, email_bytes = _run(fleet, ingest == 'fast', _whitelist_file(directory), stages)
+        total = time.time() - start
+    finally:
+        shutil.rmtree(directory)
+
+    print(json.dumps({'benchmark': 'end_to_end',
+                      'python': platform.python_version(),
+                      'ingest': ingest,
+                      'instances': instance_count,
+                      'volumes': volume_count,
+                      'reported_instances': reported,
+                      'response_mb': round(fleet_bytes / 1e6, 1),
+                      'console_mb': round(console_bytes / 1e6, 1),
+                      'email_mb': round(email_bytes / 1e6, 1),
+                      'generate_seconds': round(generate, 2),
+                      'seconds': round(total, 4),
+                      'per_second': round((instance_count + volume_count) / total),
+                      'peak_rss_mb': _peak_rss_mb(),
+                      'stages': stages.stages}, indent=2, sort_keys=True, separators=(",", ": ")))
+
+
+if __name__ == '__main__':
+    main()
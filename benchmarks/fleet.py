@@ -0,0 +1,214 @@
+"""Synthetic EC2 fleet for the offline benchmarks.
+
+SyntheticFleet spreads instances and volumes over the regions with a
+realistic mix of instance types, volume types, keynames and tags, and
+writes them out as the paged DescribeInstances / DescribeVolumes
+responses EC2 would send. StubEC2Connection answers AWS from those
+pages in place of EC2, so a whole report run can be timed offline.
+"""
+
+from __future__ import print_function
+
+from datetime import datetime, timedelta
+from io import BytesIO
+import json
+import os
+import random
+import time
+
+from boto.ec2.connection import EC2Connection
+from boto.regioninfo import RegionInfo
+
+from aws.aws import INSTANCE_PAGE_SIZE, VOLUME_PAGE_SIZE
+
+# share of the fleet in each region, most accounts lean on a few
+REGION_WEIGHTS = [('us-east-1', 40), ('us-west-2', 20), ('eu-west-1', 15), ('us-west-1', 6),
+                  ('eu-central-1', 6), ('ap-southeast-1', 4), ('ap-southeast-2', 4),
+                  ('ap-northeast-1', 4), ('sa-east-1', 1)]
+ENVIRONMENTS = [('prod', 50), ('dev', 25), ('staging', 20), ('ci', 5)]
+VOLUME_TYPES = [('gp2', 70), ('standard', 20), ('io1', 10)]
+VOLUME_SIZES = [8, 8, 20, 50, 100, 100, 500, 1000]
+TEAMS = 40
+# the smaller types in each region account for most instances
+COMMON_TYPES = 8
+
+RESPONSE = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+            b'<{action}Response xmlns="http://ec2.amazonaws.com/doc/2015-10-01/">'
+            b'<requestId>8f7724cf-496f-496e-8fe3-example</requestId>'
+            b'<{item_set}>{items}</{item_set}>{next_token}</{action}Response>')
+
+INSTANCE = ('<item><reservationId>r-{index:017x}</reservationId><ownerId>123456789012</ownerId><groupSet/>'
+            '<instancesSet><item><instanceId>i-{index:017x}</instanceId><imageId>ami-{image:08x}</imageId>'
+            '<instanceState><code>16</code><name>running</name></instanceState>'
+            '<privateDnsName>ip-10-{a}-{b}-{c}.{region}.compute.internal</privateDnsName>{key}'
+            '<amiLaunchIndex>0</amiLaunchIndex><instanceType>{instance_type}</instanceType>'
+            '<launchTime>{launched}</launchTime><placement><availabilityZone>{region}a</availabilityZone>'
+            '<tenancy>default</tenancy></placement><monitoring><state>disabled</state></monitoring>'
+            '<privateIpAddress>10.{a}.{b}.{c}</privateIpAddress><architecture>x86_64</architecture>'
+            '<rootDeviceType>ebs</rootDeviceType><tagSet>{tags}</tagSet><hypervisor>xen</hypervisor>'
+            '</item></instancesSet></item>')
+
+VOLUME = ('<item><volumeId>vol-{index:017x}</volumeId><size>{size}</size><snapshotId/>'
+          '<availabilityZone>{region}a</availabilityZone><status>in-use</status>'
+          '<createTime>{created}</createTime><tagSet>{tags}</tagSet>'
+          '<volumeType>{volume_type}</volumeType>{iops}<encrypted>false</encrypted></item>')
+
+TAG = '<item><key>{}</key><value>{}</value></item>'
+
+
+class SyntheticFleet(object):
+    """Instances and volumes written as pages of describe responses to a
+    directory, one file per region and action.
+
+    The fleet is the same for the same counts and seed, launch and
+    create times are relative to now.
+    """
+
+    def __init__(self, instances, volumes, directory, seed=0, now=None,
+                 price_file='data.aws.ondemand.json'):
+        self.instance_count = instances
+        self.volume_count = volumes
+        self._directory = directory
+        self._seed = seed
+        self._now = now or datetime.utcnow()
+        # (region, action) -> list of (offset, length) of each page
+        self._pages = {}
+
+        with open(price_file) as data_file:
+            self._types = dict((region['region'], [t['type'] for t in region['instanceTypes']])
+                               for region in json.load(data_file)['regions'])
+
+    @property
+    def regions(self):
+        return [region for region, weight in REGION_WEIGHTS]
+
+    def write(self):
+        """Generates every page, returns the number of bytes written"""
+        random_ = random.Random(self._seed)
+        written = 0
+
+        for action, count, page_size, item in [('DescribeInstances', self.instance_count,
+                                                 INSTANCE_PAGE_SIZE, self._instance),
+                                                ('DescribeVolumes', self.volume_count,
+                                                 VOLUME_PAGE_SIZE, self._volume)]:
+            shares = self._split(count)
+            index = 0
+            for region, share in zip(self.regions, shares):
+                written += self._write_region(random_, action, region, index, share, page_size, item)
+                index += share
+
+        return written
+
+    def page(self, region, action, number):
+        """:returns: body of one page of a describe response"""
+        offset, length = self._pages[(region, action)][number]
+        with open(self._path(region, action), 'rb') as pages:
+            pages.seek(offset)
+            return pages.read(length)
+
+    def _split(self, count):
+        total = sum(weight for region, weight in REGION_WEIGHTS)
+        shares = [count * weight // total for region, weight in REGION_WEIGHTS]
+        shares[0] += count - sum(shares)
+        return shares
+
+    def _write_region(self, random_, action, region, first, count, page_size, item):
+        item_set = b'reservationSet' if action == 'DescribeInstances' else b'volumeSet'
+        pages = self._pages[(region, action)] = []
+        offset = 0
+        page_count = max(1, (count + page_size - 1) // page_size)
+
+        with open(self._path(region, action), 'wb') as out:
+            for number in range(page_count):
+                start = first + number * page_size
+                items = ''.join(item(random_, region, index)
+                                for index in range(start, min(first + count, start + page_size)))
+                next_token = ''
+                if number + 1 < page_count:
+                    next_token = '<nextToken>{}</nextToken>'.format(number + 1)
+
+                body = (RESPONSE.replace(b'{action}', action.encode('utf-8'))
+                                .replace(b'{item_set}', item_set)
+                                .replace(b'{next_token}', next_token.encode('utf-8'))
+                                .replace(b'{items}', items.encode('utf-8')))
+                out.write(body)
+                pages.append((offset, len(body)))
+                offset += len(body)
+
+        return offset
+
+    def _instance(self, random_, region, index):
+        types = self._types[region]
+        instance_type = random_.choice(types[:COMMON_TYPES] if random_.random() < 0.8 else types)
+        team = 'team-{}'.format(random_.randrange(TEAMS))
+
+        key = ''
+        if random_.random() < 0.95:
+            key = '<keyName>deploy-{}</keyName>'.format(team)
+
+        return INSTANCE.format(index=index, image=random_.getrandbits(32), region=region,
+                               a=index >> 16 & 255, b=index >> 8 & 255, c=index & 255,
+                               key=key, instance_type=instance_type,
+                               launched=self._timestamp(random_), tags=self._tags(random_, index, team))
+
+    def _volume(self, random_, region, index):
+        volume_type = _weighted(random_, VOLUME_TYPES)
+        size = random_.choice(VOLUME_SIZES)
+
+        iops = ''
+        if volume_type == 'io1':
+            iops = '<iops>{}</iops>'.format(min(20000, size * 30))
+
+        return VOLUME.format(index=index, size=size, region=region, created=self._timestamp(random_),
+                             tags=self._tags(random_, index, 'team-{}'.format(random_.randrange(TEAMS))),
+                             volume_type=volume_type, iops=iops)
+
+    def _tags(self, random_, index, team):
+        tags = [TAG.format('Name', 'server-{}'.format(index))]
+        # a few resources are never tagged beyond a name
+        if random_.random() < 0.9:
+            tags.append(TAG.format('team', team))
+            tags.append(TAG.format('env', _weighted(random_, ENVIRONMENTS)))
+        return ''.join(tags)
+
+    def _timestamp(self, random_):
+        # most resources are weeks old, a few launched within the last day
+        age = timedelta(days=min(720, random_.expovariate(1 / 60.0)))
+        return (self._now - age).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def _path(self, region, action):
+        return os.path.join(self._directory, '{}.{}.xml'.format(region, action))
+
+
+class StubResponse(BytesIO):
+    """Enough of an httplib response for boto and aws.describe"""
+
+    status = 200
+    reason = 'OK'
+
+
+class StubEC2Connection(EC2Connection):
+    """EC2Connection answering every request from a SyntheticFleet,
+    timing how long it spends handing back pages"""
+
+    def __init__(self, fleet, region):
+        EC2Connection.__init__(self, 'stub', 'stub', region=RegionInfo(name=region, endpoint='127.0.0.1'))
+        self._fleet = fleet
+        self.fetch_seconds = 0.0
+        self.requests = 0
+
+    def make_request(self, action, params=None, path='/', verb='GET', *args, **kwargs):
+        start = time.time()
+        body = self._fleet.page(self.region.name, action, int((params or {}).get('NextToken', 0)))
+        self.fetch_seconds += time.time() - start
+        self.requests += 1
+        return StubResponse(body)
+
+
+def _weighted(random_, choices):
+    point = random_.uniform(0, sum(weight for value, weight in choices))
+    for value, weight in choices:
+        point -= weight
+        if point <= 0:
+            return value
+    return choices[-1][0]
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Benchmark of CostLedger queries.
+
+Records a year of hourly report runs for a synthetic fleet, compacting
+as aws_reporter.py does, then times the history queries.
+
+    python -m benchmarks.ledger_query [instances] [days]
+"""
+
+from __future__ import print_function
+
+from datetime import datetime, timedelta
+import os
+import sys
+import tempfile
+import time
+
+from aws.aws import AWSInstance
+from aws.ledger import CostLedger
+
+REGIONS = ['us-east-1', 'us-west-1', 'us-west-2', 'eu-west-1', 'ap-southeast-1']
+TYPES = ['t2.micro', 't2.medium', 'm4.large', 'c4.xlarge', 'r3.2xlarge']
+
+
+def _fleet(count, launched):
+    return [AWSInstance("i-{:017x}".format(index), launched, REGIONS[index % len(REGIONS)],
+                        TYPES[index % len(TYPES)], "deploy", 0.1 * (1 + index % 4),
+                        {"team": "team-{}".format(index % 12), "env": "prod"})
+            for index in range(count)]
+
+
+def _time(label, query, repeat=20):
+    start = time.time()
+    for _ in range(repeat):
+        rows = query()
+    elapsed = (time.time() - start) / repeat
+    print("{} : {:.1f} ms ({} rows)".format(label, elapsed * 1000, len(rows)))
+
+
+def main():
+    instance_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+
+    start_at = datetime(2016, 1, 1)
+    end_at = start_at + timedelta(days=days)
+    instances = _fleet(instance_count, start_at - timedelta(hours=1))
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        ledger = CostLedger(path)
+
+        start = time.time()
+        now = start_at
+        while now < end_at:
+            ledger.record(now, instances)
+            now += timedelta(hours=1)
+        print("recorded {} hourly runs of {} instances : {:.1f} s".format(days * 24, instance_count,
+                                                                         time.time() - start))
+        print("ledger size : {:.1f} MB".format(os.path.getsize(path) / 1e6))
+
+        _time("last week by region", lambda: ledger.spend(end_at - timedelta(days=7), end_at))
+        _time("year by day and region", lambda: ledger.spend(start_at, end_at))
+        _time("year by week and type", lambda: ledger.spend(start_at, end_at, group_by='instance_type',
+                                                            interval=7 * 86400))
+        _time("year by day and tag:team", lambda: ledger.spend(start_at, end_at, group_by='tag:team'))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Benchmark of importing the AWS EC2 offer file.
+
+Writes a synthetic offer file shaped like the real one, with products
+for several operating systems and tenancies plus on demand and reserved
+terms, then imports it in a child process. Fails if the peak resident
+memory of the import grows with the size of the file.
+
+    python -m benchmarks.offer_import [products]
+"""
+
+from __future__ import print_function
+
+from multiprocessing import Process, Queue
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from aws.offer import LOCATIONS, read_offer_file
+
+OPERATING_SYSTEMS = ['Linux', 'Windows', 'RHEL', 'SUSE']
+TENANCIES = ['Shared', 'Dedicated', 'Host']
+VOLUMES = [('gp2', 'GB-Mo', 'Storage'), ('io1', 'GB-Mo', 'Storage'), ('io1', 'IOPS-Mo', 'System Operation'),
+           ('standard', 'GB-Mo', 'Storage'), ('standard', 'IOs', 'System Operation')]
+
+# the import may hold its buffer, the wanted SKUs and prices, nothing
+# in proportion to the file
+MAX_PEAK_MB = 64
+
+
+def _product(index, locations):
+    sku = 'SKU{:012d}'.format(index)
+    location = locations[index % len(locations)]
+
+    if index % 10 == 0:
+        ebs_type, unit, family = VOLUMES[(index // 10) % len(VOLUMES)]
+        attributes = {"location": location, "volumeApiName": ebs_type, "servicecode": "AmazonEC2"}
+        return sku, unit, {"sku": sku, "productFamily": family, "attributes": attributes}
+
+    attributes = {"location": location,
+                  "instanceType": "type{}.{}xlarge".format(index % 300, index % 7),
+                  "operatingSystem": OPERATING_SYSTEMS[index % len(OPERATING_SYSTEMS)],
+                  "tenancy": TENANCIES[(index // 4) % len(TENANCIES)],
+                  "preInstalledSw": "NA", "capacitystatus": "Used",
+                  "licenseModel": "No License required", "servicecode": "AmazonEC2",
+                  "usagetype": "BoxUsage:type{}".format(index % 300), "vcpu": str(index % 64),
+                  "memory": "{} GiB".format(index % 512), "storage": "EBS only"}
+    return sku, 'Hrs', {"sku": sku, "productFamily": "Compute Instance", "attributes": attributes}
+
+
+def _term(sku, unit, index, code):
+    rate = "{}.{}.6YS6EN2CT7".format(sku, code)
+    return {"{}.{}".format(sku, code): {
+        "offerTermCode": code, "sku": sku, "effectiveDate": "2016-01-01T00:00:00Z",
+        "priceDimensions": {rate: {"rateCode": rate, "unit": unit, "beginRange": "0", "endRange": "Inf",
+                                   "description": "synthetic price dimension for benchmarking",
+                                   "pricePerUnit": {"USD": "{:.10f}".format(0.001 * (1 + index % 997))}}},
+        "termAttributes": {}}}
+
+
+def _write_offer_file(path, count):
+    locations = sorted(LOCATIONS)
+
+    with open(path, 'w') as offer_file:
+        offer_file.write('{\n  "formatVersion" : "v1.0",\n  "offerCode" : "AmazonEC2",\n  "products" : {\n')
+        for index in range(count):
+            sku, unit, product = _product(index, locations)
+            offer_file.write('{}    {} : {}'.format(',\n' if index else '', json.dumps(sku), json.dumps(product, indent=2)))
+
+        offer_file.write('\n  },\n  "terms" : {\n')
+        for term_index, (term_type, codes) in enumerate([('OnDemand', ['JRTCKXETXF']),
+                                                         ('Reserved', ['38NPMPTW36', '4NA7Y494T4', 'HU7G6KETJZ'])]):
+            offer_file.write('{}    {} : {{\n'.format(',\n' if term_index else '', json.dumps(term_type)))
+            for index in range(count):
+                sku, unit, product = _product(index, locations)
+                terms = {}
+                for code in codes:
+                    terms.update(_term(sku, unit, index, code))
+                offer_file.write('{}      {} : {}'.format(',\n' if index else '', json.dumps(sku), json.dumps(terms, indent=2)))
+            offer_file.write('\n    }')
+        offer_file.write('\n  }\n}\n')
+
+
+def _import(path, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    with open(path) as offer_file:
+        instance_prices, volume_rates = read_offer_file(offer_file)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux
+    results.put((len(instance_prices), len(volume_rates), elapsed, (after - before) / 1024.0))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    handle, path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    try:
+        _write_offer_file(path, count)
+        size_mb = os.path.getsize(path) / 1e6
+
+        results = Queue()
+        child = Process(target=_import, args=(path, results))
+        child.start()
+        instances, volumes, elapsed, peak_mb = results.get()
+        child.join()
+    finally:
+        os.remove(path)
+
+    print("offer file : {:.0f} MB, {} products".format(size_mb, count))
+    print("imported : {} instance prices, {} volume prices".format(instances, volumes))
+    print("import : {:.1f} s ({:.1f} MB/s)".format(elapsed, size_mb / elapsed))
+    print("peak memory added : {:.1f} MB".format(peak_mb))
+
+    assert peak_mb < MAX_PEAK_MB, "import used {:.1f} MB".format(peak_mb)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""Startup benchmark of AWSPricingStore.
+
+Compares a cold load from the JSON price files with a load from the
+compiled price snapshot.
+
+    python -m benchmarks.price_load
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import timeit
+
+from aws.price import AWSPricingStore
+
+
+def _load_time(cache_file, repeat=20):
+    def run():
+        AWSPricingStore(cache_file=cache_file).instance_cost_per_hour('us-east-1', 't2.micro')
+
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        cache_file = os.path.join(temp_dir, 'prices.cache')
+        # prime the snapshot
+        AWSPricingStore(cache_file=cache_file).instance_cost_per_hour('us-east-1', 't2.micro')
+
+        cold = _load_time(None)
+        cached = _load_time(cache_file)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print("json load : {:.2f} ms".format(cold * 1000))
+    print("snapshot load : {:.2f} ms".format(cached * 1000))
+    print("speed up : {:.1f}x".format(cold / cached))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Micro-benchmark of AWSPricingStore lookups.
+
+Compares the indexed lookups against the linear scans the store used
+to do for every instance and volume.
+
+    python -m benchmarks.price_lookup
+"""
+
+from __future__ import print_function
+
+import json
+import timeit
+
+from aws.price import AWSPricingStore, EBS_TYPES, PREVIOUS_GENERATION_PRICES, PriceNotFoundError
+
+
+class LinearScanPricingStore(object):
+    """The pre-index lookup, kept here only as a baseline."""
+
+    def __init__(self, instance_price_file='data.aws.ondemand.json',
+                        ebs_price_file='data.aws.ebs.json'):
+        with open(instance_price_file) as data_file:
+            self._instance_data = json.load(data_file)
+        with open(ebs_price_file) as data_file:
+            self._ebs_data = json.load(data_file)
+
+    def instance_cost_per_hour(self, aws_region, aws_type):
+        if (aws_region, aws_type) in PREVIOUS_GENERATION_PRICES:
+            return PREVIOUS_GENERATION_PRICES[(aws_region, aws_type)]
+        regions = [r for r in self._instance_data['regions'] if r['region'] == aws_region]
+        types = [t for t in regions[0]['instanceTypes'] if t['type'] == aws_type]
+        return types[0]['price']
+
+    def volume_costs(self, aws_region, ebs_type):
+        type_long_name, iops_long_name = EBS_TYPES[ebs_type]
+        region = [r for r in self._ebs_data['config']['regions'] if r['region'] == aws_region][0]
+        values = [t for t in region['types'] if t['name'] == type_long_name][0]['values']
+        per_gb = float([p for p in values if p['rate'] == 'perGBmoProvStorage'][0]['prices']['USD'])
+        iops = 0.0
+        if iops_long_name is not None:
+            iops = float([p for p in values if p['rate'] == iops_long_name][0]['prices']['USD'])
+        return per_gb, iops
+
+
+def _sample_keys():
+    with open('data.aws.ondemand.json') as data_file:
+        instance_data = json.load(data_file)
+    instance_keys = [(r['region'], t['type']) for r in instance_data['regions'] for t in r['instanceTypes']]
+    volume_keys = [(region, ebs_type) for region, _ in instance_keys[::20] for ebs_type in EBS_TYPES]
+    return instance_keys, volume_keys
+
+
+def _has_volume_price(store, key):
+    try:
+        store.volume_costs(*key)
+        return True
+    except PriceNotFoundError:
+        return False
+
+
+def _lookups_per_second(store, instance_keys, volume_keys, repeat=5):
+    def run():
+        for region, aws_type in instance_keys:
+            store.instance_cost_per_hour(region, aws_type)
+        for region, ebs_type in volume_keys:
+            store.volume_costs(region, ebs_type)
+
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return (len(instance_keys) + len(volume_keys)) / best
+
+
+def main():
+    instance_keys, volume_keys = _sample_keys()
+    # volumes are only priced for regions present in the ebs data
+    indexed = AWSPricingStore()
+    volume_keys = [k for k in volume_keys if _has_volume_price(indexed, k)]
+
+    before = _lookups_per_second(LinearScanPricingStore(), instance_keys, volume_keys)
+    after = _lookups_per_second(indexed, instance_keys, volume_keys)
+
+    print("lookups : {} instance, {} volume".format(len(instance_keys), len(volume_keys)))
+    print("linear scan : {:.0f} lookups/sec".format(before))
+    print("indexed : {:.0f} lookups/sec".format(after))
+    print("speed up : {:.1f}x".format(after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Benchmark of costing instances over a timeline of price changes.
+
+Gives every instance a monthly price change over three years and times
+BatchCostCalculator against the same fleet on flat prices. A sample of
+the costs is checked against charging each hour separately.
+
+    python -m benchmarks.price_timeline [count]
+"""
+
+from __future__ import print_function
+
+from datetime import datetime, timedelta
+import sys
+import time
+
+from aws.aws import AWSInstance
+from aws.cost import BatchCostCalculator, price_timeline, to_microseconds
+
+START = datetime(2014, 1, 1)
+MONTHS = 36
+
+
+def _timeline(price):
+    starts = tuple(to_microseconds(datetime(START.year + month // 12, month % 12 + 1, 1))
+                   for month in range(MONTHS))
+    prices = tuple(round(price * (1 - 0.01 * month), 6) for month in range(MONTHS))
+    return price_timeline(starts, prices)
+
+
+def _fleet(count, timelines, with_timelines):
+    instances = []
+    for index in range(count):
+        timeline = timelines[index % len(timelines)]
+        instances.append(AWSInstance('i-{}'.format(index), START + timedelta(hours=index * 7 % (MONTHS * 720)),
+                                     'us-east-1', 'm4.large', 'key', timeline[1][-1], {},
+                                     timeline if with_timelines else None))
+    return instances
+
+
+def _hour_by_hour(instance, now):
+    starts, prices, accrued = instance.price_timeline
+    at_us = to_microseconds(instance.launchedAtUtc)
+    now_us = to_microseconds(now)
+    cost = 0.0
+    while at_us < now_us:
+        segment = max([i for i, start in enumerate(starts) if start <= at_us] or [0])
+        cost += prices[segment]
+        at_us += 3600 * 1000000
+    return cost
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    now = datetime(2017, 1, 1, 6, 0)
+    timelines = [_timeline(0.1 + 0.05 * index) for index in range(8)]
+
+    flat = _fleet(count, timelines, False)
+    varying = _fleet(count, timelines, True)
+
+    start = time.time()
+    BatchCostCalculator(now).cost_instances(flat)
+    flat_time = time.time() - start
+
+    start = time.time()
+    BatchCostCalculator(now).cost_instances(varying)
+    timeline_time = time.time() - start
+
+    # instances launch on the hour and prices change at midnight so
+    # charging every hour at its starting price is exact
+    for instance in varying[::max(1, count // 200)]:
+        assert abs(instance.cost - _hour_by_hour(instance, now)) < 1e-6, instance.identifier
+
+    print("instances : {}, price changes per instance : {}".format(count, MONTHS - 1))
+    print("flat prices : {:.2f} s".format(flat_time))
+    print("price timelines : {:.2f} s".format(timeline_time))
+
+
+if __name__ == '__main__':
+    main()
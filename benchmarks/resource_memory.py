@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Memory benchmark of the AWSInstance / AWSVolume resource model.
+
+Builds a fleet in a child process and reports the resident memory it
+added per resource, for the current classes and for plain dict backed
+classes equivalent to the previous model.
+
+    python -m benchmarks.resource_memory [count]
+"""
+
+from __future__ import print_function
+
+from datetime import datetime, timedelta
+from multiprocessing import Process, Queue
+import resource
+import sys
+
+from aws.aws import AWSInstance, AWSVolume
+
+
+class DictInstance(object):
+
+    def __init__(self, identifier, launchedAtUtc, aws_region,
+                 aws_instance_type, keyname, cost_per_hour, tags=[]):
+        self.identifier = identifier
+        self.cost_per_hour = cost_per_hour
+        self.launchedAtUtc = launchedAtUtc
+        self.aws_region = aws_region
+        self.aws_instance_type = aws_instance_type
+        self.keyname = keyname
+        self.tags = tags
+        self.cost = 0.0
+
+
+class DictVolume(object):
+
+    def __init__(self, identifier, size, volume_type, aws_region, iops, createdAtUtc, cost_per_gb, iops_cost):
+        self.identifier = identifier
+        self.size = size
+        self.type = volume_type
+        self.aws_region = aws_region,
+        self.provisioned_iops = iops
+        self.createdAtUtc = createdAtUtc
+        self.cost_per_gb = cost_per_gb
+        self.iops_cost = iops_cost
+        self.cost = 0.0
+
+
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'ap-southeast-2']
+TYPES = ['t2.micro', 't2.medium', 'm4.large', 'c4.xlarge', 'r3.2xlarge']
+
+
+def _fresh(value):
+    # a decoder hands back a new string object per resource
+    return ''.join(list(value))
+
+
+def _build(instance_class, volume_class, count):
+    launched = datetime(2016, 1, 1)
+    fleet = []
+
+    for index in range(count):
+        region = _fresh(REGIONS[index % len(REGIONS)])
+        tags = {_fresh('team'): _fresh('platform'), _fresh('Name'): 'server-{}'.format(index)}
+        fleet.append(instance_class('i-{:017x}'.format(index), launched + timedelta(minutes=index),
+                                    region, _fresh(TYPES[index % len(TYPES)]),
+                                    _fresh('deploy-key'), 0.052, tags))
+        fleet.append(volume_class('vol-{:017x}'.format(index), 80, _fresh('gp2'), _fresh(region),
+                                  None, launched, 0.1, 0.0))
+    return fleet
+
+
+def _measure(instance_class, volume_class, count, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fleet = _build(instance_class, volume_class, count)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux
+    results.put((after - before) * 1024.0 / len(fleet))
+
+
+def _bytes_per_resource(instance_class, volume_class, count):
+    results = Queue()
+    child = Process(target=_measure, args=(instance_class, volume_class, count, results))
+    child.start()
+    measured = results.get()
+    child.join()
+    return measured
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    before = _bytes_per_resource(DictInstance, DictVolume, count)
+    after = _bytes_per_resource(AWSInstance, AWSVolume, count)
+
+    print("resources : {} instances, {} volumes".format(count, count))
+    print("dict backed : {:.0f} bytes/resource".format(before))
+    print("slots + interned : {:.0f} bytes/resource".format(after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Benchmark of the snapshot diff behind --reports Diff.
+
+Snapshots a synthetic fleet, saves it, then changes a slice of it :
+some instances terminated, some launched and some resized or retagged,
+and times taking, diffing and saving the next snapshot.
+
+    python -m benchmarks.snapshot_diff [resources] [changed]
+"""
+
+from __future__ import print_function
+
+from datetime import datetime, timedelta
+import os
+import random
+import sys
+import tempfile
+import time
+
+from aws.aws import AWSInstance, AWSVolume
+from aws.snapshot import Snapshot, snapshot_records
+
+REGIONS = ['us-east-1', 'us-west-1', 'us-west-2', 'eu-west-1', 'ap-southeast-1']
+TYPES = [('t2.micro', 0.013), ('m4.large', 0.12), ('c4.xlarge', 0.209), ('r3.2xlarge', 0.665)]
+
+
+def _fleet(count, launched):
+    instances = []
+    volumes = []
+    for index in range(count):
+        region = REGIONS[index % len(REGIONS)]
+        if index % 2:
+            volume = AWSVolume("vol-{:017x}".format(index), 8 + index % 500, 'gp2', region, None,
+                               launched, 0.1, 0.0)
+            volume.calculate_cost()
+            volumes.append(volume)
+        else:
+            instance_type, cost_per_hour = TYPES[index % len(TYPES)]
+            instances.append(AWSInstance("i-{:017x}".format(index), launched, region, instance_type,
+                                         "deploy", cost_per_hour,
+                                         {"team": "team-{}".format(index % 12), "env": "prod"}))
+
+    # EC2 hands out identifiers in no particular order
+    shuffle = random.Random(0).shuffle
+    shuffle(instances)
+    shuffle(volumes)
+    return instances, volumes
+
+
+def _change(instances, changed, launched):
+    step = max(1, len(instances) // max(1, changed))
+    # every step-th instance is terminated, resized or retagged in turn
+    kept = []
+    for index, instance in enumerate(instances):
+        if index % step == 0 and index // step % 3 == 0:
+            continue
+        if index % step == 0 and index // step % 3 == 1:
+            instance.aws_instance_type, instance.cost_per_hour = TYPES[-1]
+        if index % step == 0 and index // step % 3 == 2:
+            instance.tags = dict(instance.tags, env="staging")
+        kept.append(instance)
+
+    kept.extend(AWSInstance("i-{:017x}".format(len(instances) * 4 + index), launched, REGIONS[0],
+                            TYPES[0][0], "deploy", TYPES[0][1])
+                for index in range(changed // 3))
+    return kept
+
+
+def _time(label, work):
+    start = time.time()
+    result = work()
+    print("{} : {:.2f} s".format(label, time.time() - start))
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    changed = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+
+    launched = datetime(2016, 1, 1)
+    now = launched + timedelta(days=30)
+    instances, volumes = _fleet(count, launched)
+
+    handle, path = tempfile.mkstemp(suffix='.snapshot')
+    os.close(handle)
+    try:
+        snapshot = Snapshot(path)
+        records = _time("snapshot {} resources".format(count), lambda: snapshot_records(instances, volumes))
+        _time("save", lambda: snapshot.save(records, now))
+        print("snapshot size : {:.1f} MB".format(os.path.getsize(path) / 1e6))
+
+        instances = _change(instances, changed, now)
+        records = _time("snapshot again", lambda: snapshot_records(instances, volumes))
+        diff = _time("diff", lambda: snapshot.diff(records, now + timedelta(hours=1)))
+        _time("save", lambda: snapshot.save(records, now + timedelta(hours=1)))
+        print("added : {}, removed : {}, changed : {}, cost per hour change : ${:.2f}".format(
+            len(diff.added), len(diff.removed), len(diff.changed), diff.cost_per_hour_change))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
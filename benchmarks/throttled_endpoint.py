@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Benchmark of the EC2 throttle against a local endpoint that throttles.
+
+Starts a fake EC2 endpoint per region which serves paged
+DescribeInstances responses from benchmarks/fixtures and answers
+RequestLimitExceeded once its own token bucket runs dry. Several
+workers per region then list every instance through AWS, first pacing
+close to the endpoint's limit and then asking for far more. Fails if a
+worker does not get every instance.
+
+    python -m benchmarks.throttled_endpoint [workers per region] [pages]
+"""
+
+from __future__ import print_function
+
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+
+from boto.ec2.connection import EC2Connection
+from boto.regioninfo import RegionInfo
+
+from aws.aws import AWS
+from aws.throttle import ThrottleStats, shared_throttle
+from benchmarks.describe_decode import _fixture
+
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'ap-southeast-1']
+INSTANCES_PER_PAGE = 50
+# what the fake endpoint allows each region
+ENDPOINT_RATE = 5
+ENDPOINT_BURST = 25
+
+THROTTLED = (b'<?xml version="1.0" encoding="UTF-8"?>\n<Response><Errors><Error>'
+             b'<Code>RequestLimitExceeded</Code><Message>Request limit exceeded.</Message>'
+             b'</Error></Errors><RequestID>00000000-0000-0000-0000-000000000000</RequestID></Response>')
+
+
+class FakeEC2(ThreadingMixIn, HTTPServer):
+    """Serves pages of DescribeInstances, throttling above its rate"""
+
+    daemon_threads = True
+
+    def __init__(self, pages):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.pages = pages
+        self.page = _fixture('describe_instances.xml', b'reservationSet', INSTANCES_PER_PAGE)
+        self.served = 0
+        self.throttled = 0
+        self._tokens = float(ENDPOINT_BURST)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.time()
+            self._tokens = min(ENDPOINT_BURST, self._tokens + (now - self._updated) * ENDPOINT_RATE)
+            self._updated = now
+            if self._tokens < 1:
+                self.throttled += 1
+                return False
+            self._tokens -= 1
+            self.served += 1
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        params = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+
+        if not self.server.allow():
+            self._respond(503, THROTTLED)
+            return
+
+        page = int(params.get('NextToken', ['0'])[0])
+        body = self.server.page
+        if page + 1 < self.server.pages:
+            body = body.replace(b'</reservationSet>',
+                                '</reservationSet>\n<nextToken>{}</nextToken>'.format(page + 1).encode('utf-8'))
+        self._respond(200, body)
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _run(servers, workers, pages, account, api_rate):
+    def list_instances(job):
+        region, server = job
+        connection = EC2Connection('fake', 'fake', is_secure=False, port=server.server_address[1],
+                                   region=RegionInfo(name=region, endpoint='127.0.0.1'))
+        aws = AWS(account, 'fake', region, fast_ingest=True, api_rate=api_rate, connection=connection)
+        return sum(1 for _ in aws.instances(page_size=INSTANCES_PER_PAGE))
+
+    jobs = [(region, server) for region, server in servers for _ in range(workers)]
+    pool = ThreadPool(processes=len(jobs))
+    start = time.time()
+    try:
+        counts = pool.map(list_instances, jobs)
+    finally:
+        pool.close()
+    elapsed = time.time() - start
+
+    stats = ThrottleStats()
+    for region, server in servers:
+        stats.merge(shared_throttle(region, account).stats)
+
+    assert counts == [pages * INSTANCES_PER_PAGE] * len(jobs), counts
+    return elapsed, stats
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+
+    servers = []
+    for region in REGIONS:
+        server = FakeEC2(pages)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append((region, server))
+
+    print("regions : {}, workers per region : {}, pages per worker : {}".format(len(REGIONS), workers, pages))
+    print("endpoint limit : {} calls/s per region".format(ENDPOINT_RATE))
+
+    for label, account, api_rate in [("paced at the endpoint limit", 'paced', ENDPOINT_RATE),
+                                     ("asking for 10x the limit", 'eager', ENDPOINT_RATE * 10)]:
+        elapsed, stats = _run(servers, workers, pages, account, api_rate)
+        print("{} : {:.1f} s, {:.1f} pages/s per region, {} calls, {} throttled, {} retried, {} gave up".format(
+            label, elapsed, workers * pages / elapsed, stats.calls, stats.throttles, stats.retries, stats.failures))
+
+    for region, server in servers:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
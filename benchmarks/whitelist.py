@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Benchmark of Whitelist matching.
+
+Builds a whitelist of exact, tag, instance type, glob and regex rules
+and times filtering a synthetic fleet against it, alongside the list
+scan the whitelist used to do.
+
+    python -m benchmarks.whitelist [rules] [instances]
+"""
+
+from __future__ import print_function
+
+from datetime import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+from aws.aws import AWSInstance
+from aws_reporter import Whitelist
+
+TYPES = ['t2.micro', 't2.medium', 'm4.large', 'c4.xlarge', 'r3.2xlarge']
+
+
+def _rules(count):
+    # mostly exact ids, as today, plus a spread of the other rule types
+    rules = []
+    for index in range(count):
+        kind = index % 20
+        if kind == 0:
+            rules.append({"tag": {"key": "team", "value": "team-{}".format(index)}})
+        elif kind == 1 and index % 200 == 1:
+            rules.append({"pattern": "i-{:04x}*".format(index), "field": "identifier"})
+        elif kind == 2 and index % 400 == 2:
+            rules.append({"regex": "jenkins-{}-".format(index), "field": "keyname"})
+        elif kind == 3 and index % 1000 == 3:
+            rules.append({"instance_type": "x1.{}xlarge".format(index)})
+        else:
+            rules.append({"identifier": "i-{:017x}".format(index * 7)})
+    return rules
+
+
+def _fleet(count):
+    launched = datetime(2016, 1, 1)
+    return [AWSInstance("i-{:017x}".format(index), launched, 'us-east-1', TYPES[index % len(TYPES)],
+                        "deploy-{}".format(index % 50), 0.1, {"team": "team-{}".format(index % 300),
+                                                              "Name": "server-{}".format(index)})
+            for index in range(count)]
+
+
+def main():
+    rule_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    instance_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    rules = _rules(rule_count)
+    instances = _fleet(instance_count)
+
+    handle, path = tempfile.mkstemp(suffix='.json')
+    try:
+        with os.fdopen(handle, 'w') as whitelist_file:
+            json.dump({"items": rules}, whitelist_file)
+        start = time.time()
+        whitelist = Whitelist(path)
+        compile_time = time.time() - start
+    finally:
+        os.remove(path)
+
+    start = time.time()
+    kept = sum(1 for instance in instances if whitelist.ok(instance))
+    matcher = time.time() - start
+
+    # the old whitelist only knew identifiers, scanned as a list
+    identifiers = [rule['identifier'] for rule in rules if 'identifier' in rule]
+    sample = instances[:1000]
+    start = time.time()
+    sum(1 for instance in sample if instance.identifier not in identifiers)
+    scan = (time.time() - start) / len(sample) * len(instances)
+
+    print("rules : {}, instances : {}, kept : {}".format(rule_count, instance_count, kept))
+    print("compile : {:.3f} s".format(compile_time))
+    print("combined matcher : {:.2f} s ({:.0f} instances/sec)".format(matcher, instance_count / matcher))
+    print("list scan, identifiers only (extrapolated) : {:.2f} s".format(scan))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+
+from __future__ import print_function
+
+import heapq
+
+GROUP_BY = ('region', 'instance_type', 'keyname')
+
+
+class GroupTotals(object):
+    """Totals for one group of instances e.g. a single region"""
+
+    __slots__ = ('count', 'cost', 'cost_per_hour', 'top')
+
+    def __init__(self):
+        self.count = 0
+        self.cost = 0.0
+        self.cost_per_hour = 0.0
+        # min heap of (cost, identifier) holding the most expensive instances
+        self.top = []
+
+    def add(self, cost, cost_per_hour, identifier, top_k):
+        self.count += 1
+        self.cost += cost
+        self.cost_per_hour += cost_per_hour
+        self._keep(top_k, (cost, identifier))
+
+    def merge(self, other, top_k):
+        self.count += other.count
+        self.cost += other.cost
+        self.cost_per_hour += other.cost_per_hour
+        for spender in other.top:
+            self._keep(top_k, spender)
+
+    def top_spenders(self):
+        """:returns: list of (cost, identifier), most expensive first"""
+        return sorted(self.top, reverse=True)
+
+    def _keep(self, top_k, spender):
+        if len(self.top) < top_k:
+            heapq.heappush(self.top, spender)
+        elif spender > self.top[0]:
+            heapq.heapreplace(self.top, spender)
+
+
+class ReportSummary(object):
+    """Totals and group by rollups of a costed fleet.
+
+    Built once per run and shared, read only, by every reporter.
+    Summaries of part of a fleet can be combined with merge.
+    """
+
+    def __init__(self, tag_keys=None, top_k=5):
+        self.tag_keys = list(tag_keys or [])
+        self.top_k = top_k
+        self.instance_count = 0
+        self.total_cost = 0.0
+        self.total_cost_per_hour = 0.0
+        self.volume_count = 0
+        self.volumes_cost_per_month = 0.0
+        # group name e.g. 'region' or 'tag:team' -> group value -> GroupTotals
+        self.group_names = list(GROUP_BY) + ['tag:{}'.format(key) for key in self.tag_keys]
+        self.groups = dict((name, {}) for name in self.group_names)
+        # (group name, value) every instance is also filed under, see label
+        self.labels = []
+
+    def add_instance(self, instance):
+        self.instance_count += 1
+        self.total_cost += instance.cost
+        self.total_cost_per_hour += instance.cost_per_hour
+
+        tags = instance.tags or {}
+        names = list(GROUP_BY) + ['tag:{}'.format(key) for key in self.tag_keys]
+        values = [instance.aws_region, instance.aws_instance_type, instance.keyname]
+        values.extend(tags.get(key) for key in self.tag_keys)
+
+        for name, value in list(zip(names, values)) + self.labels:
+            group = self.groups[name].get(value)
+            if group is None:
+                group = self.groups[name][value] = GroupTotals()
+            group.add(instance.cost, instance.cost_per_hour, instance.identifier, self.top_k)
+
+    def add_volume(self, volume):
+        self.volume_count += 1
+        self.volumes_cost_per_month += volume.cost
+
+    def merge(self, other):
+        self.instance_count += other.instance_count
+        self.total_cost += other.total_cost
+        self.total_cost_per_hour += other.total_cost_per_hour
+        self.volume_count += other.volume_count
+        self.volumes_cost_per_month += other.volumes_cost_per_month
+
+        for key in other.tag_keys:
+            if key not in self.tag_keys:
+                self.tag_keys.append(key)
+                self.group_names.append('tag:{}'.format(key))
+                self.groups['tag:{}'.format(key)] = {}
+
+        for index, name in enumerate(other.group_names):
+            if name not in self.groups:
+                self.group_names.insert(index, name)
+                self.groups[name] = {}
+
+        for name, groups in other.groups.items():
+            mine = self.groups[name]
+            for value, group in groups.items():
+                if value not in mine:
+                    mine[value] = GroupTotals()
+                mine[value].merge(group, self.top_k)
+
+    def label(self, name, value):
+        """
+        Files every instance of the summary, and any added later, under
+        one value of a new group listed first e.g. the account a shard
+        was collected from
+
+        :param name e.g. account
+        :param value e.g. production
+
+        """
+        totals = GroupTotals()
+        # regions partition the instances, so together they are the whole
+        for group in self.groups['region'].values():
+            totals.merge(group, self.top_k)
+
+        self.labels.append((name, value))
+        self.group_names.insert(0, name)
+        self.groups[name] = {value: totals}
+
+    def breakdown(self, name):
+        """
+        Rollup for one group by, most expensive first
+
+        :param name one of region, instance_type, keyname, tag:<key> or a label
+
+        :returns: list of (value, GroupTotals)
+
+        """
+        return sorted(self.groups.get(name, {}).items(), key=lambda g: g[1].cost, reverse=True)
+
+
+def aggregate(instances, volumes, tag_keys=None, top_k=5):
+    """
+    Computes every total and rollup in a single pass over the fleet
+
+    :param instances costed instances
+    :param volumes costed volumes
+    :param tag_keys tag names to break the costs down by
+    :param top_k number of most expensive instances to keep per group
+
+    :returns: ReportSummary
+
+    """
+    summary = ReportSummary(tag_keys=tag_keys, top_k=top_k)
+
+    for instance in instances:
+        summary.add_instance(instance)
+    for volume in volumes:
+        summary.add_volume(volume)
+
+    return summary
@@ -2,19 +2,37 @@
 
 from __future__ import print_function
 
+import sys
+
+from reports.aggregate import aggregate
+from reports.ranking import most_expensive
+
 
 class ConsoleReporter(object):
 
-    def write(self, instances, volumes):
+    def __init__(self, top=None, out=None):
+        self._top = top
+        # file to write to, standard out when None
+        self._out = out
+
+    def write(self, instances, volumes, summary=None):
+
+        if summary is None:
+            summary = aggregate(instances, volumes)
+
+        out = self._out or sys.stdout
+        shown, _ = most_expensive(instances, self._top)
+        # instances may be only the most expensive of each shard, the
+        # summary counts every one
+        hidden = summary.instance_count - len(shown)
+        total_cost = summary.total_cost
+        total_cost_per_hour = summary.total_cost_per_hour
 
-        instances.sort(key=lambda x: x.cost, reverse=True)
-        total_cost = 0
-        total_cost_per_hour = 0
-        print("Instances")
-        for instance in instances:
+        shown_cost = 0
+        print("Instances", file=out)
+        for instance in shown:
 
-            total_cost += instance.cost
-            total_cost_per_hour += instance.cost_per_hour
+            shown_cost += instance.cost
  
             print("{} ${:.2f} \t{} \t{} \t{} \t{} \t{}".format(
                                             instance.launchedAtUtc,
@@ -23,19 +41,27 @@ class ConsoleReporter(object):
                                             instance.aws_instance_type,
                                             instance.aws_region,
                                             instance.keyname,
-                                            instance.tags))
+                                            instance.tags), file=out)
 
-        print ("Ongoing (hour) : \t${:.2f}".format(total_cost_per_hour))
-        print ("Ongoing (day) : \t${:.2f}".format(total_cost_per_hour * 24))
-        print ("Ongoing (30 day month) : \t${:.2f}".format(total_cost_per_hour * 24 * 30))
-        print ("Total accrued cost : \t${:.2f}".format(total_cost))
-        
-        print ("Volumes")
-        print ("Volumes (total) : {}".format(len(volumes)))
-        
-        volumes_cost_per_month = 0
+        if hidden:
+            print("... {} more instances ${:.2f}".format(hidden, total_cost - shown_cost), file=out)
 
-        for volume in volumes:
-            volumes_cost_per_month += volume.cost
+        print ("Ongoing (hour) : \t${:.2f}".format(total_cost_per_hour), file=out)
+        print ("Ongoing (day) : \t${:.2f}".format(total_cost_per_hour * 24), file=out)
+        print ("Ongoing (30 day month) : \t${:.2f}".format(total_cost_per_hour * 24 * 30), file=out)
+        print ("Total accrued cost : \t${:.2f}".format(total_cost), file=out)
+
+        for name in summary.group_names:
+            print ("By {}".format(name), file=out)
+            for value, group in summary.breakdown(name):
+                print ("{} \t{} instances \t${:.2f} \t${:.2f}/hour \t{}".format(
+                                            value,
+                                            group.count,
+                                            group.cost,
+                                            group.cost_per_hour,
+                                            ", ".join(identifier for cost, identifier in group.top_spenders())), file=out)
+        
+        print ("Volumes", file=out)
+        print ("Volumes (total) : {}".format(summary.volume_count), file=out)
             
-        print ("Ongoing (30 day month) : \t${:.2f}".format(volumes_cost_per_month ))
+        print ("Ongoing (30 day month) : \t${:.2f}".format(summary.volumes_cost_per_month ), file=out)
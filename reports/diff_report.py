@@ -0,0 +1,103 @@
+
+from __future__ import print_function
+
+from operator import attrgetter
+import sys
+
+from reports.email_report import HtmlEmailTemplateReportWriter
+from reports.ranking import most_expensive
+
+_by_cost_per_hour = attrgetter('cost_per_hour')
+
+
+def _by_change(change):
+    previous, current = change
+    return abs(current.cost_per_hour - previous.cost_per_hour)
+
+
+def _sections(diff, top):
+    """:returns: list of (title, rows, hidden) in the order they are reported"""
+    added, added_hidden = most_expensive(diff.added, top, key=_by_cost_per_hour)
+    removed, removed_hidden = most_expensive(diff.removed, top, key=_by_cost_per_hour)
+    changed, changed_hidden = most_expensive(diff.changed, top, key=_by_change)
+
+    return [("Added ({})".format(len(diff.added)),
+             [(record.identifier, record.type, record.region, "${:.4f}".format(record.cost_per_hour))
+              for record in added], added_hidden),
+            ("Removed ({})".format(len(diff.removed)),
+             [(record.identifier, record.type, record.region, "${:.4f}".format(record.cost_per_hour))
+              for record in removed], removed_hidden),
+            ("Changed ({})".format(len(diff.changed)),
+             [(current.identifier, _from_to(previous.type, current.type), current.region,
+               _from_to("${:.4f}".format(previous.cost_per_hour), "${:.4f}".format(current.cost_per_hour)))
+              for previous, current in changed], changed_hidden)]
+
+
+def _from_to(previous, current):
+    if previous == current:
+        return current
+    return "{} -> {}".format(previous, current)
+
+
+class DiffConsoleReporter(object):
+    """Prints what was launched, terminated or changed since the last
+    snapshot, with the costs per hour"""
+
+    def __init__(self, top=None, out=None):
+        self._top = top
+        # file to write to, standard out when None
+        self._out = out
+
+    def write(self, diff):
+
+        out = self._out or sys.stdout
+
+        if diff is None:
+            print("No earlier snapshot to compare with", file=out)
+            return
+
+        if not diff.has_changes:
+            print("No changes since {}".format(diff.previous_taken_at), file=out)
+            return
+
+        print("Changes since {}".format(diff.previous_taken_at), file=out)
+        for title, rows, hidden in _sections(diff, self._top):
+            print(title, file=out)
+            for row in rows:
+                print(" \t".join(row), file=out)
+            if hidden:
+                print("... {} more".format(hidden), file=out)
+
+        print("Ongoing (hour) change : \t${:+.2f}".format(diff.cost_per_hour_change), file=out)
+
+
+class DiffEmailReportWriter(HtmlEmailTemplateReportWriter):
+    """Emails what was launched, terminated or changed since the last
+    snapshot, only when something did"""
+
+    def write(self, diff):
+
+        if diff is None or not diff.has_changes:
+            return
+
+        html = ["<html><head></head><body>Changes since {}".format(diff.previous_taken_at)]
+
+        for title, rows, hidden in _sections(diff, self._top):
+            if not rows:
+                continue
+            html.append("<h4>{}</h4><table border='1'>".format(title))
+            html.append("<tr><th>{}</th><th>{}</th><th>{}</th><th>{}</th></tr>".format(
+                "Identifier",
+                "Type",
+                "Region",
+                "Cost (hour)"))
+            for row in rows:
+                html.append("<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>".format(*row))
+            if hidden:
+                html.append("<tr><td colspan='4'>... {} more</td></tr>".format(hidden))
+            html.append("</table>")
+
+        html.append("<br />Ongoing (hour) change : ${:+.2f}</body></html>".format(diff.cost_per_hour_change))
+
+        title = "AWS Usage changes {}".format(diff.taken_at)
+        self._send_email(title, "".join(html))
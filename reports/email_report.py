@@ -2,29 +2,40 @@
 
 from __future__ import print_function
 
-import smtplib
-
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from datetime import datetime
 
+from reports.aggregate import aggregate
+from reports.mailer import SmtpMailer
+from reports.ranking import most_expensive
+
 
 class HtmlEmailTemplateReportWriter(object):
 
-    def __init__(self, from_email_address, recipients, email_password):
+    def __init__(self, from_email_address, recipients, email_password, top=None, mailer=None):
         self._from_email_address = from_email_address
         self._recipients = recipients
         self._email_password = email_password
+        self._top = top
+        # a shared SmtpMailer or BackgroundMailer, otherwise a connection
+        # is made just for this report
+        self._mailer = mailer
+
+    def write(self, instances, volumes, summary=None):
 
-    def write(self, instances, volumes):
+        if summary is None:
+            summary = aggregate(instances, volumes)
 
-        instances.sort(key=lambda x: x.cost, reverse=True)
+        shown, _ = most_expensive(instances, self._top)
+        # instances may be only the most expensive of each shard, the
+        # summary counts every one
+        hidden = summary.instance_count - len(shown)
 
-        total_cost = 0
-        total_cost_per_hour = 0
+        total_cost = summary.total_cost
+        total_cost_per_hour = summary.total_cost_per_hour
 
-        html = "<html><head></head><body><table border='1'>"
-        html += "<tr><th>{}</th><th>{}</th><th>{}</th><th>{}</th><th>{}</th><th>{}</th><th>{}</th></tr>".format(
+        # the document is built up as a list of parts and joined once
+        html = ["<html><head></head><body><table border='1'>"]
+        html.append("<tr><th>{}</th><th>{}</th><th>{}</th><th>{}</th><th>{}</th><th>{}</th><th>{}</th></tr>".format(
                     "Launched",
                     "Cost",
                     "Identifier",
@@ -32,14 +43,15 @@ class HtmlEmailTemplateReportWriter(object):
                     "Region",
                     "Keyname",
                     "Tags"
-                )
+                ))
 
-        for instance in instances:
+        shown_cost = 0
 
-            total_cost += instance.cost
-            total_cost_per_hour += instance.cost_per_hour
+        for instance in shown:
 
-            row = "<tr><td>{}</td><td>${:.2f}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td width='45%'>{}</td><tr>".format(
+            shown_cost += instance.cost
+
+            row = "<tr><td>{}</td><td>${:.2f}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td width='45%'>{}</td></tr>".format(
                                 instance.launchedAtUtc,
                                 instance.cost,
                                 instance.identifier,
@@ -47,41 +59,50 @@ class HtmlEmailTemplateReportWriter(object):
                                 instance.aws_region,
                                 instance.keyname,
                                 instance.tags)
-            html += row
+            html.append(row)
+
+        if hidden:
+            html.append("<tr><td>...</td><td>${:.2f}</td><td colspan='5'>{} more instances</td></tr>".format(
+                total_cost - shown_cost,
+                hidden))
 
-        html += "</table>"
-        html += "</br> Ongoing (hour) : ${:.2f}<br />Ongoing (day) : ${:.2f}<br /> Ongoing (30 day month) : ${:.2f}<br />Total accrued cost : ${:.2f} <br / >".format(
+        html.append("</table>")
+        html.append("</br> Ongoing (hour) : ${:.2f}<br />Ongoing (day) : ${:.2f}<br /> Ongoing (30 day month) : ${:.2f}<br />Total accrued cost : ${:.2f} <br / >".format(
             total_cost_per_hour,
             total_cost_per_hour * 24,
             total_cost_per_hour * 24 * 30,
-            total_cost)
+            total_cost))
 
-        volumes_cost_per_month = 0
-
-        for volume in volumes:
-            volumes_cost_per_month += volume.cost
-
-        html += "Volumes (total): {} <br/> Ongoing (30 day month) : ${:.2f}</body></html>".format(
-            len(volumes),
-            volumes_cost_per_month)
+        for name in summary.group_names:
+            html.append("<h4>By {}</h4><table border='1'>".format(name))
+            html.append("<tr><th>{}</th><th>{}</th><th>{}</th><th>{}</th><th>{}</th></tr>".format(
+                    name,
+                    "Instances",
+                    "Cost",
+                    "Cost (hour)",
+                    "Most expensive"))
+            for value, group in summary.breakdown(name):
+                html.append("<tr><td>{}</td><td>{}</td><td>${:.2f}</td><td>${:.2f}</td><td>{}</td></tr>".format(
+                    value,
+                    group.count,
+                    group.cost,
+                    group.cost_per_hour,
+                    ", ".join(identifier for cost, identifier in group.top_spenders())))
+            html.append("</table>")
+
+        html.append("Volumes (total): {} <br/> Ongoing (30 day month) : ${:.2f}</body></html>".format(
+            summary.volume_count,
+            summary.volumes_cost_per_month))
 
         now = datetime.utcnow()
         title = "AWS Usage {}".format(now)
-        self._send_email(title, html)
+        self._send_email(title, "".join(html))
         
     def _send_email(self, title, htmlmessage):
 
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(self._from_email_address, self._email_password)
-
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = title
-        msg['From'] = self._from_email_address
-        msg['To'] = ", ".join(self._recipients)
-
-        part1 = MIMEText(htmlmessage, 'html')
-        msg.attach(part1)
+        if self._mailer is not None:
+            self._mailer.send(self._from_email_address, self._recipients, title, htmlmessage)
+            return
 
-        server.sendmail(self._from_email_address, self._recipients, msg.as_string())
-        server.quit()
+        with SmtpMailer(username=self._from_email_address, password=self._email_password) as mailer:
+            mailer.send(self._from_email_address, self._recipients, title, htmlmessage)
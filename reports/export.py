@@ -0,0 +1,208 @@
+
+from __future__ import print_function
+
+import csv
+import json
+import os
+import sys
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # only the Parquet export needs it
+    pyarrow = None
+
+from aws.cost import DAYS_PER_MONTH, HOURS_PER_DAY
+
+HOURS_PER_MONTH = HOURS_PER_DAY * DAYS_PER_MONTH
+
+# one flat row per instance or volume, the columns a resource does not
+# have are left empty e.g. keyname for a volume, accrued cost for a volume
+COLUMNS = ('kind', 'identifier', 'region', 'type', 'started_at', 'cost', 'cost_per_hour', 'cost_per_month',
+           'keyname', 'size', 'iops', 'tags')
+
+# rows buffered for each Parquet row group, the most held in memory
+ROW_GROUP_SIZE = 65536
+
+
+def resource_rows(instances, volumes):
+    """
+    Flattens costed resources, one at a time
+
+    :param instances costed AWSInstance, any iterable
+    :param volumes costed AWSVolume, any iterable
+
+    :returns: tuples in COLUMNS order
+
+    """
+    for instance in instances:
+        yield ('instance', instance.identifier, instance.aws_region, instance.aws_instance_type,
+               instance.launchedAtUtc, instance.cost, instance.cost_per_hour,
+               instance.cost_per_hour * HOURS_PER_MONTH, instance.keyname, None, None, instance.tags or {})
+
+    for volume in volumes:
+        yield ('volume', volume.identifier, volume.aws_region, volume.type,
+               volume.createdAtUtc, None, volume.cost / HOURS_PER_MONTH,
+               volume.cost, None, volume.size, volume.provisioned_iops, {})
+
+
+def export(exports, instances, volumes):
+    """
+    Writes every resource to each export as it comes, so generators are
+    consumed once and only the current resource is held
+
+    :param exports open exports e.g. CsvExport
+    :param instances costed AWSInstance, any iterable
+    :param volumes costed AWSVolume, any iterable
+
+    :returns: number of rows written
+
+    """
+    count = 0
+    complete = False
+    try:
+        for row in resource_rows(instances, volumes):
+            for resource_export in exports:
+                resource_export.add(row)
+            count += 1
+        complete = True
+    finally:
+        for resource_export in exports:
+            resource_export.close(complete)
+    return count
+
+
+class _FileExport(object):
+    """Writes to standard out, or to a temporary file renamed into place
+    once the export is complete"""
+
+    def __init__(self, path=None):
+        self._path = path
+        if path is None:
+            self._temp_file = None
+            self._out = sys.stdout
+        else:
+            self._temp_file = "{}.{}.tmp".format(path, os.getpid())
+            self._out = open(self._temp_file, 'w')
+
+    def close(self, complete=True):
+        """:param complete False to throw away what was written to a file"""
+        if self._temp_file is None:
+            self._out.flush()
+            return
+
+        self._out.close()
+        if complete:
+            os.rename(self._temp_file, self._path)
+        else:
+            os.remove(self._temp_file)
+
+
+class CsvExport(_FileExport):
+    """Comma separated, with a header row and the tags as a JSON object"""
+
+    def __init__(self, path=None):
+        _FileExport.__init__(self, path)
+        self._writer = csv.writer(self._out)
+        self._writer.writerow(COLUMNS)
+
+    def add(self, row):
+        self._writer.writerow(row[:4] + (_timestamp(row[4]),) + row[5:11]
+                              + (json.dumps(row[11], sort_keys=True),))
+
+
+class JsonLinesExport(_FileExport):
+    """One JSON object per line"""
+
+    def add(self, row):
+        document = dict(zip(COLUMNS, row))
+        document['started_at'] = _timestamp(row[4])
+        self._out.write(json.dumps(document, sort_keys=True))
+        self._out.write('\n')
+
+
+class ParquetExport(object):
+    """Snappy compressed Parquet, written a row group at a time.
+
+    Needs pyarrow and a path, Parquet can not be streamed to standard out.
+    """
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        if pyarrow is None:
+            raise ValueError("Parquet exports require pyarrow")
+        if path is None:
+            raise ValueError("Parquet exports must be written to a file")
+
+        self._path = path
+        self._temp_file = "{}.{}.tmp".format(path, os.getpid())
+        self._row_group_size = row_group_size
+        self._schema = pyarrow.schema([('kind', pyarrow.string()),
+                                       ('identifier', pyarrow.string()),
+                                       ('region', pyarrow.string()),
+                                       ('type', pyarrow.string()),
+                                       ('started_at', pyarrow.timestamp('us')),
+                                       ('cost', pyarrow.float64()),
+                                       ('cost_per_hour', pyarrow.float64()),
+                                       ('cost_per_month', pyarrow.float64()),
+                                       ('keyname', pyarrow.string()),
+                                       ('size', pyarrow.int64()),
+                                       ('iops', pyarrow.int64()),
+                                       ('tags', pyarrow.string())])
+        self._writer = pyarrow.parquet.ParquetWriter(self._temp_file, self._schema, compression='snappy')
+        self._columns = [[] for _ in COLUMNS]
+
+    def add(self, row):
+        for column, value in zip(self._columns, row[:11]):
+            column.append(value)
+        self._columns[11].append(json.dumps(row[11], sort_keys=True))
+
+        if len(self._columns[0]) >= self._row_group_size:
+            self._flush()
+
+    def close(self, complete=True):
+        if complete and self._columns[0]:
+            self._flush()
+        self._writer.close()
+        if complete:
+            os.rename(self._temp_file, self._path)
+        else:
+            os.remove(self._temp_file)
+
+    def _flush(self):
+        arrays = [pyarrow.array(column, type=field.type) for column, field in zip(self._columns, self._schema)]
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self._schema))
+        self._columns = [[] for _ in COLUMNS]
+
+
+def parquet_supported():
+    """:returns: True when pyarrow is installed"""
+    return pyarrow is not None
+
+
+# report name -> (export, file extension)
+EXPORTS = {'CSV': (CsvExport, '.csv'),
+           'JSONLines': (JsonLinesExport, '.jsonl'),
+           'Parquet': (ParquetExport, '.parquet')}
+
+
+def open_exports(names, prefix=None):
+    """
+    :param names report names from EXPORTS
+    :param prefix e.g. /data/fleet writes /data/fleet.csv, standard out
+                  when None
+
+    :returns: list of exports
+
+    """
+    exports = []
+    for name in names:
+        export_type, extension = EXPORTS[name]
+        exports.append(export_type(prefix + extension if prefix else None))
+    return exports
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    return value.isoformat() + 'Z'
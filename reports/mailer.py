@@ -0,0 +1,122 @@
+
+from __future__ import print_function
+
+import logging
+import smtplib
+import threading
+import time
+
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from aws.metrics import run_metrics
+
+
+class SmtpMailer(object):
+    """Sends html emails over one reusable, authenticated SMTP
+    connection.
+
+    The connection is opened on the first send and kept until close so
+    several reports can go out in the same session.
+    """
+
+    def __init__(self, host='smtp.gmail.com', port=587, username=None, password=None,
+                 starttls=True, timeout=60):
+        self._host = host
+        self._port = port
+        self._username = username
+        self._password = password
+        self._starttls = starttls
+        self._timeout = timeout
+        self._server = None
+
+    def send(self, from_address, recipients, title, htmlmessage):
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = title
+        msg['From'] = from_address
+        msg['To'] = ", ".join(recipients)
+
+        part1 = MIMEText(htmlmessage, 'html')
+        msg.attach(part1)
+
+        start = time.time()
+        try:
+            self._connection().sendmail(from_address, recipients, msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # the server may drop an idle session, reconnect once
+            self._server = None
+            self._connection().sendmail(from_address, recipients, msg.as_string())
+        run_metrics().record('smtp_send', None, time.time() - start, items=1)
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except smtplib.SMTPException:
+                pass
+            self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _connection(self):
+        if self._server is None:
+            server = smtplib.SMTP(self._host, self._port, timeout=self._timeout)
+            if self._starttls:
+                server.starttls()
+            if self._password is not None:
+                server.login(self._username, self._password)
+            self._server = server
+        return self._server
+
+
+class BackgroundMailer(object):
+    """Hands emails to a SmtpMailer on a background thread so report
+    generation does not wait on mail delivery.
+
+    close waits for every queued email to be sent, failures counts the
+    emails that could not be.
+    """
+
+    def __init__(self, mailer):
+        self._mailer = mailer
+        self.failures = 0
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, from_address, recipients, title, htmlmessage):
+        self._queue.put((from_address, recipients, title, htmlmessage))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self):
+        try:
+            while True:
+                email = self._queue.get()
+                if email is None:
+                    return
+                try:
+                    self._mailer.send(*email)
+                except Exception as e:
+                    self.failures += 1
+                    logging.error("Unable to send email {} : {}".format(email[2], e))
+        finally:
+            self._mailer.close()
@@ -0,0 +1,27 @@
+
+from __future__ import print_function
+
+import heapq
+from operator import attrgetter
+
+_by_cost = attrgetter('cost')
+
+
+def most_expensive(instances, top=None, key=_by_cost):
+    """
+    Orders instances by cost, most expensive first
+
+    With top set only that many are selected using a heap rather than
+    sorting the whole fleet.
+
+    :param instances
+    :param top optional number of instances to keep
+    :param key optional cost of each instance, its cost by default
+
+    :returns: list of instances, number of instances left out
+
+    """
+    if top is None or len(instances) <= top:
+        return sorted(instances, key=key, reverse=True), 0
+
+    return heapq.nlargest(top, instances, key=key), len(instances) - top
@@ -0,0 +1,316 @@
+
+from __future__ import print_function
+
+from datetime import datetime
+from io import StringIO
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import json
+import logging
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+from reports.aggregate import ReportSummary
+from reports.console_report import ConsoleReporter
+from reports.email_report import HtmlEmailTemplateReportWriter
+from reports.ranking import most_expensive
+
+
+class RegionReport(object):
+    """The instances and volumes of one region as of its last refresh,
+    costed as of then or as of the last time they were re-costed"""
+
+    __slots__ = ('instances', 'volumes', 'summary', 'refreshed_at')
+
+    def __init__(self, instances, volumes, summary, refreshed_at):
+        self.instances = instances
+        self.volumes = volumes
+        self.summary = summary
+        self.refreshed_at = refreshed_at
+
+
+class FleetReport(object):
+    """Every region put together, never changed once built so requests
+    can read it without locking.
+
+    Each format is rendered at most once per top and kept, so polling
+    the same report costs a dictionary lookup.
+    """
+
+    def __init__(self, regions, tag_keys):
+        self.regions = regions
+        self.instances = []
+        self.volumes = []
+        self.summary = ReportSummary(tag_keys=tag_keys)
+        self.built_at = datetime.utcnow()
+
+        for region, report in sorted(regions.items()):
+            self.instances.extend(report.instances)
+            self.volumes.extend(report.volumes)
+            self.summary.merge(report.summary)
+
+        self._rendered = {}
+        self._lock = threading.Lock()
+
+    def render(self, kind, top=None):
+        """
+        :param kind one of json, console or html
+        :param top optional number of instances to list
+
+        :returns: (content type, body bytes)
+
+        """
+        with self._lock:
+            rendered = self._rendered.get((kind, top))
+            if rendered is None:
+                rendered = self._rendered[(kind, top)] = RENDERERS[kind](self, top)
+            return rendered
+
+
+def _render_json(report, top):
+    shown, _ = most_expensive(report.instances, top)
+    summary = report.summary
+
+    document = {
+        'built_at': report.built_at.isoformat() + 'Z',
+        'regions': dict((region, r.refreshed_at.isoformat() + 'Z') for region, r in report.regions.items()),
+        'instance_count': summary.instance_count,
+        'total_cost': summary.total_cost,
+        'total_cost_per_hour': summary.total_cost_per_hour,
+        'volume_count': summary.volume_count,
+        'volumes_cost_per_month': summary.volumes_cost_per_month,
+        'groups': dict((name, [{'value': value, 'count': group.count, 'cost': group.cost,
+                                'cost_per_hour': group.cost_per_hour,
+                                'top': [identifier for cost, identifier in group.top_spenders()]}
+                               for value, group in summary.breakdown(name)])
+                       for name in summary.group_names),
+        'instances': [{'identifier': i.identifier, 'launched': i.launchedAtUtc.isoformat() + 'Z',
+                       'cost': i.cost, 'cost_per_hour': i.cost_per_hour, 'instance_type': i.aws_instance_type,
+                       'region': i.aws_region, 'keyname': i.keyname, 'tags': i.tags or {}}
+                      for i in shown],
+    }
+    return 'application/json', json.dumps(document, sort_keys=True).encode('utf-8')
+
+
+def _render_console(report, top):
+    out = _TextBuffer()
+    ConsoleReporter(top=top, out=out).write(report.instances, report.volumes, report.summary)
+    return 'text/plain; charset=utf-8', out.getvalue().encode('utf-8')
+
+
+def _render_html(report, top):
+    mailer = _CapturingMailer()
+    HtmlEmailTemplateReportWriter(None, [], None, top=top, mailer=mailer).write(report.instances,
+                                                                              report.volumes,
+                                                                              report.summary)
+    return 'text/html; charset=utf-8', mailer.html.encode('utf-8')
+
+
+RENDERERS = {'json': _render_json, 'console': _render_console, 'html': _render_html}
+
+
+class _TextBuffer(StringIO):
+
+    def write(self, text):
+        # print on python 2 hands over byte strings
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        return StringIO.write(self, text)
+
+
+class _CapturingMailer(object):
+
+    html = None
+
+    def send(self, from_address, recipients, title, htmlmessage):
+        self.html = htmlmessage
+
+
+class ReportService(object):
+    """Keeps the costed fleet in memory and serves it over HTTP.
+
+    Each region is refreshed every refresh_interval seconds by
+    refresh_region, which returns its RegionReport. After the first
+    refresh the regions fall due one after the other across the interval,
+    so each refresh fetches a few regions rather than the whole fleet. The
+    regions that are not due are re-costed from memory by recost_region,
+    when given, so accrued costs keep up. recost_region returns a new
+    RegionReport and must leave the one it is given, which the current
+    fleet report holds, as it was. The fleet report is then put back
+    together from the per region summaries.
+
+        GET  /report.json   totals, breakdowns and instances as JSON
+        GET  /report.txt    the console report
+        GET  /report.html   the email report
+        POST /reports       writes the configured reports from memory
+
+    The GET reports take an optional ?top=N.
+    """
+
+    def __init__(self, refresh_region, regions, tag_keys=None, refresh_interval=300, concurrency=4,
+                 region_timeout=None, write_reports=None, top=None, recost_region=None):
+        self._refresh_region = refresh_region
+        self._recost_region = recost_region
+        self._regions = list(regions)
+        self._tag_keys = list(tag_keys or [])
+        self._refresh_interval = refresh_interval
+        self._concurrency = concurrency
+        self._region_timeout = region_timeout
+        self._write_reports = write_reports
+        # instances listed when a request does not ask for a top
+        self.top = top
+        self._region_reports = {}
+        self._due = dict((region, 0) for region in self._regions)
+        # after the first refresh region n falls due n / len(regions) of the
+        # way through the interval, rather than every region at once
+        self._stagger = dict((region, refresh_interval * (index + 1) / float(len(self._regions)))
+                             for index, region in enumerate(self._regions))
+        self._report = None
+        self._stopped = threading.Event()
+        self._write_lock = threading.Lock()
+
+    @property
+    def report(self):
+        """:returns: the current FleetReport, None until the first refresh"""
+        return self._report
+
+    def refresh(self):
+        """Refreshes every region that is due, returns how many were"""
+        now = time.time()
+        due = [region for region in self._regions if self._due[region] <= now]
+        if not due:
+            return 0
+        costed_at = datetime.utcnow()
+        refreshed = set()
+
+        pool = ThreadPool(processes=max(1, min(self._concurrency, len(due))))
+        try:
+            pending = [(region, pool.apply_async(self._refresh_region, (region,))) for region in due]
+
+            for region, result in pending:
+                try:
+                    self._region_reports[region] = result.get(self._region_timeout)
+                    refreshed.add(region)
+                except TimeoutError:
+                    logging.warning("Timed out after {}s refreshing {}".format(self._region_timeout, region))
+                except Exception as e:
+                    logging.warning("Unable to refresh {} : {}".format(region, e))
+                # a region that failed keeps its last report until next time
+                self._due[region] = now + self._stagger.pop(region, self._refresh_interval)
+        finally:
+            pool.close()
+
+        if self._recost_region is not None:
+            for region, report in list(self._region_reports.items()):
+                if region in refreshed:
+                    continue
+                try:
+                    self._region_reports[region] = self._recost_region(report, costed_at)
+                except Exception as e:
+                    logging.warning("Unable to re-cost {} : {}".format(region, e))
+
+        self._report = FleetReport(dict(self._region_reports), self._tag_keys)
+        return len(due)
+
+    def write_reports(self):
+        """Writes the configured reports from the current fleet report"""
+        report = self._report
+        if report is None or self._write_reports is None:
+            return False
+
+        with self._write_lock:
+            self._write_reports(report)
+        return True
+
+    def run(self):
+        """Refreshes regions as they fall due until stop is called"""
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error("Unable to refresh : {}".format(e))
+            self._stopped.wait(max(1, min(self._due.values()) - time.time()))
+
+    def serve_forever(self, host='127.0.0.1', port=8080):
+        """Refreshes every region, then serves until interrupted"""
+        self.refresh()
+
+        refresher = threading.Thread(target=self.run)
+        refresher.daemon = True
+        refresher.start()
+
+        server = _ReportServer((host, port), self)
+        logging.info("Serving reports on http://{}:{}/".format(host, server.server_address[1]))
+        try:
+            server.serve_forever()
+        finally:
+            self.stop()
+            server.server_close()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class _ReportServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, _ReportHandler)
+        self.service = service
+
+
+class _ReportHandler(BaseHTTPRequestHandler):
+
+    _kinds = {'/report.json': 'json', '/report.txt': 'console', '/report.html': 'html'}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        kind = self._kinds.get(url.path)
+        if kind is None:
+            self._respond(404, 'text/plain', b'Not found\n')
+            return
+
+        report = self.server.service.report
+        if report is None:
+            self._respond(503, 'text/plain', b'The first refresh has not finished\n')
+            return
+
+        top = parse_qs(url.query).get('top')
+        try:
+            top = int(top[0]) if top else self.server.service.top
+        except ValueError:
+            self._respond(400, 'text/plain', b'top must be a number\n')
+            return
+
+        content_type, body = report.render(kind, top)
+        self._respond(200, content_type, body)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/reports':
+            self._respond(404, 'text/plain', b'Not found\n')
+            return
+
+        if not self.server.service.write_reports():
+            self._respond(503, 'text/plain', b'No report to write yet\n')
+            return
+        self._respond(200, 'text/plain', b'Reports written\n')
+
+    def _respond(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
@@ -0,0 +1,96 @@
+
+from __future__ import print_function
+
+from datetime import datetime, timedelta
+import unittest
+
+from aws import cost
+from aws.aws import AWSInstance, AWSVolume
+from aws.cost import BatchCostCalculator, price_timeline, to_microseconds
+
+NOW = datetime(2016, 6, 1, 12, 30, 15, 250000)
+
+
+def _instances():
+    launched = datetime(2016, 1, 1)
+    timeline = price_timeline([to_microseconds(datetime(2015, 1, 1)), to_microseconds(datetime(2016, 3, 1, 6))],
+                              [0.14, 0.12])
+    return [
+        # exactly on the hour, and part way through one
+        AWSInstance('i-1', launched, 'us-east-1', 'm4.large', 'key', 0.12, {}),
+        AWSInstance('i-2', launched + timedelta(minutes=1), 'us-east-1', 'm4.large', 'key', 0.12, {}),
+        AWSInstance('i-3', launched + timedelta(seconds=7, microseconds=3), 'us-east-1', 't2.micro', 'key', 0.013),
+        AWSInstance('i-4', NOW - timedelta(microseconds=1), 'us-east-1', 'c4.xlarge', 'key', 0.209),
+        AWSInstance('i-5', NOW - timedelta(hours=3), 'us-east-1', 'c4.xlarge', 'key', 0.209),
+        # ran across a price change
+        AWSInstance('i-6', launched, 'us-east-1', 'm4.large', 'key', 0.12, {}, price_timeline=timeline),
+        AWSInstance('i-7', datetime(2016, 3, 1, 5, 59, 30), 'us-east-1', 'm4.large', 'key', 0.12, {},
+                    price_timeline=timeline),
+    ]
+
+
+def _volumes():
+    launched = datetime(2016, 1, 1)
+    return [AWSVolume('vol-1', 8, 'gp2', 'us-east-1', None, launched, 0.1, 0.0),
+            AWSVolume('vol-2', 500, 'io1', 'us-east-1', 1000, launched, 0.125, 0.065),
+            AWSVolume('vol-3', 37, 'io1', 'us-east-1', 3, launched, 0.125, 0.065),
+            AWSVolume('vol-4', 100, 'standard', 'us-east-1', None, launched, 0.05, 0.05)]
+
+
+class BatchCostCalculatorTest(unittest.TestCase):
+    """The batch engine must cost exactly as the per object methods do,
+    with numpy and with the stdlib array fallback"""
+
+    def setUp(self):
+        self._numpy = cost.numpy
+
+    def tearDown(self):
+        cost.numpy = self._numpy
+
+    def _check(self):
+        expected_instances = _instances()
+        for instance in expected_instances:
+            instance.calculate_cost(NOW)
+        expected_volumes = _volumes()
+        for volume in expected_volumes:
+            volume.calculate_cost()
+
+        instances = _instances()
+        volumes = _volumes()
+        calculator = BatchCostCalculator(NOW)
+        calculator.cost_instances(instances)
+        calculator.cost_volumes(volumes)
+
+        self.assertEqual([i.cost for i in expected_instances], [i.cost for i in instances])
+        self.assertEqual([v.cost for v in expected_volumes], [v.cost for v in volumes])
+
+    def test_numpy(self):
+        if cost.numpy is None:
+            self.skipTest("numpy is not installed")
+        self._check()
+
+    def test_array(self):
+        cost.numpy = None
+        self._check()
+
+    def test_partial_hours_round_up(self):
+        instances = _instances()
+        BatchCostCalculator(NOW).cost_instances(instances)
+        # launched a microsecond ago is a whole hour, three hours ago exactly three
+        self.assertEqual(0.209, instances[3].cost)
+        self.assertAlmostEqual(0.209 * 3, instances[4].cost)
+
+    def test_price_timeline(self):
+        instances = _instances()
+        BatchCostCalculator(datetime(2016, 3, 1, 7, 59, 30)).cost_instances(instances[6:])
+        # 06:00 to 07:59:30 at the new price, the half minute before at the old
+        self.assertAlmostEqual(0.14 * 30 / 3600.0 + 0.12 * (3600 + 3570) / 3600.0, instances[6].cost)
+
+    def test_empty(self):
+        calculator = BatchCostCalculator(NOW)
+        self.assertEqual([], list(calculator.cost_instances([])))
+        self.assertEqual([], list(calculator.cost_volumes([])))
+
+
+if __name__ == '__main__':
+    unittest.main()
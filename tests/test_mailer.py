@@ -0,0 +1,168 @@
+
+from __future__ import print_function
+
+from argparse import Namespace
+from datetime import datetime, timedelta
+import asyncore
+import os
+import shutil
+import smtpd
+import tempfile
+import threading
+import unittest
+
+import aws_reporter
+from aws.aws import AWSInstance
+from reports.aggregate import aggregate
+from reports.mailer import BackgroundMailer, SmtpMailer
+
+
+class _Channel(smtpd.SMTPChannel):
+
+    def __init__(self, server, conn, addr):
+        smtpd.SMTPChannel.__init__(self, server, conn, addr)
+        self._stand_in = server
+
+    def found_terminator(self):
+        received = len(self._stand_in.messages)
+        smtpd.SMTPChannel.found_terminator(self)
+        # hang up once the reply to a message has gone out
+        if self._stand_in.drop and len(self._stand_in.messages) > received:
+            self.close_when_done()
+
+
+class _SmtpServer(smtpd.SMTPServer):
+    """A stand-in SMTP server on localhost, served on a background thread"""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.connections = 0
+        self.messages = []
+        # hang up after every message
+        self.drop = False
+        # reply to every message with an error
+        self.reject = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            self.connections += 1
+            _Channel(self, *pair)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if self.reject:
+            return '550 Rejected'
+        self.messages.append((mailfrom, rcpttos, data))
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        asyncore.close_all()
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            asyncore.loop(timeout=0.05, count=1)
+
+
+class SmtpMailerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _SmtpServer()
+        self.mailer = SmtpMailer(host='127.0.0.1', port=self.server.port, starttls=False, timeout=10)
+
+    def tearDown(self):
+        self.mailer.close()
+        self.server.stop()
+
+    def _send(self, title):
+        self.mailer.send('reports@example.com', ['a@example.com', 'b@example.com'], title, '<p>{}</p>'.format(title))
+
+    def test_reuses_one_connection(self):
+        for index in range(3):
+            self._send('report {}'.format(index))
+
+        self.assertEqual(3, len(self.server.messages))
+        self.assertEqual(1, self.server.connections)
+        mailfrom, rcpttos, data = self.server.messages[0]
+        self.assertEqual('reports@example.com', mailfrom)
+        self.assertEqual(['a@example.com', 'b@example.com'], rcpttos)
+        self.assertIn('Subject: report 0', data)
+
+    def test_reconnects_when_dropped(self):
+        self.server.drop = True
+        for index in range(3):
+            self._send('report {}'.format(index))
+
+        self.assertEqual(3, len(self.server.messages))
+        self.assertEqual(3, self.server.connections)
+
+
+class BackgroundMailerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _SmtpServer()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _mailer(self):
+        return BackgroundMailer(SmtpMailer(host='127.0.0.1', port=self.server.port, starttls=False, timeout=10))
+
+    def test_sends_in_the_background(self):
+        with self._mailer() as mailer:
+            mailer.send('reports@example.com', ['a@example.com'], 'one', '<p>one</p>')
+            mailer.send('reports@example.com', ['a@example.com'], 'two', '<p>two</p>')
+
+        self.assertEqual(0, mailer.failures)
+        self.assertEqual(2, len(self.server.messages))
+        self.assertEqual(1, self.server.connections)
+
+    def test_counts_failures(self):
+        self.server.reject = True
+        with self._mailer() as mailer:
+            mailer.send('reports@example.com', ['a@example.com'], 'one', '<p>one</p>')
+
+        self.assertEqual(1, mailer.failures)
+
+
+class OutputReportsTest(unittest.TestCase):
+    """A snapshot is only saved once its emails went out, so a change that
+    could not be mailed is mailed again next run"""
+
+    def setUp(self):
+        self.server = _SmtpServer()
+        self.directory = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self.directory, 'fleet.snapshot')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def _output_reports(self):
+        instances = [AWSInstance('i-1', datetime.utcnow() - timedelta(days=2), 'us-east-1', 'm4.large', 'key', 0.12,
+                                 {})]
+        for instance in instances:
+            instance.calculate_cost()
+        opts = Namespace(snapshot=self.snapshot, smtp_host='127.0.0.1', smtp_port=self.server.port,
+                         email_from='reports@example.com', email_password=None, email_to='a@example.com',
+                         smtp_no_starttls=True, email_background=True, top=None, export_out=None)
+        aws_reporter._output_reports(instances, [], aggregate(instances, []), ['Email'], opts)
+
+    def test_saves_snapshot_once_mailed(self):
+        self._output_reports()
+        self.assertEqual(1, len(self.server.messages))
+        self.assertTrue(os.path.exists(self.snapshot))
+
+    def test_keeps_snapshot_when_mail_fails(self):
+        self.server.reject = True
+        self._output_reports()
+        self.assertFalse(os.path.exists(self.snapshot))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from collections import OrderedDict
+from io import BytesIO
+import json
+import unittest
+
+from aws import offer
+from aws.offer import JsonStream, read_offer_file
+
+# every kind of token, with escapes, \u sequences, a surrogate pair and
+# raw UTF-8 that a small chunk size splits part way through
+DOCUMENT = b'''{
+  "plain" : "text",
+  "esc\\"aped \\\\ name" : "tab\\there \\"quoted\\" back\\\\slash\\/",
+  "unicode" : "caf\\u00e9 \\ud83d\\ude00 \\u0041",
+  "utf8" : "caf\xc3\xa9",
+  "numbers" : [0, -7, 1234567890123, 12.5, -0.001, 6.02e23, 1E-5, 2e+10],
+  "literals" : [true, false, null],
+  "nested" : {"a" : [1, {"b" : [[], {}]}, "x]}"], "c" : {}},
+  "last" : 99
+}'''
+
+
+def _stream(chunk_size, document=DOCUMENT):
+    return JsonStream(BytesIO(document), chunk_size=chunk_size)
+
+
+class JsonStreamTest(unittest.TestCase):
+    """Tokens must decode the same wherever the chunks split them"""
+
+    def test_values_match_json_loads(self):
+        expected = json.loads(DOCUMENT.decode('utf-8'))
+        for chunk_size in range(1, len(DOCUMENT) + 1):
+            stream = _stream(chunk_size)
+            decoded = dict((name, stream.value()) for name in stream.members())
+            self.assertEqual(expected, decoded, "chunk size {}".format(chunk_size))
+
+    def test_skip_nested_containers(self):
+        for chunk_size in range(1, len(DOCUMENT) + 1):
+            stream = _stream(chunk_size)
+            kept = {}
+            for name in stream.members():
+                if name in ('nested', 'numbers', 'literals', 'unicode'):
+                    stream.skip()
+                else:
+                    kept[name] = stream.value()
+            self.assertEqual(['esc"aped \\ name', 'last', 'plain', 'utf8'], sorted(kept),
+                             "chunk size {}".format(chunk_size))
+            self.assertEqual(99, kept['last'])
+
+    def test_members_of_nested_objects(self):
+        stream = _stream(3)
+        for name in stream.members():
+            if name != 'nested':
+                stream.skip()
+                continue
+            names = []
+            for inner in stream.members():
+                names.append(inner)
+                stream.skip()
+            self.assertEqual(['a', 'c'], names)
+
+    def test_number_at_end_of_document(self):
+        for chunk_size in range(1, 6):
+            self.assertEqual(12345, _stream(chunk_size, b'12345').value())
+
+    def test_truncated_document(self):
+        stream = _stream(4, b'{"a" : [1, 2')
+        with self.assertRaises(ValueError):
+            for _ in stream.members():
+                stream.skip()
+
+
+def _offer_file():
+    products = {}
+    terms = {}
+    rows = [('SKU1', 'Compute Instance', {'location': 'US East (N. Virginia)', 'instanceType': 'm4.large',
+                                          'operatingSystem': 'Linux', 'tenancy': 'Shared'}, 'Hrs', '0.1200000000'),
+            ('SKU2', 'Compute Instance', {'regionCode': 'eu-west-1', 'instanceType': 'm4.large',
+                                          'operatingSystem': 'Linux', 'tenancy': 'Shared',
+                                          'preInstalledSw': 'NA', 'capacitystatus': 'Used'}, 'Hrs', '0.1330000000'),
+            ('SKU3', 'Compute Instance', {'location': 'US East (N. Virginia)', 'instanceType': 'm4.large',
+                                          'operatingSystem': 'Windows', 'tenancy': 'Shared'}, 'Hrs', '0.2200000000'),
+            ('SKU4', 'Compute Instance', {'location': 'US East (N. Virginia)', 'instanceType': 'm4.large',
+                                          'operatingSystem': 'Linux', 'tenancy': 'Dedicated'}, 'Hrs', '0.1320000000'),
+            ('SKU5', 'Storage', {'location': 'US East (N. Virginia)', 'volumeApiName': 'gp2'}, 'GB-Mo', '0.10'),
+            ('SKU6', 'Storage', {'location': 'US East (N. Virginia)', 'volumeType': 'Provisioned IOPS'},
+             'GB-Mo', '0.125'),
+            ('SKU7', 'System Operation', {'location': 'US East (N. Virginia)', 'volumeApiName': 'io1'},
+             'IOPS-Mo', '0.065'),
+            ('SKU8', 'System Operation', {'location': 'US East (N. Virginia)', 'volumeApiName': 'standard'},
+             'IOs', '0.00000005'),
+            ('SKU9', 'Compute Instance', {'location': 'Nowhere', 'instanceType': 'm4.large',
+                                          'operatingSystem': 'Linux', 'tenancy': 'Shared'}, 'Hrs', '9.0')]
+
+    for sku, family, attributes, unit, price in rows:
+        products[sku] = {'sku': sku, 'productFamily': family, 'attributes': attributes}
+        dimension = {'unit': unit, 'pricePerUnit': {'USD': price}, 'description': u'caf\xe9 — "rate"'}
+        terms.setdefault('OnDemand', {})[sku] = {sku + '.JRTCKXETXF': {'priceDimensions': {sku + '.1': dimension}}}
+        reserved = dict(dimension, pricePerUnit={'USD': '0.0010000000'})
+        terms.setdefault('Reserved', {})[sku] = {sku + '.38NPMPTW36': {'priceDimensions': {sku + '.2': reserved}}}
+
+    # products come before terms, as in the offer files AWS publishes
+    document = OrderedDict([('formatVersion', 'v1.0'), ('offerCode', 'AmazonEC2'), ('products', products),
+                            ('terms', terms), ('attributesList', {'nested': [[1, 2], {'x': None}]})])
+    return json.dumps(document, indent=2).encode('utf-8')
+
+
+def _read_whole(document, operating_system='Linux', tenancy='Shared'):
+    # the same extraction from a document loaded in one go
+    instance_skus = {}
+    volume_skus = {}
+    for product in document['products'].values():
+        offer._add_product(product, operating_system, tenancy, instance_skus, volume_skus)
+
+    instance_prices = {}
+    volume_rates = {}
+    for sku, offers in document['terms']['OnDemand'].items():
+        for unit, price in offer._dimensions(offers):
+            if sku in instance_skus and unit == 'Hrs':
+                instance_prices[instance_skus[sku]] = price
+            elif sku in volume_skus and unit in offer.EBS_UNITS:
+                rate, multiplier = offer.EBS_UNITS[unit]
+                volume_rates.setdefault(volume_skus[sku], {})[rate] = price * multiplier
+    return instance_prices, volume_rates
+
+
+class ReadOfferFileTest(unittest.TestCase):
+
+    def test_matches_json_load(self):
+        content = _offer_file()
+        expected = _read_whole(json.load(BytesIO(content)))
+
+        for chunk_size in (1, 7, 64, 4096):
+            source = BytesIO(content)
+            stream_class = offer.JsonStream
+            offer.JsonStream = lambda source: stream_class(source, chunk_size=chunk_size)
+            try:
+                self.assertEqual(expected, read_offer_file(source), "chunk size {}".format(chunk_size))
+            finally:
+                offer.JsonStream = stream_class
+
+    def test_prices(self):
+        instance_prices, volume_rates = read_offer_file(BytesIO(_offer_file()))
+        self.assertEqual({('us-east-1', 'm4.large'): 0.12, ('eu-west-1', 'm4.large'): 0.133}, instance_prices)
+        self.assertEqual({('us-east-1', 'gp2'): {'perGBmoProvStorage': 0.1},
+                          ('us-east-1', 'io1'): {'perGBmoProvStorage': 0.125, 'perPIOPSreq': 0.065},
+                          ('us-east-1', 'standard'): {'perMMIOreq': 0.00000005 * 1000000}}, volume_rates)
+
+    def test_other_operating_system(self):
+        instance_prices, _ = read_offer_file(BytesIO(_offer_file()), operating_system='Windows')
+        self.assertEqual({('us-east-1', 'm4.large'): 0.22}, instance_prices)
+
+
+if __name__ == '__main__':
+    unittest.main()
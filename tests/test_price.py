@@ -0,0 +1,60 @@
+
+from __future__ import print_function
+
+from datetime import datetime
+import calendar
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from aws.cost import to_microseconds
+from aws.price import AWSPricingStore
+
+
+class PriceTimelineTest(unittest.TestCase):
+    """The current price file is the last point of every timeline"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = os.path.join(self.directory, 'history')
+        os.mkdir(self.history)
+        self._write(os.path.join(self.history, 'data.aws.ondemand.2015-06-01.json'), 0.14)
+        self._write(os.path.join(self.history, 'data.aws.ondemand.2016-01-01.json'), 0.10)
+        self.current = os.path.join(self.directory, 'data.aws.ondemand.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, path, price, modified=None):
+        with open(path, 'w') as data_file:
+            json.dump({'regions': [{'region': 'us-east-1',
+                                    'instanceTypes': [{'type': 'm4.large', 'price': price}]}]}, data_file)
+        if modified is not None:
+            timestamp = calendar.timegm(modified.timetuple())
+            os.utime(path, (timestamp, timestamp))
+
+    def _timeline(self):
+        store = AWSPricingStore(instance_price_file=self.current, ebs_price_file='data.aws.ebs.json',
+                                history_dir=self.history)
+        timeline = store.instance_price_timeline('us-east-1', 'm4.large')
+        return timeline and (list(timeline[0]), list(timeline[1]))
+
+    def test_current_price_from_when_the_file_changed(self):
+        self._write(self.current, 0.12, datetime(2016, 3, 1))
+        self.assertEqual(([to_microseconds(datetime(2015, 6, 1)), to_microseconds(datetime(2016, 1, 1)),
+                           to_microseconds(datetime(2016, 3, 1))], [0.14, 0.10, 0.12]), self._timeline())
+
+    def test_current_price_never_before_the_newest_history(self):
+        self._write(self.current, 0.12, datetime(2015, 3, 1))
+        self.assertEqual(([to_microseconds(datetime(2015, 6, 1)), to_microseconds(datetime(2016, 1, 1))],
+                          [0.14, 0.12]), self._timeline())
+
+    def test_unchanged_price_needs_no_timeline(self):
+        self._write(self.current, 0.14, datetime(2015, 3, 1))
+        self.assertEqual(None, self._timeline())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+
+from __future__ import print_function
+
+from datetime import datetime
+import json
+import os
+import tempfile
+import unittest
+
+from aws.aws import AWSInstance
+from aws_reporter import Whitelist
+
+
+def _instance(identifier='i-0123', keyname='deploy', instance_type='m4.large', tags=None):
+    return AWSInstance(identifier, datetime(2016, 1, 1), 'us-east-1', instance_type, keyname, 0.12, tags or {})
+
+
+class WhitelistTest(unittest.TestCase):
+
+    def _whitelist(self, *items):
+        handle, path = tempfile.mkstemp(suffix='.json')
+        try:
+            with os.fdopen(handle, 'w') as data_file:
+                json.dump({'items': list(items)}, data_file)
+            return Whitelist(path)
+        finally:
+            os.remove(path)
+
+    def test_exact_rules(self):
+        whitelist = self._whitelist({'identifier': 'i-1'}, {'instance_type': 't2.nano'},
+                                    {'tag': {'key': 'env', 'value': 'dev'}}, {'tag': {'key': 'ci'}})
+        self.assertFalse(whitelist.ok(_instance('i-1')))
+        self.assertFalse(whitelist.ok(_instance(instance_type='t2.nano')))
+        self.assertFalse(whitelist.ok(_instance(tags={'env': 'dev'})))
+        self.assertFalse(whitelist.ok(_instance(tags={'ci': 'anything'})))
+        self.assertTrue(whitelist.ok(_instance(tags={'env': 'prod'})))
+
+    def test_glob_matches_the_whole_value(self):
+        whitelist = self._whitelist({'pattern': 'i-0ab*'}, {'pattern': 'build-?', 'field': 'keyname'})
+        self.assertFalse(whitelist.ok(_instance('i-0abc')))
+        self.assertTrue(whitelist.ok(_instance('x-i-0abc')))
+        self.assertFalse(whitelist.ok(_instance(keyname='build-1')))
+        self.assertTrue(whitelist.ok(_instance(keyname='build-12')))
+
+    def test_regex_is_searched(self):
+        whitelist = self._whitelist({'regex': 'jenkins', 'field': 'keyname'}, {'regex': '^ci-', 'field': 'keyname'})
+        self.assertFalse(whitelist.ok(_instance(keyname='my-jenkins-key')))
+        self.assertFalse(whitelist.ok(_instance(keyname='ci-1')))
+        self.assertTrue(whitelist.ok(_instance(keyname='old-ci-1')))
+        self.assertTrue(whitelist.ok(_instance(keyname=None)))
+
+    def test_regex_backreference_and_inline_flags(self):
+        # each would mean something else combined with the rules before it
+        whitelist = self._whitelist({'pattern': 'i-0ab*'}, {'regex': '(a)b', 'field': 'keyname'},
+                                    {'regex': r'^(\w+)-\1$', 'field': 'keyname'},
+                                    {'regex': '(?i)^TEMP-', 'field': 'keyname'})
+        self.assertFalse(whitelist.ok(_instance(keyname='deploy-deploy')))
+        self.assertTrue(whitelist.ok(_instance(keyname='deploy-other')))
+        self.assertFalse(whitelist.ok(_instance(keyname='temp-box')))
+        self.assertTrue(whitelist.ok(_instance(keyname='AB')))
+
+    def test_invalid_regex(self):
+        with self.assertRaises(ValueError):
+            self._whitelist({'regex': '(unclosed', 'field': 'keyname'})
+
+
+if __name__ == '__main__':
+    unittest.main()